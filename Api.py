@@ -1,12 +1,14 @@
 from fastapi import FastAPI, Form
 from fastapi.middleware.cors import CORSMiddleware
 import main
-from main import optimize, read_data
+from main import new_relaxed_optimizer, new_session, optimize, read_data
+from module.core.ModelPredictiveControl import ModelPredictiveControl, shift_plan
+from module.core.RepresentativeDays import RepresentativeDays
+from module.core.TemporalDecomposition import TemporalDecomposition
 import datetime as dt
 import pandas as pd
 from settings.general_settings import GeneralSettings
 from time import time
-from copy import deepcopy
 from helpers.set_loggers import *
 
 
@@ -39,6 +41,88 @@ async def objective_function(selected_option: str = Form(...)):
     return objective_function
 
 
+def day_problem(df, init, degraded=0, degraded2=0):
+    """
+    Builds the inputs of a single day's run from GeneralSettings (all but the measured SoC of each BESS).
+    :param df: forecasts of the day
+    :type df: pandas.core.frame.DataFrame
+    :param init: datetime at the beginning of the day's horizon
+    :type init: datetime.datetime
+    :param degraded: energy degraded so far in the first BESS (kWh)
+    :type degraded: float
+    :param degraded2: energy degraded so far in the second BESS (kWh)
+    :type degraded2: float
+    :return: settings, bess_asset, bess_asset2, milp_params and forecasts of the day
+    :rtype: tuple
+    """
+    settings = {
+        'pccLimitValue': GeneralSettings.pcc_limit_value,
+        'addOnInv': GeneralSettings.add_on_inv,
+        'addOnSoc': GeneralSettings.add_on_soc,
+    }
+
+    bess_asset = {
+        'actualENom': GeneralSettings.bess_e_nom - degraded,
+        'chEff': GeneralSettings.bess_ch_eff,
+        'degCurve': GeneralSettings.bess_deg_curve,
+        'dischEff': GeneralSettings.bess_disch_eff,
+        'eNom': GeneralSettings.bess_e_nom,
+        'eolCriterion': GeneralSettings.bess_eol_criterion,
+        'invMaxIDC': GeneralSettings.bess_inv_max_idc,
+        'invSNom': GeneralSettings.bess_inv_s_nom,
+        'invVNom': GeneralSettings.bess_inv_v_nom,
+        'maxCCh': GeneralSettings.bess_max_c_ch,
+        'maxCDch': GeneralSettings.bess_max_c_disch,
+        'maxSoc': GeneralSettings.bess_max_soc,
+        'minPCh': GeneralSettings.bess_min_p_ch,
+        'minPDch': GeneralSettings.bess_min_p_disch,
+        'minSoc': GeneralSettings.bess_min_soc,
+        'reserveSoc': GeneralSettings.bess_reserve_soc,
+        'testData': GeneralSettings.bess_test_data,
+        'vNom': GeneralSettings.bess_v_nom,
+        'K1': GeneralSettings.k1,
+        'K2': GeneralSettings.k2,
+    }
+
+    bess_asset2 = {
+        'actualENom': GeneralSettings.bess_e_nom2 - degraded2,
+        'chEff': GeneralSettings.bess_ch_eff2,
+        'degCurve': GeneralSettings.bess_deg_curve2,
+        'dischEff': GeneralSettings.bess_disch_eff2,
+        'eNom': GeneralSettings.bess_e_nom2,
+        'eolCriterion': GeneralSettings.bess_eol_criterion2,
+        'invMaxIDC': GeneralSettings.bess_inv_max_idc2,
+        'invSNom': GeneralSettings.bess_inv_s_nom2,
+        'invVNom': GeneralSettings.bess_inv_v_nom2,
+        'maxCCh': GeneralSettings.bess_max_c_ch2,
+        'maxCDch': GeneralSettings.bess_max_c_disch2,
+        'maxSoc': GeneralSettings.bess_max_soc2,
+        'minPCh': GeneralSettings.bess_min_p_ch2,
+        'minPDch': GeneralSettings.bess_min_p_disch2,
+        'minSoc': GeneralSettings.bess_min_soc2,
+        'reserveSoc': GeneralSettings.bess_reserve_soc2,
+        'testData': GeneralSettings.bess_test_data2,
+        'vNom': GeneralSettings.bess_v_nom2,
+        'C1': GeneralSettings.C1,
+        'C2': GeneralSettings.C2,
+    }
+
+    milp_params = {
+        'mipgap': GeneralSettings.mipgap,
+        'timeout': GeneralSettings.timeout,
+        'init': init,
+        'horizon': GeneralSettings.horizon,
+        'step': GeneralSettings.step,
+    }
+
+    forecasts_and_other_arrays = {
+        'loadForecasts': df['load'].values,
+        'marketPrices': df['market'].values,
+    }
+
+    return settings, bess_asset, bess_asset2, milp_params, forecasts_and_other_arrays
+
+
 @app.post("/api/settings")
 async def settings(data: dict):
     selected_option = data.get("selected_option")
@@ -176,6 +260,11 @@ async def settings(data: dict):
     first_day = data_df.index[0]
     total_iter = len(GeneralSettings.all_days)
     iteration = 0
+    session = new_session() if GeneralSettings.persistent_session else None
+    incumbent = None
+    annual_outputs = None
+    day_results = None
+    controller = None
 
     for day in GeneralSettings.all_days:
         # Log the current iteration
@@ -201,75 +290,13 @@ async def settings(data: dict):
             degraded += main.degradation
             degraded2 += main.degradation2
             init += dt.timedelta(days=1)
-            main.last_soc /= (GeneralSettings.bess_e_nom - degraded) * 100
-            main.last_soc2 /= (GeneralSettings.bess_e_nom2 - degraded2) * 100
-            soc = main.last_soc
-            soc2 = main.last_soc2
+            soc = main.last_soc / (GeneralSettings.bess_e_nom - degraded) * 100
+            soc2 = main.last_soc2 / (GeneralSettings.bess_e_nom2 - degraded2) * 100
 
         before_init = init - dt.timedelta(hours=1)
 
-        settings = {
-            'pccLimitValue': GeneralSettings.pcc_limit_value,
-            'addOnInv': GeneralSettings.add_on_inv,
-            'addOnSoc': GeneralSettings.add_on_soc,
-        }
-
-        original_test_data = deepcopy(GeneralSettings.bess_test_data)
-        original_test_data2 = deepcopy(GeneralSettings.bess_test_data2)
-
-        bess_asset = {
-            'actualENom': GeneralSettings.bess_e_nom - degraded,
-            'chEff': GeneralSettings.bess_ch_eff,
-            'degCurve': GeneralSettings.bess_deg_curve,
-            'dischEff': GeneralSettings.bess_disch_eff,
-            'eNom': GeneralSettings.bess_e_nom,
-            'eolCriterion': GeneralSettings.bess_eol_criterion,
-            'invMaxIDC': GeneralSettings.bess_inv_max_idc,
-            'invSNom': GeneralSettings.bess_inv_s_nom,
-            'invVNom': GeneralSettings.bess_inv_v_nom,
-            'maxCCh': GeneralSettings.bess_max_c_ch,
-            'maxCDch': GeneralSettings.bess_max_c_disch,
-            'maxSoc': GeneralSettings.bess_max_soc,
-            'minPCh': GeneralSettings.bess_min_p_ch,
-            'minPDch': GeneralSettings.bess_min_p_disch,
-            'minSoc': GeneralSettings.bess_min_soc,
-            'reserveSoc': GeneralSettings.bess_reserve_soc,
-            'testData': GeneralSettings.bess_test_data,
-            'vNom': GeneralSettings.bess_v_nom,
-            'K1': GeneralSettings.k1,
-            'K2': GeneralSettings.k2,
-        }
-
-        bess_asset2 = {
-            'actualENom': GeneralSettings.bess_e_nom2 - degraded2,
-            'chEff': GeneralSettings.bess_ch_eff2,
-            'degCurve': GeneralSettings.bess_deg_curve2,
-            'dischEff': GeneralSettings.bess_disch_eff2,
-            'eNom': GeneralSettings.bess_e_nom2,
-            'eolCriterion': GeneralSettings.bess_eol_criterion2,
-            'invMaxIDC': GeneralSettings.bess_inv_max_idc2,
-            'invSNom': GeneralSettings.bess_inv_s_nom2,
-            'invVNom': GeneralSettings.bess_inv_v_nom2,
-            'maxCCh': GeneralSettings.bess_max_c_ch2,
-            'maxCDch': GeneralSettings.bess_max_c_disch2,
-            'maxSoc': GeneralSettings.bess_max_soc2,
-            'minPCh': GeneralSettings.bess_min_p_ch2,
-            'minPDch': GeneralSettings.bess_min_p_disch2,
-            'minSoc': GeneralSettings.bess_min_soc2,
-            'reserveSoc': GeneralSettings.bess_reserve_soc2,
-            'testData': original_test_data2,
-            'vNom': GeneralSettings.bess_v_nom2,
-            'C1': GeneralSettings.C1,
-            'C2': GeneralSettings.C2,
-        }
-
-        milp_params = {
-            'mipgap': GeneralSettings.mipgap,
-            'timeout': GeneralSettings.timeout,
-            'init': init,
-            'horizon': GeneralSettings.horizon,
-            'step': GeneralSettings.step,
-        }
+        settings, bess_asset, bess_asset2, milp_params, forecasts_and_other_arrays = \
+            day_problem(df, init, degraded, degraded2)
 
         measures = {
             'bessSoC': soc,
@@ -279,19 +306,99 @@ async def settings(data: dict):
             'bessSoC': soc2,
         }
 
-        forecasts_and_other_arrays = {
-            'loadForecasts': df['load'].values,
-            'marketPrices': df['market'].values,
-        }
-
         t0 = time()
-        prob_obj = optimize(settings, bess_asset, bess_asset2, milp_params, measures, measures2,
-                            forecasts_and_other_arrays, objective_function)
-        t1 = time() - t0
-
-        # Get the needed outputs
-        outputs = prob_obj.outputs
-        outputs.pop('milpStatus')
+        if GeneralSettings.annual_lp:
+            # A single LP covering all days is solved on the first day and then split back into days
+            if annual_outputs is None:
+                last_annual_dt = first_day + dt.timedelta(days=GeneralSettings.all_days[-1]) + \
+                    dt.timedelta(hours=GeneralSettings.horizon) - \
+                    dt.timedelta(minutes=GeneralSettings.step)
+                annual_df = data_df.loc[first_dt:last_annual_dt, :]
+                annual_params = dict(milp_params, horizon=len(annual_df) * GeneralSettings.step / 60)
+                annual_forecasts = {
+                    'loadForecasts': annual_df['load'].values,
+                    'marketPrices': annual_df['market'].values,
+                }
+                prob_obj = optimize(settings, bess_asset, bess_asset2, annual_params, measures, measures2,
+                                    annual_forecasts, objective_function, new_relaxed_optimizer())
+                annual_outputs = prob_obj.split_outputs(int(24 * 60 / GeneralSettings.step))
+            outputs = dict(annual_outputs[day - GeneralSettings.all_days[0]])
+            status, status_real, common_fname = prob_obj.stat, prob_obj.status_real, prob_obj.common_fname
+            t1 = time() - t0
+        elif GeneralSettings.representative_days > 0 or GeneralSettings.parallel_days > 1:
+            # All days are solved on the first day (only the representative ones, or by blocks of days in
+            # parallel), then consumed one at a time
+            if day_results is None:
+                problems = []
+                for i, other_day in enumerate(GeneralSettings.all_days):
+                    other_dt = first_day + dt.timedelta(days=other_day)
+                    other_df = data_df.loc[other_dt:other_dt + dt.timedelta(hours=GeneralSettings.horizon) -
+                                           dt.timedelta(minutes=GeneralSettings.step), :]
+                    problems.append(day_problem(other_df, init + dt.timedelta(days=i)))
+                if GeneralSettings.representative_days > 0:
+                    decomposition = RepresentativeDays(optimize, objective_function,
+                                                       GeneralSettings.representative_days)
+                else:
+                    decomposition = TemporalDecomposition(optimize, objective_function, GeneralSettings.parallel_days)
+                day_results = decomposition.run(problems, (soc, soc2, degraded, degraded2))
+            result = day_results[iteration - 1]
+            outputs = dict(result['outputs'])
+            status, status_real, common_fname = result['stat'], result['status_real'], result['common_fname']
+            t1 = result['time']
+        elif GeneralSettings.mpc:
+            # Closed-loop intraday control: the plan over a receding horizon is updated at every step, from the SoC
+            # reached, and only its first step is committed
+            if controller is None:
+                controller = ModelPredictiveControl(optimize, objective_function, new_session())
+            committed = []
+            step_soc, step_soc2 = soc, soc2
+            for k in range(int(24 * 60 / GeneralSettings.step)):
+                step_dt = first_dt + dt.timedelta(minutes=k * GeneralSettings.step)
+                window_df = data_df.loc[step_dt:step_dt + dt.timedelta(hours=GeneralSettings.horizon) -
+                                        dt.timedelta(minutes=GeneralSettings.step), :]
+                if window_df.empty:
+                    break
+                settings, bess_asset, bess_asset2, milp_params, forecasts_and_other_arrays = \
+                    day_problem(window_df, init + dt.timedelta(minutes=k * GeneralSettings.step), degraded, degraded2)
+                milp_params['horizon'] = len(window_df) * GeneralSettings.step / 60
+                prob_obj = controller.replan(settings, bess_asset, bess_asset2, milp_params, {'bessSoC': step_soc},
+                                             {'bessSoC': step_soc2}, forecasts_and_other_arrays)
+                if not prob_obj.outputs:
+                    break
+                committed.append(prob_obj.outputs)
+                step_soc = prob_obj.outputs['eBess'][0]['setpoint'] / (GeneralSettings.bess_e_nom - degraded) * 100
+                step_soc2 = prob_obj.outputs['eBess2'][0]['setpoint'] / (GeneralSettings.bess_e_nom2 - degraded2) * 100
+            outputs = {key: [plan[key][0] for plan in committed] for key, val in committed[0].items()
+                       if isinstance(val, list)} if committed else {}
+            status, status_real, common_fname = prob_obj.stat, prob_obj.status_real, prob_obj.common_fname
+            t1 = time() - t0
+            logger.info(f' - MPC: {len(committed)} steps committed ({max(controller.times):.3f}s per re-plan at most, '
+                        f'{controller.skipped} plans kept without solving)')
+        else:
+            committed_steps = int(GeneralSettings.horizon * 60 / GeneralSettings.step)
+            if GeneralSettings.look_ahead > 0:
+                # The window also covers the next look_ahead hours, but only its first horizon hours are committed
+                window_df = data_df.loc[first_dt:last_dt + dt.timedelta(hours=GeneralSettings.look_ahead), :]
+                settings, bess_asset, bess_asset2, milp_params, forecasts_and_other_arrays = \
+                    day_problem(window_df, init, degraded, degraded2)
+                milp_params['horizon'] = len(window_df) * GeneralSettings.step / 60
+            prob_obj = optimize(settings, bess_asset, bess_asset2, milp_params, measures, measures2,
+                                forecasts_and_other_arrays, objective_function, session, incumbent)
+            outputs = dict(prob_obj.split_outputs(committed_steps)[0]) if prob_obj.outputs else {}
+            status, status_real, common_fname = prob_obj.stat, prob_obj.status_real, prob_obj.common_fname
+            t1 = time() - t0
+
+            # The current solution becomes the next day's MIP start (with a look-ahead, its non-committed tail),
+            # unless the most similar day solved is used instead
+            incumbent = None
+            if GeneralSettings.warm_start and prob_obj.varis:
+                if GeneralSettings.look_ahead > 0:
+                    incumbent = shift_plan(prob_obj.varis, committed_steps)
+                elif not GeneralSettings.similarity_index:
+                    incumbent = prob_obj.varis
+
+        # Get the needed outputs (only the time series; e.g. milpStatus and optimalityGap are single values)
+        outputs = {key: val for key, val in outputs.items() if isinstance(val, list)}
 
         # -- get a single dataframe from all outputs
         col_names = outputs.keys()
@@ -308,14 +415,13 @@ async def settings(data: dict):
         #     main.daily_outputs = df
         main.daily_outputs = df
 
-        status = prob_obj.stat
         logger.warning(f'{status}')
         main.expected_revenues = pd.DataFrame(
             outputs.get('expectRevs')).sum().get('setpoint')
         main.last_soc = pd.DataFrame(outputs['eBess']
-                                     ).loc[prob_obj.time_intervals - 1, 'setpoint']
+                                     ).loc[len(outputs['eBess']) - 1, 'setpoint']
         main.last_soc2 = pd.DataFrame(outputs['eBess2']
-                                      ).loc[prob_obj.time_intervals - 1, 'setpoint']
+                                      ).loc[len(outputs['eBess2']) - 1, 'setpoint']
         main.degradation = pd.DataFrame(outputs['eDeg']).sum().get('setpoint')
         main.degradation2 = pd.DataFrame(
             outputs['eDeg2']).sum().get('setpoint')
@@ -325,13 +431,6 @@ async def settings(data: dict):
         main.first_dt_text = dt.datetime.strftime(
             first_dt, '%Y-%m-%d %H:%M:%S')
 
-        with open(f'{prob_obj.common_fname}-pulp.sol', newline='\n') as csvfile:
-            init_text = csvfile.read(50)
-            status_real = init_text.split(sep=' - ')[0]
-
-        # Clean unnecessary files from "core" folder
-        prob_obj.final_folder_cleaning()
-
         main.final_outputs['date'].append(main.first_dt_text)
         main.final_outputs['status'].append(status)
         main.final_outputs['status_real'].append(status_real)
@@ -350,9 +449,9 @@ async def settings(data: dict):
     # TODO: create a folder for the outputs if non existent
     # dir = os.path.join(ROOT_PATH, 'outputs')
 
-    main.daily_outputs.to_csv(rf'outputs/{prob_obj.common_fname}_setpoints.csv',
+    main.daily_outputs.to_csv(rf'outputs/{common_fname}_setpoints.csv',
                               sep=';', decimal=',', index=True)
-    pd.DataFrame(main.final_outputs).to_csv(rf'outputs/{prob_obj.common_fname}_main_outputs.csv',
+    pd.DataFrame(main.final_outputs).to_csv(rf'outputs/{common_fname}_main_outputs.csv',
                                             sep=';', decimal=',', index=True)
 
     # Remove the log file handler
@@ -366,5 +465,11 @@ async def get_data_for_chart():
     technology2 = GeneralSettings.technology2
     return main.daily_outputs['Merge'], main.daily_outputs['Merge2'], main.final_outputs, technology, technology2
 
+
+@app.get("/api/cache_metrics")
+async def cache_metrics():
+    cache = main.get_result_cache()
+    return cache.metrics() if cache is not None else {}
+
 # if __name__ == "__main__":
 #     uvicorn.run(app, host="127.0.0.1", port=8000)
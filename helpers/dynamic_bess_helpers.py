@@ -66,7 +66,7 @@ def c_rate_limits(max_c_rate, nom_capacity, inv_max_idc):
 def average_c_rates_dups(bess_test_data, key2test_value):
 	"""
 	Function to convert test data into a pandas.core.frame.DataFrame and average equal c-rates tested per test set
-	:param bess_test_data: "testData structure of a BESS asset configured
+	:param bess_test_data: "testData structure of a BESS asset configured (left unchanged)
 	:type bess_test_data: dict
 	:param key2test_value: checkup dictionary relating the keys of a test set structure and the corresponding value key
 	:type key2test_value: dict of string
@@ -76,13 +76,15 @@ def average_c_rates_dups(bess_test_data, key2test_value):
 	# For each test set available:
 	# 1) Convert list values with structure {'cRate': float, 'value_name': float, 'trial': float} to dataframe
 	# 2) Average equal c-rates
+	tests_dups_avg = dict()
 	for key, values in bess_test_data.items():
-		if key in ['addOnSoc', 'betterEffApprox', 'roundEffApprox']:
+		if key in ['addOnSoc', 'betterEffApprox', 'roundEffApprox', 'effSegments']:
+			tests_dups_avg[key] = values
 			continue
 
-		bess_test_data[key] = pd.DataFrame(values).groupby('cRate', as_index=False)[key2test_value.get(key)].mean()
+		tests_dups_avg[key] = pd.DataFrame(values).groupby('cRate', as_index=False)[key2test_value.get(key)].mean()
 
-	return bess_test_data
+	return tests_dups_avg
 
 
 def power_rate_limits(nom_cap, max_c_rate, data, action):
@@ -190,9 +192,63 @@ def efficiencies(df, cut_value, constant_eff):
 
 	if df.get('x').min() < cut_value:
 		sub_df = df.loc[df.get('x') < cut_value]
-		sub_df.append({sub_df.columns[0]: cut_value, sub_df.columns[1]: constant_eff*cut_value}, ignore_index=True)
 		slope, origin = linearize(sub_df, x_col='x', y_col='y')
 	else:
 		slope, origin = constant_eff, 0.0
 
 	return slope, origin
+
+
+def segment_efficiencies(df, cut_value, constant_eff, nr_segments):
+	"""
+	Splits the power rates below the cut-value into "nr_segments" segments of equal width and returns the line
+	parameters for calculating the (dis)charge efficiency in each one of them, as in "efficiencies". Segments without
+	tested power rates are given the constant efficiency value provided.
+	:param df: dataframe with the power rates and the corresponding measured values
+	:type df: pandas.core.frame.DataFrame
+	:param cut_value: power rate after which the efficiency is considered constant
+	:type cut_value: float
+	:param constant_eff: constant efficiency value to be considered
+	:type constant_eff: float
+	:param nr_segments: number of segments before the cut-value
+	:type nr_segments: int
+	:return: lower and upper power rates, slope and origin of each segment
+	:rtype: list of (float, float, float, float)
+	"""
+	boundaries = np.linspace(0.0, cut_value, nr_segments + 1)
+	segments = []
+	for low, high in zip(boundaries[:-1], boundaries[1:]):
+		sub_df = df.loc[df.get('x') >= low] if low > 0 else df
+		slope, origin = efficiencies(sub_df, high, constant_eff)
+		segments.append((low, high, slope, origin))
+
+	return segments
+
+
+def is_convex_curve(segments, concave=False, tol=1e-6):
+	"""
+	Checks if the piecewise linear curve defined by a list of segments starts at the origin (x=0, y=0), is continuous
+	and convex (or concave), in which case it can be modelled as the sum of its segments, without binary variables,
+	whenever filling the segments out of order is not advantageous.
+	:param segments: lower and upper x values, slope and origin of each segment, in increasing x order
+	:type segments: list of (float, float, float, float)
+	:param concave: if True, checks if the curve is concave instead
+	:type concave: bool
+	:param tol: absolute tolerance of the checks
+	:type tol: float
+	:return: True if the curve is convex (concave)
+	:rtype: bool
+	"""
+	low, _, slope, origin = segments[0]
+	if abs(low) > tol or abs(origin) > tol:
+		return False
+
+	for (_, high, slope, origin), (next_low, _, next_slope, next_origin) in zip(segments[:-1], segments[1:]):
+		if abs(next_low - high) > tol or abs(slope * high + origin - next_slope * next_low - next_origin) > tol:
+			return False
+
+	slope_increments = np.diff([segment[2] for segment in segments])
+	if concave:
+		slope_increments = -slope_increments
+
+	return bool(np.all(slope_increments >= -tol))
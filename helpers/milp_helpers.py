@@ -29,3 +29,15 @@ def create_strftime_list(horizon, step, init):
 	iso_8601_format = "%Y-%m-%dT%H:%M:%SZ"
 
 	return [dt.strftime(iso_8601_format) for dt in dt_list]
+
+
+def unit_suffix(unit):
+	"""
+	Returns the suffix of the variables' names and outputs' keys of a BESS of the fleet: none for the first BESS and
+	its position (counting from 1) for the others, e.g. "p_ch", "p_ch2", "p_ch3".
+	:param unit: position of the BESS in the fleet, counting from 0
+	:type unit: int
+	:return: suffix of the BESS's names
+	:rtype: str
+	"""
+	return '' if unit == 0 else str(unit + 1)
@@ -0,0 +1,266 @@
+import numpy as np
+import re
+
+from loguru import logger
+
+# Fractions of the desired set point tried, in decreasing order, until a feasible one is found
+set_point_fractions = np.linspace(1.0, 0.0, 21)
+# Tolerance used when checking the incumbent against the problem's limits
+feasibility_tol = 1e-7
+# Blocks of variables of each BESS, named "<block><suffix of the BESS>"
+unit_blocks = ('e_bess', 'e_deg', 'min_e_bes', 'max_e_bes', 'p_ch', 'p_disch', 'delta_bess', 'z_ch', 'z_disch',
+               'delta_bess_ch', 'delta_bess_disch')
+
+
+def repair_incumbent(varis, optimizer):
+	"""
+	Builds a MIP start for the problem defined in "optimizer" from a previous solution (e.g. the previous day's
+	"varis"), shifted to the new optimization horizon. The charge/discharge set points of each BESS are kept whenever
+	possible and scaled down, time step by time step, until they respect the new initial energy content, the BESS
+	limits and the PCC limit. Binaries, energy contents, degradation and PCC flows are then recomputed from those set
+	points, so the incumbent is consistent with the new problem.
+	:param varis: dictionary with the values of the decision variables of a previous solution
+	:type varis: dict
+	:param optimizer: optimizer already initialized with the new inputs
+	:type optimizer: module.core.Optimizer.Optimizer
+	:return: dictionary with the same structure as "varis", or None if no feasible incumbent was found
+	:rtype: dict
+	"""
+	T = optimizer.time_intervals
+	dt = optimizer.durations
+	load = np.asarray(optimizer.load_forecasts, dtype=float)[:T]
+	pcc_limit = optimizer.pcc_limit_value
+
+	# With all BESS idle, the PCC must be able to supply the load by itself
+	if np.any(load < -feasibility_tol) or np.any(load > pcc_limit + feasibility_tol):
+		logger.debug(' - warm start: load outside PCC limits; no incumbent')
+		return None
+
+	units = tuple(zip(optimizer.fleet, optimizer.suffixes))
+	desired = {sfx: _shifted_net_power(varis, sfx, T) for _, sfx in units}
+	if any(d is None for d in desired.values()):
+		logger.debug(' - warm start: previous solution has no set points; no incumbent')
+		return None
+
+	schedule = {sfx: [] for _, sfx in units}
+	e_content = {sfx: bess.initial_e_bess for bess, sfx in units}
+	for t in range(T):
+		p_abs = load[t]
+		for bess, sfx in units:
+			for fraction in set_point_fractions:
+				step = _unit_step(bess, desired[sfx][t] * fraction, e_content[sfx], dt[t], optimizer)
+				if step is not None and -feasibility_tol <= p_abs + step['p'] <= pcc_limit + feasibility_tol:
+					break
+			else:
+				logger.debug(f' - warm start: no feasible set point for BESS{sfx} at step {t}; no incumbent')
+				return None
+			p_abs += step['p']
+			e_content[sfx] = step['e_bess']
+			schedule[sfx].append(step)
+
+	return _build_incumbent(schedule, load, optimizer)
+
+
+def flatten_incumbent(incumbent):
+	"""
+	Flattens an incumbent with the structure of "varis" into one array per block of variables, named as the blocks
+	of the sparse model (segment variables as "<name>_<segment>").
+	:param incumbent: dictionary with the same structure as "varis"
+	:type incumbent: dict
+	:return: dictionary of variable block name -> values
+	:rtype: dict
+	"""
+	flat = dict()
+	for name, values in incumbent.items():
+		if isinstance(values, dict):
+			for s, seg_values in values.items():
+				flat[f'{name}_{s}'] = np.asarray(seg_values, dtype=float)
+		else:
+			flat[name] = np.asarray(values, dtype=float)
+
+	return flat
+
+
+def unflatten_values(flat):
+	"""
+	Inverse of flatten_incumbent: groups the blocks of segment variables ("<name>_<segment>") into dictionaries, so
+	the values follow the structure of "varis".
+	:param flat: dictionary of variable block name -> values
+	:type flat: dict
+	:return: dictionary with the same structure as "varis"
+	:rtype: dict
+	"""
+	values = dict()
+	for name, block_values in flat.items():
+		segment = re.fullmatch(r'(.+)_(\d+)', name)
+		if segment:
+			values.setdefault(segment.group(1), dict())[int(segment.group(2))] = list(block_values)
+		else:
+			values[name] = list(block_values)
+
+	return values
+
+
+def order_identical_units(incumbent, pairs):
+	"""
+	Swaps the variables of interchangeable BESS in an incumbent until, in each pair, the first BESS discharges at least
+	as much energy as the second, to satisfy the symmetry-breaking constraints added for those pairs.
+	:param incumbent: dictionary with the same structure as "varis"
+	:type incumbent: dict
+	:param pairs: suffixes of the variables' names of each pair of consecutive interchangeable BESS
+	:type pairs: list of tuple
+	:return: the incumbent, with the BESS of each pair ordered by total discharge
+	:rtype: dict
+	"""
+	def discharge(values, sfx):
+		return sum(np.sum(v) for v in flatten_incumbent({'p': values[f'p_disch{sfx}']}).values())
+
+	ordered = dict(incumbent)
+	# Consecutive pairs form chains of interchangeable BESS, sorted by as many passes as there are pairs
+	for _ in pairs:
+		for first, second in pairs:
+			if discharge(ordered, second) > discharge(ordered, first):
+				for name in unit_blocks:
+					if f'{name}{first}' in ordered:
+						ordered[f'{name}{first}'], ordered[f'{name}{second}'] = \
+							ordered[f'{name}{second}'], ordered[f'{name}{first}']
+
+	return ordered
+
+
+def _shifted_net_power(varis, sfx, T):
+	"""
+	Returns the net AC power (charge positive) of a BESS in a previous solution, shifted to the new horizon: the
+	previous schedule is repeated from its first time step and truncated (or repeated) to T time steps.
+	:return: array of T net power set points, or None if unavailable
+	:rtype: numpy.ndarray
+	"""
+	p_ch = varis.get(f'p_ch{sfx}')
+	p_disch = varis.get(f'p_disch{sfx}')
+	if p_ch is None or p_disch is None:
+		return None
+
+	# Segment variables (add_on_inv) are summed to obtain a single set point per time step
+	if isinstance(p_ch, dict):
+		p_ch = np.sum([np.asarray(v, dtype=float) for v in p_ch.values()], axis=0)
+		p_disch = np.sum([np.asarray(v, dtype=float) for v in p_disch.values()], axis=0)
+	net = np.nan_to_num(np.asarray(p_ch, dtype=float) - np.asarray(p_disch, dtype=float))
+	if not net.size:
+		return None
+
+	return np.resize(net, T)
+
+
+def _unit_step(bess, p, e_prev, dt, optimizer):
+	"""
+	Computes all variables of one BESS in one time step for a given net AC set point (charge positive).
+	:return: dictionary with the BESS variables, or None if the set point is not feasible
+	:rtype: dict
+	"""
+	p_ch, p_disch = max(p, 0.0), max(-p, 0.0)
+	if p_ch > bess.p_ac_max_c or p_disch > bess.p_ac_max_d:
+		return None
+
+	step = dict(p=p, p_ch=p_ch, p_disch=p_disch)
+	if not optimizer.add_on_inv:
+		bes_charge = p_ch * bess.const_eff_ch
+		bes_discharge = p_disch / bess.const_eff_disch
+	else:
+		seg_ch = _segment_powers(p_ch, bess.eff_segments_ch, bess.convex_eff)
+		seg_disch = _segment_powers(p_disch, bess.eff_segments_disch, bess.convex_eff)
+		if seg_ch is None or seg_disch is None:
+			return None
+		seg_p_ch, active_ch, z_ch, bes_charge = seg_ch
+		seg_p_disch, active_disch, z_disch, bes_discharge = seg_disch
+		step.update(seg_p_ch=seg_p_ch, seg_p_disch=seg_p_disch, active_ch=active_ch, active_disch=active_disch,
+		            z_ch=z_ch, z_disch=z_disch)
+
+	if bes_charge > bess.p_dc_max_c + feasibility_tol or bes_discharge > bess.p_dc_max_d + feasibility_tol:
+		return None
+
+	e_bess = e_prev + (bes_charge - bes_discharge) * dt
+	if optimizer.add_on_soc:
+		min_e_bes = bess.discharge_slope / bess.v_nom_discharge * bes_charge + bess.discharge_origin
+		max_e_bes = bess.charge_slope / bess.v_nom_charge * bes_discharge + bess.charge_origin
+	else:
+		min_e_bes = bess.min_e_bess
+		max_e_bes = bess.max_e_bess
+	if min(e_bess, min_e_bes, max_e_bes) < -feasibility_tol or not \
+			min_e_bes - feasibility_tol <= e_bess <= max_e_bes + feasibility_tol:
+		return None
+
+	step.update(e_bess=max(e_bess, 0.0), min_e_bes=max(min_e_bes, 0.0), max_e_bes=max(max_e_bes, 0.0),
+	            e_deg=bess.deg_slope * bes_discharge * dt)
+
+	return step
+
+
+def _segment_powers(p, segments, convex):
+	"""
+	Splits an AC set point among the segments of the piecewise linearization of an efficiency curve: filled in order
+	for convex curves, or fully assigned to the segment whose power limits contain it otherwise.
+	:return: AC power and activation of each segment, DC power of all but the last segment and total DC power, or
+	None if the set point is not feasible
+	:rtype: (list, list, float, float)
+	"""
+	powers = [0.0] * len(segments)
+	active = [0.0] * len(segments)
+	if p <= 0:
+		return powers, active, 0.0, 0.0
+
+	if convex:
+		if p > segments[-1][1] + feasibility_tol:
+			return None
+		for s, (low, high, _, _) in enumerate(segments):
+			powers[s] = min(max(p - low, 0.0), high - low)
+		dc_powers = [slope * powers[s] for s, (_, _, slope, _) in enumerate(segments)]
+	else:
+		for s, (low, high, _, _) in enumerate(segments):
+			if low - feasibility_tol <= p <= high + feasibility_tol:
+				break
+		else:
+			return None
+		powers[s], active[s] = p, 1.0
+		dc_powers = [0.0] * len(segments)
+		dc_powers[s] = segments[s][2] * p + segments[s][3]
+		if dc_powers[s] < -feasibility_tol:
+			return None
+
+	return powers, active, max(sum(dc_powers[:-1]), 0.0), sum(dc_powers)
+
+
+def _build_incumbent(schedule, load, optimizer):
+	"""
+	Converts the per time step schedule of each BESS into a dictionary with the same structure as "varis".
+	:rtype: dict
+	"""
+	T = optimizer.time_intervals
+	units = dict(zip(optimizer.suffixes, optimizer.fleet))
+	incumbent = dict()
+
+	p_abs = load.copy()
+	for sfx, steps in schedule.items():
+		p_abs += [step['p'] for step in steps]
+		for name in ('e_bess', 'e_deg', 'min_e_bes', 'max_e_bes'):
+			incumbent[f'{name}{sfx}'] = [step[name] for step in steps]
+
+		if not optimizer.add_on_inv:
+			incumbent[f'p_ch{sfx}'] = [step['p_ch'] for step in steps]
+			incumbent[f'p_disch{sfx}'] = [step['p_disch'] for step in steps]
+			incumbent[f'delta_bess{sfx}'] = [float(step['p_ch'] > 0) for step in steps]
+		else:
+			incumbent[f'z_ch{sfx}'] = [step['z_ch'] for step in steps]
+			incumbent[f'z_disch{sfx}'] = [step['z_disch'] for step in steps]
+			for name in ('p_ch', 'p_disch'):
+				S = range(len(getattr(units[sfx], f'eff_segments_{name[2:]}')))
+				incumbent[f'{name}{sfx}'] = {s: [step[f'seg_{name}'][s] for step in steps] for s in S}
+				if not units[sfx].convex_eff:
+					incumbent[f'delta_bess_{name[2:]}{sfx}'] = {s: [step[f'active_{name[2:]}'][s] for step in steps]
+					                                            for s in S}
+			if units[sfx].convex_eff:
+				incumbent[f'delta_bess{sfx}'] = [float(step['p_ch'] > 0) for step in steps]
+
+	incumbent['p_abs'] = list(np.maximum(p_abs, 0.0))
+	incumbent['delta_pcc'] = [1.0] * T
+
+	return incumbent
@@ -1,6 +1,9 @@
 import pandas as pd
 from helpers.set_loggers import *
 from module.core.Optimizer import Optimizer
+from module.core.ResultCache import ResultCache
+from module.core.SimilarityIndex import SimilarityIndex
+from module.tasks.BESS import key_asset
 from settings.general_settings import GeneralSettings
 from time import time
 
@@ -40,7 +43,114 @@ def read_data(step, table_data):
 
 	return data
 
-def optimize(_settings, _assets, _assets2, _milp_params, _measures, _measures2, _forecasts, a):
+# Arguments of the optimizer -> settings that set them (not passed in the inputs), which change the results of a run
+optimizer_settings = dict(solver='solver', heuristic='heuristic', reduce_model='model_reduction',
+                          scale_model='model_scaling', portfolio='portfolio', dp_resolution='dp_resolution',
+                          decompose_units='unit_decomposition', aggregate_fleet='fleet_aggregation',
+                          aggregation_tol='aggregation_tol', merge_steps='merge_steps', fine_hours='fine_hours',
+                          coarse_step='coarse_step')
+
+def new_optimizer(**options):
+	"""
+	Creates an optimizer configured from the settings (see optimizer_settings).
+	:param options: arguments of the optimizer that override the settings or are not set by them (e.g. persistent)
+	:type options: dict
+	:return: the optimizer
+	:rtype: module.core.Optimizer.Optimizer
+	"""
+	arguments = dict(plot=GeneralSettings.plot, write_artifacts=GeneralSettings.write_artifacts,
+	                 **{argument: getattr(GeneralSettings, name) for argument, name in optimizer_settings.items()})
+	arguments.update(options)
+
+	return Optimizer(**arguments)
+
+def get_result_cache():
+	"""
+	Gets the cache of results shared by all runs, created on first use from the settings.
+	:return: the cache, or None if result_cache is off
+	:rtype: module.core.ResultCache.ResultCache
+	"""
+	global result_cache
+	if not GeneralSettings.result_cache:
+		return None
+	if result_cache is None:
+		result_cache = ResultCache(GeneralSettings.cache_size, GeneralSettings.cache_path)
+
+	return result_cache
+
+def cached_run(problem, *inputs):
+	"""
+	Looks up the result of a run with the same inputs and optimizer options (see Optimizer.options) and, if found,
+	loads it into the optimizer (so it is used as if it had been solved).
+	:param problem: optimizer of the run
+	:type problem: module.core.Optimizer.Optimizer
+	:param inputs: all inputs of the run that change its result (not the session nor the MIP start)
+	:type inputs: tuple
+	:return: key of the run (None if result_cache is off) and whether the result was found
+	:rtype: (str, bool)
+	"""
+	cache = get_result_cache()
+	if cache is None:
+		return None, False
+
+	key, result = cache.lookup(*inputs, problem.options())
+	if result is None:
+		return key, False
+	for name, value in result.items():
+		setattr(problem, name, value)
+
+	return key, True
+
+def cache_run(problem, key):
+	"""
+	Stores the result of a solved run under its key (see cached_run); runs without a solution are not stored.
+	:return: None
+	:rtype: None
+	"""
+	if key is not None and problem.opt_val is not None:
+		get_result_cache().put(key, dict(outputs=problem.outputs, stat=problem.stat, status_real=problem.status_real,
+		                                 opt_val=problem.opt_val, varis=problem.varis))
+
+def get_similarity_index():
+	"""
+	Gets the index of the schedules of past runs shared by all runs, created on first use from the settings.
+	:return: the index, or None if similarity_index is off
+	:rtype: module.core.SimilarityIndex.SimilarityIndex
+	"""
+	global similarity_index
+	if not GeneralSettings.similarity_index:
+		return None
+	if similarity_index is None:
+		similarity_index = SimilarityIndex(GeneralSettings.index_size)
+
+	return similarity_index
+
+def new_session():
+	"""
+	Creates an optimizer to be kept alive across the rolling day loop: the model structure is built on the first run
+	and only the changed coefficients and right-hand sides are updated in the following ones.
+	:return: optimizer to be passed to "optimize" as _session
+	:rtype: module.core.Optimizer.Optimizer
+	"""
+	session = new_optimizer(persistent=True)
+	# Only the sparse (HiGHS) model is kept; the PuLP model and the DP/THRESHOLD engines are rebuilt on every run
+	if session.solv != 'HIGHS' and not session.portfolio:
+		logger.warning(f'The persistent session has no effect with the {session.solv} solver (only with HIGHS)')
+
+	return session
+
+def new_relaxed_optimizer():
+	"""
+	Creates an optimizer that relaxes the binaries and solves a single sparse LP with HiGHS, meant for horizons that
+	cover all days of an annual study at once (the energy content is then chained across midnight within the model).
+	:return: optimizer to be passed to "optimize" as _session
+	:rtype: module.core.Optimizer.Optimizer
+	"""
+	return new_optimizer(solver='HIGHS', relaxed=True, heuristic=None, portfolio=None, decompose_units=False,
+	                     aggregate_fleet=False, fine_hours=None)
+
+def optimize(_settings, _assets, _assets2, _milp_params, _measures, _measures2, _forecasts, a, _session=None,
+             _incumbent=None):
 	"""
 	Main optimization orchestrator.
 	:param _settings:
@@ -50,13 +160,33 @@ def optimize(_settings, _assets, _assets2, _milp_params, _measures, _measures2,
 	:param _measures:
 	:param _measures2:
 	:param _forecasts:
+	:param _session: optimizer created by "new_session", to be reused; if None, a new optimizer is created
+	:param _incumbent: previous solution (e.g. the previous day's varis) to be repaired and used as MIP start; not
+	part of the result cache's key, since it only changes the time taken to solve; if None, the schedule of the most
+	similar run is used when similarity_index is set
 
 	:return:
 	"""
 	config_t = time()
 	logger.info(f'Configuring data for MILP...')
-	problem = Optimizer(plot=GeneralSettings.plot, solver='CBC')
+	problem = _session if _session is not None else new_optimizer()
+	key, found = cached_run(problem, 'pair', _settings, key_asset(_assets), key_asset(_assets2), _milp_params,
+	                        _measures, _measures2, _forecasts, a)
+	if found:
+		logger.info(f'Configuring data for MILP ... result found in cache ({time() - config_t:.3f}s)')
+		return problem
+	# Embedding of the inputs before initialize (which rescales the assets' test data)
+	index = get_similarity_index()
+	if index is not None:
+		vector = index.embed(_forecasts, (_measures['bessSoC'], _measures2['bessSoC']), (_assets, _assets2))
 	problem.initialize(_settings, _assets, _assets2, _milp_params, _measures, _measures2, _forecasts)
+	if _incumbent is not None and not problem.set_incumbent(_incumbent):
+		logger.info('No feasible MIP start could be built from the previous solution')
+	# Without a previous solution, the schedule of the most similar run solved so far (MIP start and cutoff)
+	if _incumbent is None and index is not None:
+		neighbour, _ = index.nearest(vector)
+		if neighbour is not None and not problem.set_incumbent(neighbour, cutoff=True):
+			logger.info('No feasible MIP start could be built from the most similar run')
 	logger.info(f'Configuring data for MILP ... OK! ({time() - config_t:.3f}s)')
 
 	solve_t = time()
@@ -68,6 +198,46 @@ def optimize(_settings, _assets, _assets2, _milp_params, _measures, _measures2,
 	logger.info(f'Generating outputs ...')
 	problem.generate_outputs(a, _assets, _assets2 )
 	logger.info(f'Generating outputs ... OK! ({time() - outputs_t:.3f}s)')
+	cache_run(problem, key)
+	if index is not None and problem.opt_val is not None:
+		index.add(vector, problem.varis)
+
+	return problem
+
+def optimize_fleet(_settings, _assets, _milp_params, _measures, _forecasts, _deg_weights, _session=None):
+	"""
+	Optimization orchestrator for a site with any number of BESS (a fleet).
+	:param _settings:
+	:param _assets: the BESS configured, in order
+	:param _milp_params:
+	:param _measures: the real-time measurements of each BESS, in the same order
+	:param _forecasts:
+	:param _deg_weights: cost of each kWh degraded in each BESS (€/kWh), in the same order
+	:param _session: optimizer created by "new_session", to be reused; if None, a new optimizer is created
+
+	:return:
+	"""
+	config_t = time()
+	logger.info(f'Configuring data for MILP...')
+	problem = _session if _session is not None else new_optimizer()
+	key, found = cached_run(problem, 'fleet', _settings, [key_asset(asset) for asset in _assets], _milp_params,
+	                        _measures, _forecasts, _deg_weights)
+	if found:
+		logger.info(f'Configuring data for MILP ... result found in cache ({time() - config_t:.3f}s)')
+		return problem
+	problem.initialize_fleet(_settings, _assets, _milp_params, _measures, _forecasts)
+	logger.info(f'Configuring data for MILP ... OK! ({time() - config_t:.3f}s)')
+
+	solve_t = time()
+	logger.info(f'Solving MILP ...')
+	problem.solve_fleet(_deg_weights)
+	logger.info(f'Solving MILP ... OK! ({time() - solve_t:.3f}s)')
+
+	outputs_t = time()
+	logger.info(f'Generating outputs ...')
+	problem.generate_outputs()
+	logger.info(f'Generating outputs ... OK! ({time() - outputs_t:.3f}s)')
+	cache_run(problem, key)
 
 	return problem
 
@@ -80,6 +250,11 @@ HELPERS_PATH = os.path.join(ROOT_PATH, 'helpers')
 set_stdout_logger()
 logfile_handler_id = set_logfile_handler()
 
+# Cache of the results of past runs (see get_result_cache)
+result_cache = None
+# Index of the schedules of past runs (see get_similarity_index)
+similarity_index = None
+
 # Create a variable to store the setpoints
 daily_outputs = None
 # Create a variable to store the main results
@@ -0,0 +1,287 @@
+"""
+DynamicProgramming class. Solves the BESS dispatch problem with constant efficiencies by dynamic programming over a
+discretized energy content grid of each BESS, with the Bellman recursion vectorized over all grid states.
+"""
+import math
+import numpy as np
+
+from loguru import logger
+from numpy.lib.stride_tricks import sliding_window_view
+from pulp import LpStatusInfeasible, LpStatusNotSolved, LpStatusOptimal
+from time import time
+
+# Tolerance used when checking the PCC and energy content limits
+feasibility_tol = 1e-7
+# Maximum number of grid points per BESS, so BESS with a very low power for their capacity do not exhaust the memory
+max_grid_points = 1001
+
+
+class DynamicProgramming:
+	def __init__(self, name, resolution=12):
+		self.name = name  # problem's name
+		self.resolution = resolution  # grid steps covered by a BESS at its largest DC power during one time step
+		# **************************************************************************************************************
+		#        PROBLEM
+		# **************************************************************************************************************
+		self.dt = None  # time interval of each step, in hours
+		self.load = None  # inflexible load per time step (kW)
+		self.prices = None  # market prices per time step (€/kWh)
+		self.pcc_limit = None  # power limit that can be absorbed at the PCC (kW)
+		self.units = []  # energy content grid and possible moves of each BESS (see add_unit)
+		# **************************************************************************************************************
+		#        RESULTS
+		# **************************************************************************************************************
+		self.columns = dict()  # variable block name -> array with the respective indices in x (as in SparseMilp)
+		self.status = LpStatusNotSolved  # status of the solution, following PuLP's codes
+		self.status_real = None  # status reported as by the solvers (here, "Heuristic" when a schedule was found)
+		self.message = None  # solver's message
+		self.objective_value = None  # optimal objective function value
+		self.x = None  # optimal variables' values
+
+	def set_pcc(self, load, prices, pcc_limit, dt):
+		"""
+		Sets the inflexible load, the market prices and the PCC limit of the optimization horizon.
+		:param load: inflexible load per time step (kW)
+		:type load: Union[list, numpy.ndarray]
+		:param prices: market prices per time step (€/kWh)
+		:type prices: Union[list, numpy.ndarray]
+		:param pcc_limit: power limit that can be absorbed at the PCC (kW)
+		:type pcc_limit: float
+		:param dt: time interval of each step, in hours
+		:type dt: float
+		:return: None
+		:rtype: None
+		"""
+		self.load = np.asarray(load, dtype=float)
+		self.prices = np.asarray(prices, dtype=float)
+		self.pcc_limit = pcc_limit
+		self.dt = dt
+
+	def add_unit(self, bess, sfx, deg_weight, dynamic_limits=False):
+		"""
+		Adds a BESS to the problem. Its energy content grid is anchored at the initial energy content, with a step such
+		that "resolution" steps are covered at the largest DC power; each move between grid points sets the charge or
+		discharge power of one time step. Must be called after set_pcc; one or two BESS are supported.
+		:param bess: the BESS configured
+		:type bess: module.tasks.BESS.BESS
+		:param sfx: suffix of the BESS's variables' names
+		:type sfx: str
+		:param deg_weight: cost of each kWh degraded (€/kWh)
+		:type deg_weight: float
+		:param dynamic_limits: True if the energy content limits depend on the charge/discharge power (add_on_soc)
+		:type dynamic_limits: bool
+		:return: None
+		:rtype: None
+		"""
+		if len(self.units) == 2:
+			raise ValueError('The DP dispatch supports one or two BESS')
+
+		dt = self.dt
+		e0 = bess.initial_e_bess
+		# Largest DC energy charged/discharged during one time step
+		max_e_ch = max(min(bess.p_ac_max_c * bess.const_eff_ch, bess.p_dc_max_c), 0.0) * dt
+		max_e_disch = max(min(bess.p_ac_max_d / bess.const_eff_disch, bess.p_dc_max_d), 0.0) * dt
+		capacity = max(bess.max_e_bess, e0) - min(bess.min_e_bess, e0)
+		step = max(max_e_ch / self.resolution, max_e_disch / self.resolution, capacity / (max_grid_points - 2)) or 1.0
+		# Shrink the step so the farthest (static) energy content limit is exactly on the grid
+		span = max(bess.max_e_bess - e0, e0 - bess.min_e_bess)
+		if span > 0:
+			step = span / math.ceil(span / step - feasibility_tol)
+		nr_ch = math.floor(max_e_ch / step + feasibility_tol)
+		nr_disch = math.floor(max_e_disch / step + feasibility_tol)
+
+		# Charge/discharge P of each move (from nr_disch grid steps down to nr_ch grid steps up)
+		e_change = np.arange(-nr_disch, nr_ch + 1) * step
+		bes_charge = np.maximum(e_change, 0.0) / dt
+		bes_discharge = np.maximum(-e_change, 0.0) / dt
+		p_ch = bes_charge / bess.const_eff_ch
+		p_disch = bes_discharge * bess.const_eff_disch
+
+		# Energy content limits applicable to each move
+		if dynamic_limits:
+			min_e_bes = bess.discharge_slope / bess.v_nom_discharge * bes_charge + bess.discharge_origin
+			max_e_bes = bess.charge_slope / bess.v_nom_charge * bes_discharge + bess.charge_origin
+		else:
+			min_e_bes = np.full(len(e_change), float(bess.min_e_bess))
+			max_e_bes = np.full(len(e_change), float(bess.max_e_bess))
+
+		# Grid points (the initial energy content is always one of them, even if outside the limits)
+		k_min = min(math.ceil((max(min_e_bes.min(), 0.0) - e0) / step - feasibility_tol), 0)
+		k_max = max(math.floor((max_e_bes.max() - e0) / step + feasibility_tol), 0)
+		levels = e0 + np.arange(k_min, k_max + 1) * step
+
+		# Cost (0 or inf) of each move from each grid point: inf if it leaves the grid or the energy content limits
+		target = np.arange(len(levels))[:, None] + np.arange(len(e_change))[None, :] - nr_disch
+		inside = (target >= 0) & (target < len(levels))
+		e_target = np.where(inside, levels[np.clip(target, 0, len(levels) - 1)], np.nan)
+		feasible = inside & (e_target >= min_e_bes - feasibility_tol) & (e_target <= max_e_bes + feasibility_tol) \
+			& (min_e_bes >= -feasibility_tol) & (max_e_bes >= -feasibility_tol)
+
+		# As in the MILP's objective function, the degradation cost is also multiplied by the step duration
+		e_deg = bess.deg_slope * bes_discharge * dt
+		self.units.append(dict(
+			sfx=sfx, levels=levels, start=-k_min, nr_ch=nr_ch, nr_disch=nr_disch,
+			p_ch=p_ch, p_disch=p_disch, min_e_bes=min_e_bes, max_e_bes=max_e_bes,
+			e_deg=e_deg, deg_cost=deg_weight * e_deg * dt, moves_cost=np.where(feasible, 0.0, np.inf),
+		))
+
+	def solve(self):
+		"""
+		Runs the backward Bellman recursion over the joint grid of both BESS and recovers the optimal schedule from the
+		initial energy contents. The joint minimization over the moves of both BESS is split in two stages, as they are
+		only coupled through the PCC limits: for each move of the first BESS, the best allowed move of the second one
+		is found by prefix/suffix minima (one array operation per time step over all grid points).
+		:return: status of the solution, following PuLP's codes
+		:rtype: int
+		"""
+		solve_t = time()
+		T = len(self.load)
+		# With a single BESS, an idle one (a single grid point and move) takes the place of the first BESS
+		outer, inner = self.units if len(self.units) == 2 else [self.__idle_unit()] + self.units
+		n_outer, n_inner = len(outer['levels']), len(inner['levels'])
+		w_outer, w_inner = len(outer['p_ch']), len(inner['p_ch'])
+		a_outer = outer['p_ch'] - outer['p_disch']
+		a_inner = inner['p_ch'] - inner['p_disch']
+		# Grid point of the first BESS reached by each move from each grid point (moves leaving the grid cost inf)
+		target = np.clip(np.arange(n_outer)[:, None] + np.arange(w_outer) - outer['nr_disch'], 0, n_outer - 1)
+
+		values = np.empty((T + 1, n_outer, n_inner))
+		values[T] = 0.0
+		policy = np.empty((T, n_outer, n_inner), dtype=np.int64)
+		for t in reversed(range(T)):
+			lower, upper = self.__inner_moves_range(t, a_outer, a_inner)
+			# Cost of each move of the second BESS (first axis), from each of its grid points, for each next grid point
+			# of the first BESS
+			future = sliding_window_view(np.pad(values[t + 1], [(0, 0), (inner['nr_disch'], inner['nr_ch'])],
+			                                    constant_values=np.inf), w_inner, axis=1)
+			inner_cost = np.add(np.moveaxis(future, -1, 0), inner['moves_cost'].T[:, None, :] +
+			                    (self.prices[t] * self.dt * a_inner + inner['deg_cost'])[:, None, None], order='C')
+			best_inner = self.__range_min(inner_cost, lower, upper)
+
+			outer_cost = outer['moves_cost'] + \
+				(self.prices[t] * self.dt * (self.load[t] + a_outer) + outer['deg_cost'])
+			total = best_inner[np.arange(w_outer), target, :] + outer_cost[:, :, None]
+			policy[t] = np.argmin(total, axis=1)
+			values[t] = np.take_along_axis(total, policy[t][:, None, :], axis=1)[:, 0, :]
+
+		state = (outer['start'], inner['start'])
+		if not np.isfinite(values[0][state]):
+			self.status, self.status_real, self.message = LpStatusInfeasible, 'Infeasible', 'No feasible schedule'
+			self.objective_value, self.x = None, None
+			logger.debug(f' - DP: {self.message} ({time() - solve_t:.3f}s)')
+			return self.status
+		self.objective_value = float(values[0][state])
+
+		# Forward pass: moves chosen by each BESS at each time step (the second one's is found again from values)
+		moves = np.empty((T, 2), dtype=np.int64)
+		positions = np.empty((T, 2), dtype=np.int64)
+		m_inner = np.arange(w_inner)
+		for t in range(T):
+			m_outer = policy[t][state]
+			next_outer = state[0] + m_outer - outer['nr_disch']
+			lower, upper = self.__inner_moves_range(t, a_outer[m_outer], a_inner)
+			next_inner = state[1] + m_inner - inner['nr_disch']
+			inside = (next_inner >= 0) & (next_inner < n_inner) & (m_inner >= lower) & (m_inner <= upper)
+			cost = np.where(inside, values[t + 1][next_outer, np.clip(next_inner, 0, n_inner - 1)], np.inf) + \
+				inner['moves_cost'][state[1]] + self.prices[t] * self.dt * a_inner + inner['deg_cost']
+			moves[t] = m_outer, np.argmin(cost)
+			state = positions[t] = next_outer, next_inner[moves[t, 1]]
+
+		blocks = dict()
+		p_abs = self.load.copy()
+		for i, u in enumerate((outer, inner)):
+			if u['sfx'] is None:
+				continue
+			m = moves[:, i]
+			p_abs += u['p_ch'][m] - u['p_disch'][m]
+			blocks[f'e_bess{u["sfx"]}'] = u['levels'][positions[:, i]]
+			blocks[f'e_deg{u["sfx"]}'] = u['e_deg'][m]
+			blocks[f'max_e_bes{u["sfx"]}'] = np.maximum(u['max_e_bes'][m], 0.0)
+			blocks[f'min_e_bes{u["sfx"]}'] = np.maximum(u['min_e_bes'][m], 0.0)
+			blocks[f'p_ch{u["sfx"]}'] = u['p_ch'][m]
+			blocks[f'p_disch{u["sfx"]}'] = u['p_disch'][m]
+			blocks[f'delta_bess{u["sfx"]}'] = (u['p_ch'][m] > 0).astype(float)
+		blocks = dict(p_abs=np.maximum(p_abs, 0.0), delta_pcc=np.ones(T), **blocks)
+
+		self.columns = {name: np.arange(b * T, (b + 1) * T) for b, name in enumerate(blocks)}
+		self.x = np.concatenate(list(blocks.values()))
+		# Optimal on the grid only, so not necessarily the optimum of the (continuous) dispatch problem
+		self.status, self.status_real = LpStatusOptimal, 'Heuristic'
+		grid = ' x '.join(str(len(u['levels'])) for u in self.units)
+		self.message = f'Optimal on a {grid} energy content grid'
+		logger.debug(f' - DP: {self.message} ({time() - solve_t:.3f}s)')
+
+		return self.status
+
+	def __inner_moves_range(self, t, a_outer, a_inner):
+		"""
+		Returns, for each net AC power of the first BESS, the range of moves of the second BESS that keep the PCC
+		absorption within [0, PCC limit] (the net AC power of the moves is increasing).
+		:return: first and last allowed move (the range is empty when first > last)
+		:rtype: (numpy.ndarray, numpy.ndarray)
+		"""
+		lower = np.searchsorted(a_inner, -self.load[t] - a_outer - feasibility_tol, side='left')
+		upper = np.searchsorted(a_inner, self.pcc_limit - self.load[t] - a_outer + feasibility_tol, side='right') - 1
+
+		return lower, upper
+
+	@staticmethod
+	def __range_min(costs, lower, upper):
+		"""
+		Minimum of costs[lower[k]:upper[k] + 1] for each k. Ranges starting at the first or ending at the last element
+		(one of the PCC limits not binding, the usual case) come from prefix/suffix minima; the others are computed
+		one by one.
+		:return: array with the first axis of "costs" replaced by one entry per range
+		:rtype: numpy.ndarray
+		"""
+		last = costs.shape[0] - 1
+		best = np.full((len(lower),) + costs.shape[1:], np.inf)
+		from_first = (lower <= 0) & (upper >= 0)
+		if from_first.any():
+			best[from_first] = DynamicProgramming.__running_min(costs)[upper[from_first]]
+		to_last = (lower > 0) & (upper >= last) & (lower <= last)
+		if to_last.any():
+			best[to_last] = DynamicProgramming.__running_min(costs[::-1])[last - lower[to_last]]
+		for k in np.flatnonzero((lower > 0) & (upper < last) & (lower <= upper)):
+			best[k] = costs[lower[k]:upper[k] + 1].min(axis=0)
+
+		return best
+
+	@staticmethod
+	def __running_min(costs):
+		"""
+		Running minimum along the first axis, one array operation per element of that (short) axis; much faster than
+		numpy.minimum.accumulate on these arrays.
+		:rtype: numpy.ndarray
+		"""
+		result = np.empty_like(costs)
+		result[0] = costs[0]
+		for k in range(1, len(costs)):
+			np.minimum(result[k - 1], costs[k], out=result[k])
+
+		return result
+
+	@staticmethod
+	def __idle_unit():
+		"""
+		Returns a BESS that can only stay idle, with a single grid point, used when the problem has a single BESS.
+		:rtype: dict
+		"""
+		zero = np.zeros(1)
+
+		return dict(sfx=None, levels=zero, start=0, nr_ch=0, nr_disch=0, p_ch=zero, p_disch=zero,
+		            min_e_bes=zero, max_e_bes=zero, e_deg=zero, deg_cost=zero, moves_cost=np.zeros((1, 1)))
+
+	def values(self, name):
+		"""
+		Returns the solution values of a block of variables.
+		:param name: name of the block of variables
+		:type name: str
+		:return: solution values of the block, or NaN if no solution is available
+		:rtype: numpy.ndarray
+		"""
+		idx = self.columns[name]
+		if self.x is None:
+			return np.full(len(idx), np.nan)
+
+		return self.x[idx]
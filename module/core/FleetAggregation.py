@@ -0,0 +1,286 @@
+"""
+FleetAggregation class. Clusters the BESS of a large fleet with similar parameters into a few virtual batteries, so the
+optimization model grows with the number of clusters instead of the number of BESS, and splits the set points of each
+virtual battery back among its BESS, within each BESS's limits.
+"""
+import copy
+import helpers.milp_helpers as mhelper
+import numpy as np
+
+from loguru import logger
+from pulp import LpStatusInfeasible, LpStatusNotSolved, LpStatusOptimal
+from scipy.optimize import linprog
+from scipy.sparse import csr_matrix, diags, hstack, identity, kron, vstack
+from time import time
+
+# Tolerance used when checking the split set points against the limits of each BESS
+feasibility_tol = 1e-6
+# Cost per kW charged or discharged in the LP split, so that no BESS charges and discharges at the same time
+flow_cost = 1e-6
+# Parameters summed over the BESS of a cluster
+summed_parameters = ('p_ac_max_c', 'p_ac_max_d', 'p_dc_max_c', 'p_dc_max_d', 'max_e_bess', 'min_e_bess',
+                     'initial_e_bess')
+
+
+class FleetAggregation:
+	def __init__(self, name, tolerance=0.05):
+		self.name = name  # problem's name
+		self.tolerance = tolerance  # maximum relative difference between the clustered parameters of a cluster's BESS
+		# **************************************************************************************************************
+		#        CLUSTERS
+		# **************************************************************************************************************
+		self.clusters = []  # positions (in the fleet) of the BESS of each cluster
+		self.virtual = []  # virtual battery (BESS) of each cluster
+		self.virtual_weights = []  # cost of each kWh degraded in each virtual battery (€/kWh)
+		# **************************************************************************************************************
+		#        RESULTS
+		# **************************************************************************************************************
+		self.columns = dict()  # variable block name -> array with the respective indices in x (as in SparseMilp)
+		self.status = LpStatusNotSolved  # status of the split, following PuLP's codes
+		self.status_real = None  # status reported as by the solvers (here, "Aggregated" when the split succeeded)
+		self.message = None  # split's message
+		self.objective_value = None  # objective function value of the fleet's set points
+		self.x = None  # variables' values of the fleet
+
+	def aggregate(self, fleet, deg_weights, dynamic_limits=False):
+		"""
+		Clusters the BESS whose efficiencies, degradation slope and cost, power limits and energy content limits (both
+		relative to their capacity) and initial state of charge are all within "tolerance" of those of the cluster's
+		first BESS, and builds one virtual battery per cluster: powers and energy contents are summed and the other
+		parameters averaged, weighted by capacity. A cluster of BESS with proportional parameters is modelled exactly.
+		:param fleet: the BESS configured
+		:type fleet: list of module.tasks.BESS.BESS
+		:param deg_weights: cost of each kWh degraded in each BESS (€/kWh)
+		:type deg_weights: list
+		:param dynamic_limits: True if the energy content limits depend on the charge/discharge power (add_on_soc)
+		:type dynamic_limits: bool
+		:return: virtual batteries and their costs of each kWh degraded
+		:rtype: (list, list)
+		"""
+		features = np.array([self.__features(bess, weight, dynamic_limits) for bess, weight in zip(fleet, deg_weights)])
+		self.clusters = []
+		leaders = np.empty((0, features.shape[1]))
+		for k, unit_features in enumerate(features):
+			close = np.all(np.abs(leaders - unit_features) <=
+			               self.tolerance * np.maximum(np.abs(leaders), np.abs(unit_features)) + feasibility_tol, axis=1)
+			if close.any():
+				self.clusters[int(np.argmax(close))].append(k)
+			else:
+				self.clusters.append([k])
+				leaders = np.vstack((leaders, unit_features))
+
+		self.virtual, self.virtual_weights = [], []
+		for members in self.clusters:
+			units = [fleet[k] for k in members]
+			capacity = np.array([max(bess.max_e_bess, feasibility_tol) for bess in units])
+
+			def average(values):
+				return float(np.average(values, weights=capacity))
+
+			virtual = copy.copy(units[0])
+			for parameter in summed_parameters:
+				setattr(virtual, parameter, sum(getattr(bess, parameter) for bess in units))
+			virtual.const_eff_ch = average([bess.const_eff_ch for bess in units])
+			virtual.const_eff_disch = average([bess.const_eff_disch for bess in units])
+			virtual.deg_slope = average([bess.deg_slope for bess in units])
+			if dynamic_limits:
+				# Energy content limits of each BESS: slope / nominal voltage * DC power + origin
+				virtual.charge_slope = average([b.charge_slope / b.v_nom_charge for b in units]) * virtual.v_nom_charge
+				virtual.discharge_slope = average([b.discharge_slope / b.v_nom_discharge for b in units]) \
+					* virtual.v_nom_discharge
+				virtual.charge_origin = sum(bess.charge_origin for bess in units)
+				virtual.discharge_origin = sum(bess.discharge_origin for bess in units)
+			self.virtual.append(virtual)
+			self.virtual_weights.append(average([deg_weights[k] for k in members]))
+
+		logger.debug(f' - fleet aggregation: {len(fleet)} BESS in {len(self.clusters)} cluster(s)')
+
+		return self.virtual, self.virtual_weights
+
+	def disaggregate(self, aggregated, fleet, suffixes, deg_weights, prices, dt, step=None, dynamic_limits=False):
+		"""
+		Splits the set points of each virtual battery among the BESS of its cluster: in proportion to their power
+		limits when that respects the limits of every BESS, otherwise by an LP that keeps the net power of the
+		cluster in every time step (so the PCC flows do not change) at the lowest degradation cost.
+		:param aggregated: solved problem of the virtual batteries (SparseMilp, DynamicProgramming, ...)
+		:type aggregated: object
+		:param fleet: the BESS configured, as passed to aggregate
+		:type fleet: list of module.tasks.BESS.BESS
+		:param suffixes: suffix of the variables' names of each BESS
+		:type suffixes: list of str
+		:param deg_weights: cost of each kWh degraded in each BESS (€/kWh)
+		:type deg_weights: list
+		:param prices: market prices per time step (€/kWh)
+		:type prices: Union[list, numpy.ndarray]
+		:param dt: time interval of each step (or of all steps), in hours
+		:type dt: Union[float, numpy.ndarray]
+		:param step: time interval weighting the degradation cost in the objective function, in hours (that of the
+		requested grid when steps were merged); defaults to dt
+		:type step: float
+		:param dynamic_limits: True if the energy content limits depend on the charge/discharge power (add_on_soc)
+		:type dynamic_limits: bool
+		:return: status of the split, following PuLP's codes
+		:rtype: int
+		"""
+		split_t = time()
+		step = dt if step is None else step
+		blocks = dict(p_abs=aggregated.values('p_abs'), delta_pcc=aggregated.values('delta_pcc'))
+		unit_blocks = dict()
+		nr_lp = 0
+		for c, members in enumerate(self.clusters):
+			vsfx = mhelper.unit_suffix(c)
+			p_ch, p_disch = aggregated.values(f'p_ch{vsfx}'), aggregated.values(f'p_disch{vsfx}')
+			units = [fleet[k] for k in members]
+
+			# Proportional split
+			share_ch = np.array([bess.p_ac_max_c for bess in units]) / max(sum(b.p_ac_max_c for b in units), 1e-12)
+			share_disch = np.array([bess.p_ac_max_d for bess in units]) / max(sum(b.p_ac_max_d for b in units), 1e-12)
+			split = [self.__unit_blocks(bess, p_ch * s_ch, p_disch * s_disch, dt, dynamic_limits)
+			         for bess, s_ch, s_disch in zip(units, share_ch, share_disch)]
+
+			# LP split, when the proportional one violates the limits of any BESS
+			if not all(feasible for _, feasible in split):
+				nr_lp += 1
+				flows = self.__lp_split(units, [deg_weights[k] for k in members], p_ch - p_disch, dt, step,
+				                        dynamic_limits)
+				if flows is None:
+					self.status, self.status_real = LpStatusInfeasible, 'Infeasible'
+					self.message = f'Set points of virtual battery {c + 1} could not be split among its BESS'
+					logger.debug(f' - fleet aggregation: {self.message}')
+					return self.status
+				split = [self.__unit_blocks(bess, unit_ch, unit_disch, dt, dynamic_limits)
+				         for bess, (unit_ch, unit_disch) in zip(units, flows)]
+
+			for k, (unit_values, _) in zip(members, split):
+				unit_blocks[k] = unit_values
+
+		for k, sfx in enumerate(suffixes):
+			for name, values in unit_blocks[k].items():
+				blocks[f'{name}{sfx}'] = values
+
+		T = len(blocks['p_abs'])
+		self.columns = {name: np.arange(b * T, (b + 1) * T) for b, name in enumerate(blocks)}
+		self.x = np.concatenate(list(blocks.values()))
+		self.objective_value = float(np.sum(np.asarray(prices, dtype=float) * dt * blocks['p_abs']) +
+		                             sum(weight * step * np.sum(blocks[f'e_deg{sfx}'])
+		                                 for sfx, weight in zip(suffixes, deg_weights)))
+		self.status, self.status_real = LpStatusOptimal, 'Aggregated'
+		self.message = f'{len(fleet)} BESS in {len(self.clusters)} virtual batteries ({nr_lp} split by LP)'
+		logger.debug(f' - fleet aggregation: {self.message} ({time() - split_t:.3f}s)')
+
+		return self.status
+
+	def __features(self, bess, deg_weight, dynamic_limits):
+		"""
+		Parameters of a BESS compared when clustering; powers and energy contents are taken relative to its capacity.
+		:rtype: list
+		"""
+		capacity = max(bess.max_e_bess, feasibility_tol)
+		features = [bess.const_eff_ch, bess.const_eff_disch, bess.deg_slope, deg_weight,
+		            bess.p_ac_max_c / capacity, bess.p_ac_max_d / capacity, bess.p_dc_max_c / capacity,
+		            bess.p_dc_max_d / capacity, bess.min_e_bess / capacity, bess.initial_e_bess / capacity]
+		if dynamic_limits:
+			features += [bess.charge_slope / bess.v_nom_charge, bess.discharge_slope / bess.v_nom_discharge,
+			             bess.charge_origin / capacity, bess.discharge_origin / capacity]
+
+		return features
+
+	@staticmethod
+	def __unit_blocks(bess, p_ch, p_disch, dt, dynamic_limits):
+		"""
+		Computes all variables of a BESS from its AC charge/discharge set points and checks them against its limits.
+		:return: dictionary of variable block name (without suffix) -> values, and True if all limits are respected
+		:rtype: (dict, bool)
+		"""
+		bes_charge = p_ch * bess.const_eff_ch
+		bes_discharge = p_disch / bess.const_eff_disch
+		e_bess = bess.initial_e_bess + np.cumsum((bes_charge - bes_discharge) * dt)
+		if dynamic_limits:
+			min_e_bes = bess.discharge_slope / bess.v_nom_discharge * bes_charge + bess.discharge_origin
+			max_e_bes = bess.charge_slope / bess.v_nom_charge * bes_discharge + bess.charge_origin
+		else:
+			min_e_bes = np.full(len(p_ch), float(bess.min_e_bess))
+			max_e_bes = np.full(len(p_ch), float(bess.max_e_bess))
+
+		feasible = bool(np.all(p_ch <= bess.p_ac_max_c + feasibility_tol) and
+		                np.all(p_disch <= bess.p_ac_max_d + feasibility_tol) and
+		                np.all(bes_charge <= bess.p_dc_max_c + feasibility_tol) and
+		                np.all(bes_discharge <= bess.p_dc_max_d + feasibility_tol) and
+		                np.all(e_bess >= min_e_bes - feasibility_tol) and np.all(e_bess <= max_e_bes + feasibility_tol))
+
+		return dict(e_bess=np.maximum(e_bess, 0.0), e_deg=bess.deg_slope * bes_discharge * dt,
+		            max_e_bes=np.maximum(max_e_bes, 0.0), min_e_bes=np.maximum(min_e_bes, 0.0), p_ch=p_ch,
+		            p_disch=p_disch, delta_bess=(p_ch > 0).astype(float)), feasible
+
+	@staticmethod
+	def __lp_split(units, deg_weights, net, dt, step, dynamic_limits):
+		"""
+		Splits the net AC power (charge positive) of a virtual battery among its BESS by an LP: charge and discharge
+		P and energy content of each BESS and time step within its limits, the powers summing to the net power in
+		every time step, at the lowest degradation cost.
+		:return: AC charge and discharge set points of each BESS, or None if the LP is infeasible
+		:rtype: list of tuple
+		"""
+		K, T = len(units), len(net)
+
+		def per_unit(values):
+			return np.repeat(np.asarray(values, dtype=float), T)
+
+		durations = np.tile(np.broadcast_to(np.asarray(dt, dtype=float), T), K)
+		eff_ch = per_unit([bess.const_eff_ch for bess in units])
+		eff_disch = per_unit([bess.const_eff_disch for bess in units])
+		# Variables: AC charge P, AC discharge P and energy content of each BESS and time step, in this order
+		max_ch = per_unit([min(bess.p_ac_max_c, bess.p_dc_max_c / bess.const_eff_ch) for bess in units])
+		max_disch = per_unit([min(bess.p_ac_max_d, bess.p_dc_max_d * bess.const_eff_disch) for bess in units])
+		if dynamic_limits:
+			e_bounds = np.column_stack((np.zeros(K * T), np.full(K * T, np.inf)))
+		else:
+			e_bounds = np.column_stack((per_unit([bess.min_e_bess for bess in units]),
+			                            per_unit([bess.max_e_bess for bess in units])))
+		bounds = np.vstack((np.column_stack((np.zeros(K * T), max_ch)),
+		                    np.column_stack((np.zeros(K * T), max_disch)), e_bounds))
+
+		# Energy content update: e[t] - e[t - 1] - eff_ch * dt * p_ch[t] + dt / eff_disch * p_disch[t] = 0 (e0 at t = 0)
+		previous = kron(identity(K), diags(np.ones(T - 1), -1, shape=(T, T)))
+		first = np.zeros((K, T))
+		first[:, 0] = [bess.initial_e_bess for bess in units]
+		A_eq = vstack([hstack([diags(-eff_ch * durations), diags(durations / eff_disch), identity(K * T) - previous]),
+		               hstack([kron(np.ones((1, K)), identity(T)), -kron(np.ones((1, K)), identity(T)),
+		                       csr_matrix((T, K * T))])])
+		b_eq = np.concatenate([first.ravel(), net])
+
+		# Energy content limits depending on the DC charge/discharge P (add_on_soc)
+		A_ub, b_ub = None, None
+		if dynamic_limits:
+			cslope = per_unit([bess.charge_slope / bess.v_nom_charge for bess in units])
+			dslope = per_unit([bess.discharge_slope / bess.v_nom_discharge for bess in units])
+			# e <= cslope * DC discharge P + charge_origin and dslope * DC charge P + discharge_origin <= e
+			A_ub = vstack([hstack([csr_matrix((K * T, K * T)), diags(-cslope / eff_disch), identity(K * T)]),
+			               hstack([diags(dslope * eff_ch), csr_matrix((K * T, K * T)), -identity(K * T)])]).tocsr()
+			b_ub = np.concatenate([per_unit([bess.charge_origin for bess in units]),
+			                       -per_unit([bess.discharge_origin for bess in units])])
+
+		deg_cost = per_unit([weight * bess.deg_slope * step / bess.const_eff_disch
+		                     for bess, weight in zip(units, deg_weights)]) * durations
+		c = np.concatenate([np.full(K * T, flow_cost), deg_cost + flow_cost, np.zeros(K * T)])
+		res = linprog(c, A_ub=A_ub, b_ub=b_ub, A_eq=A_eq.tocsr(), b_eq=b_eq, bounds=bounds, method='highs')
+		if res.status != 0:
+			return None
+
+		p_ch, p_disch = res.x[:K * T].reshape(K, T), res.x[K * T:2 * K * T].reshape(K, T)
+
+		return list(zip(np.maximum(p_ch, 0.0), np.maximum(p_disch, 0.0)))
+
+	def values(self, name):
+		"""
+		Returns the values of a block of variables of the fleet.
+		:param name: name of the block of variables
+		:type name: str
+		:return: values of the block, or NaN if the split did not succeed
+		:rtype: numpy.ndarray
+		"""
+		idx = self.columns[name]
+		if self.x is None:
+			return np.full(len(idx), np.nan)
+
+		return self.x[idx]
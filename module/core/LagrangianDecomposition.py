@@ -0,0 +1,206 @@
+"""
+LagrangianDecomposition class. Solves a SparseMilp whose variables split into loosely coupled groups (e.g. the PCC and
+each BESS) by relaxing the rows that couple different groups with Lagrange multipliers: each group's subproblem is
+then solved independently (in a pool of worker processes), the multipliers are updated by the subgradient method and
+the combined schedule is repaired into a feasible solution of the whole problem.
+"""
+import numpy as np
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+from loguru import logger
+from pulp import LpStatusNotSolved, LpStatusOptimal
+from scipy.optimize import Bounds, LinearConstraint, linprog, milp
+from time import time
+
+# Iterations without improving the lower bound after which the subgradient step is halved
+patience = 3
+# Subgradient step at which the iterations stop
+min_step_scale = 1e-3
+
+# Subproblems held by each worker process (set once, by _set_subproblems), so only the objectives are sent
+_subproblems = None
+
+
+class LagrangianDecomposition:
+	def __init__(self, model, groups, repair=None, nr_workers=None, max_iterations=30, gap_tol=1e-3):
+		self.model = model  # problem to decompose, already assembled
+		self.groups = groups  # column indices of each group of variables; every column belongs to exactly one group
+		self.repair = repair  # function: values per block name -> (feasible values per block name, objective value)
+		self.nr_workers = nr_workers or min(len(groups), os.cpu_count())  # worker processes (1 solves in-process)
+		self.max_iterations = max_iterations  # maximum number of subgradient iterations
+		self.gap_tol = gap_tol  # relative gap between the best solution and the lower bound at which to stop
+		# **************************************************************************************************************
+		#        RESULTS
+		# **************************************************************************************************************
+		self.status = LpStatusNotSolved  # status of the solution, following PuLP's codes
+		self.status_real = None  # status reported as by the solvers
+		self.values = None  # best feasible values found, per block name
+		self.objective_value = None  # objective function value of the best feasible values
+		self.lower_bound = -np.inf  # best lower bound (value of the Lagrangian dual function)
+		self.gap = None  # relative gap between objective_value and lower_bound
+		self.iterations = 0  # number of subgradient iterations performed
+
+	def solve(self):
+		"""
+		Runs the subgradient iterations, starting from the multipliers of the LP relaxation (its duals), until the
+		gap between the best repaired solution and the best lower bound is within gap_tol, the step vanishes or
+		max_iterations is reached.
+		:return: status of the solution, following PuLP's codes
+		:rtype: int
+		"""
+		solve_t = time()
+		model = self.model
+		subproblems, coupling_eq, coupling_ub = self.__split()
+		C_eq, d_eq = model.A_eq[coupling_eq], model.b_eq[coupling_eq]
+		C_ub, d_ub = model.A_ub[coupling_ub], model.b_ub[coupling_ub]
+		lam_eq, lam_ub = self.__initial_multipliers(coupling_eq, coupling_ub)
+
+		step_scale, stalled = 2.0, 0
+		pool = ProcessPoolExecutor(self.nr_workers, initializer=_set_subproblems, initargs=(subproblems,)) \
+			if self.nr_workers > 1 else None
+		if pool is None:
+			_set_subproblems(subproblems)
+		try:
+			for iteration in range(1, self.max_iterations + 1):
+				self.iterations = iteration
+				# Subproblems with the coupling rows moved into the objective function
+				c = model.c + C_eq.T @ lam_eq + C_ub.T @ lam_ub
+				args = [c[cols] for cols in self.groups]
+				solved = list(pool.map(_solve_subproblem, range(len(args)), args)) if pool is not None else \
+					[_solve_subproblem(k, c_k) for k, c_k in enumerate(args)]
+				if any(x_k is None for x_k, _ in solved):
+					logger.warning(' - Lagrangian decomposition: a subproblem was not solved')
+					break
+
+				x = np.zeros(model.n_cols)
+				for cols, (x_k, _) in zip(self.groups, solved):
+					x[cols] = x_k
+				dual_value = sum(bound_k for _, bound_k in solved) - lam_eq @ d_eq - lam_ub @ d_ub
+				if dual_value > self.lower_bound + 1e-9 * max(1.0, abs(dual_value)):
+					self.lower_bound, stalled = dual_value, 0
+				else:
+					stalled += 1
+
+				# Repair of the combined schedule into a feasible solution of the whole problem
+				if self.repair is not None:
+					values, objective_value = self.repair({name: x[idx] for name, idx in model.columns.items()})
+					if values is not None and (self.objective_value is None or objective_value < self.objective_value):
+						self.values, self.objective_value = values, objective_value
+
+				if self.objective_value is not None:
+					self.gap = (self.objective_value - self.lower_bound) / max(abs(self.objective_value), 1e-9)
+					if self.gap <= self.gap_tol:
+						break
+
+				# Subgradient step (Polyak's, towards the best solution or, before one is found, a nearby target)
+				g_eq, g_ub = C_eq @ x - d_eq, C_ub @ x - d_ub
+				g_ub[(lam_ub <= 0) & (g_ub < 0)] = 0.0
+				norm = g_eq @ g_eq + g_ub @ g_ub
+				if norm <= 1e-12:
+					break
+				if stalled >= patience:
+					step_scale, stalled = step_scale / 2, 0
+				if step_scale < min_step_scale:
+					break
+				target = self.objective_value if self.objective_value is not None else \
+					dual_value + 0.05 * max(abs(dual_value), 1.0)
+				step = step_scale * max(target - dual_value, 0.0) / norm
+				lam_eq = lam_eq + step * g_eq
+				lam_ub = np.maximum(lam_ub + step * g_ub, 0.0)
+		finally:
+			if pool is not None:
+				pool.shutdown()
+
+		# Only a schedule within gap_tol of the lower bound is optimal; otherwise it is merely feasible
+		if self.values is not None and self.gap is not None and self.gap <= self.gap_tol:
+			self.status, self.status_real = LpStatusOptimal, 'Decomposed'
+		elif self.values is not None:
+			self.status_real = 'Feasible'
+		logger.debug(f' - Lagrangian decomposition: objective {self.objective_value}, lower bound '
+		             f'{self.lower_bound:.6f} after {self.iterations} iteration(s) ({time() - solve_t:.3f}s)')
+
+		return self.status
+
+	def __split(self):
+		"""
+		Splits the rows of the problem into those of each group (all their columns in that group) and the coupling
+		ones (columns in more than one group).
+		:return: arrays of each subproblem (c is replaced at each iteration), and indices of the coupling equality
+		and inequality rows
+		:rtype: (list, numpy.ndarray, numpy.ndarray)
+		"""
+		model = self.model
+		col_group = np.full(model.n_cols, -1)
+		for k, cols in enumerate(self.groups):
+			col_group[cols] = k
+		if np.any(col_group < 0):
+			raise ValueError('Every column of the problem must belong to a group')
+
+		local_rows = dict()
+		for sense, A in (('eq', model.A_eq), ('ub', model.A_ub)):
+			A = A.tocsr()
+			row_of_nz = np.repeat(np.arange(A.shape[0]), np.diff(A.indptr))
+			lowest = np.full(A.shape[0], len(self.groups))
+			highest = np.full(A.shape[0], -1)
+			np.minimum.at(lowest, row_of_nz, col_group[A.indices])
+			np.maximum.at(highest, row_of_nz, col_group[A.indices])
+			# Rows without coefficients are left out of all subproblems
+			local_rows[sense] = np.where(lowest == highest, highest, -1)
+			local_rows[sense][highest < 0] = len(self.groups)
+
+		subproblems = []
+		for k, cols in enumerate(self.groups):
+			rows_eq, rows_ub = np.flatnonzero(local_rows['eq'] == k), np.flatnonzero(local_rows['ub'] == k)
+			subproblems.append((model.integrality[cols], model.lb[cols], model.ub[cols],
+			                    model.A_eq[rows_eq][:, cols], model.b_eq[rows_eq],
+			                    model.A_ub[rows_ub][:, cols], model.b_ub[rows_ub]))
+
+		return subproblems, np.flatnonzero(local_rows['eq'] == -1), np.flatnonzero(local_rows['ub'] == -1)
+
+	def __initial_multipliers(self, coupling_eq, coupling_ub):
+		"""
+		Multipliers of the coupling rows taken from the duals of the LP relaxation of the whole problem (zero if it
+		is not solved).
+		:return: multipliers of the coupling equality and inequality rows
+		:rtype: (numpy.ndarray, numpy.ndarray)
+		"""
+		model = self.model
+		res = linprog(model.c, A_ub=model.A_ub, b_ub=model.b_ub, A_eq=model.A_eq, b_eq=model.b_eq,
+		              bounds=np.column_stack((model.lb, model.ub)), method='highs')
+		if res.status != 0:
+			return np.zeros(len(coupling_eq)), np.zeros(len(coupling_ub))
+
+		return -res.eqlin.marginals[coupling_eq], np.maximum(-res.ineqlin.marginals[coupling_ub], 0.0)
+
+
+def _set_subproblems(subproblems):
+	"""
+	Stores the subproblems in the current (worker) process.
+	:return: None
+	:rtype: None
+	"""
+	global _subproblems
+	_subproblems = subproblems
+
+
+def _solve_subproblem(k, c):
+	"""
+	Solves subproblem k with the objective function coefficients "c" through scipy.optimize.milp.
+	:return: variables' values and lower bound of the subproblem's optimum (its dual bound, so the Lagrangian bound
+	remains valid within the MIP gap), or (None, None) if not solved
+	:rtype: (numpy.ndarray, float)
+	"""
+	integrality, lb, ub, A_eq, b_eq, A_ub, b_ub = _subproblems[k]
+	constraints = []
+	if A_eq.shape[0]:
+		constraints.append(LinearConstraint(A_eq, b_eq, b_eq))
+	if A_ub.shape[0]:
+		constraints.append(LinearConstraint(A_ub, -np.inf, b_ub))
+
+	res = milp(c, integrality=integrality, bounds=Bounds(lb, ub), constraints=constraints, options=dict(disp=False))
+	if res.x is None:
+		return None, None
+
+	bound = getattr(res, 'mip_dual_bound', None)
+	return res.x, res.fun if bound is None or not np.isfinite(bound) else min(bound, res.fun)
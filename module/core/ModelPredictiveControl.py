@@ -0,0 +1,119 @@
+"""
+ModelPredictiveControl class. Re-plans the dispatch over a receding horizon whenever the horizon moves (every step, in
+closed loop) or the forecasts are updated, starting from the measured SoC. The optimizer (session) is kept between
+re-plans, and the previous plan, shifted to the new window, is the MIP start; while the rest of the previous plan is
+still optimal (same forecasts, SoC as planned and a horizon within its own), it is kept without solving.
+"""
+import numpy as np
+import pandas as pd
+
+from loguru import logger
+from module.core.ResultCache import ResultCache
+from module.tasks.BESS import key_asset
+from time import time
+
+
+class ModelPredictiveControl:
+	def __init__(self, optimize, objective_function, session=None):
+		self.optimize = optimize  # function that runs a single plan, with the same signature as main.optimize
+		self.objective_function = objective_function  # objective function chosen by the client
+		self.session = session  # optimizer kept alive between re-plans (see main.new_session); None for a new one
+		self.problem = None  # optimizer of the last plan, with its outputs
+		self.plan = None  # values of the decision variables of the last plan (as in Optimizer.varis)
+		self.plan_start = None  # datetime at the beginning of the last plan
+		self.plan_end = None  # datetime at the end of the last plan's horizon
+		self.plan_forecasts = None  # forecasts of the last plan
+		self.plan_socs = None  # initial SoC of each BESS in the last plan, in %
+		self.plan_key = None  # canonical hash of the settings and assets of the last plan (see ResultCache.key)
+		self.replans = 0  # number of re-plans performed (solved or not)
+		self.skipped = 0  # number of re-plans answered by the last plan, without solving (see needs_replan)
+		self.times = []  # time taken by each re-plan, in seconds
+
+	def needs_replan(self, settings, bess_asset, bess_asset2, milp_params, measures, measures2, forecasts):
+		"""
+		Checks whether the plan has to be solved again. The rest of the last plan is still optimal (and is used as
+		is) if the new horizon ends within the last plan's horizon, with the same settings, assets and forecasts of
+		the time steps left, and the measured SoC of each BESS is the one planned for the new beginning.
+		:return: True if there is no plan yet or the rest of the last plan may no longer be optimal
+		:rtype: bool
+		"""
+		start_at = pd.to_datetime(milp_params['init'])
+		if self.plan is None or start_at < self.plan_start or \
+				start_at + pd.Timedelta(hours=milp_params['horizon']) > self.plan_end:
+			return True
+		if ResultCache.key(settings, key_asset(bess_asset), key_asset(bess_asset2)) != self.plan_key:
+			return True
+
+		elapsed = int(round((start_at - self.plan_start) / pd.Timedelta(minutes=milp_params['step'])))
+		for key in ('loadForecasts', 'marketPrices'):
+			values = np.asarray(forecasts[key], dtype=float)
+			planned = np.asarray(self.plan_forecasts[key], dtype=float)[elapsed:elapsed + len(values)]
+			if not np.array_equal(values, planned):
+				return True
+
+		for measured, planned_soc, e_bess, asset in ((measures, self.plan_socs[0], 'e_bess', bess_asset),
+		                                             (measures2, self.plan_socs[1], 'e_bess2', bess_asset2)):
+			if elapsed > 0:
+				planned_soc = self.plan[e_bess][elapsed - 1] / asset['actualENom'] * 100
+			if not np.isclose(measured['bessSoC'], planned_soc, rtol=1e-6, atol=1e-6):
+				return True
+
+		return False
+
+	def replan(self, settings, bess_asset, bess_asset2, milp_params, measures, measures2, forecasts):
+		"""
+		Solves the plan of the horizon starting at milp_params["init"] from the measured SoC of each BESS. The last
+		plan, shifted by the steps elapsed since its beginning, is repaired for the measured SoC and used as MIP start;
+		if it is still optimal (see needs_replan), it is used as the new plan without solving.
+		:return: the optimizer, with the new plan's outputs
+		:rtype: module.core.Optimizer.Optimizer
+		"""
+		replan_t = time()
+		start_at = pd.to_datetime(milp_params['init'])
+		elapsed = 0
+		if self.plan is not None:
+			elapsed = int(round((start_at - self.plan_start) / pd.Timedelta(minutes=milp_params['step'])))
+
+		if not self.needs_replan(settings, bess_asset, bess_asset2, milp_params, measures, measures2, forecasts):
+			problem = self.problem
+			if elapsed > 0:
+				problem.outputs = {key: val[elapsed:] if isinstance(val, list) else val
+				                   for key, val in problem.outputs.items()}
+				problem.varis = shift_plan(problem.varis, elapsed)
+				self.plan, self.plan_start = problem.varis, start_at
+				self.plan_forecasts = {key: np.asarray(self.plan_forecasts[key])[elapsed:]
+				                       for key in ('loadForecasts', 'marketPrices')}
+				self.plan_socs = (measures['bessSoC'], measures2['bessSoC'])
+			self.skipped += 1
+		else:
+			incumbent = shift_plan(self.plan, elapsed) if self.plan is not None else None
+			problem = self.optimize(settings, bess_asset, bess_asset2, milp_params, measures, measures2, forecasts,
+			                        self.objective_function, self.session, incumbent)
+			if problem.outputs:
+				self.problem, self.plan, self.plan_forecasts = problem, problem.varis, forecasts
+				self.plan_start, self.plan_end = start_at, start_at + pd.Timedelta(hours=milp_params['horizon'])
+				self.plan_socs = (measures['bessSoC'], measures2['bessSoC'])
+				self.plan_key = ResultCache.key(settings, key_asset(bess_asset), key_asset(bess_asset2))
+		self.replans += 1
+		self.times.append(time() - replan_t)
+		logger.debug(f' - MPC: re-plan {self.replans} at {start_at} ({self.times[-1]:.3f}s; {self.skipped} kept)')
+
+		return problem
+
+
+def shift_plan(varis, elapsed):
+	"""
+	Drops the first "elapsed" time steps of a plan (already committed), so it starts at the new horizon's beginning;
+	the missing tail is filled in by the warm start (see warm_start_helpers.repair_incumbent).
+	:param varis: values of the decision variables of a plan, as in Optimizer.varis
+	:type varis: dict
+	:param elapsed: number of time steps since the plan's beginning
+	:type elapsed: int
+	:return: dictionary with the same structure
+	:rtype: dict
+	"""
+	if elapsed <= 0:
+		return varis
+
+	return {name: {s: list(v)[elapsed:] for s, v in values.items()} if isinstance(values, dict)
+	        else list(values)[elapsed:] for name, values in varis.items()}
@@ -0,0 +1,307 @@
+"""
+ModelReduction class. Structural reduction (presolve) of a SparseMilp, and reconstruction (postsolve) of the values of
+the original variables from the solution of the reduced problem.
+"""
+import numpy as np
+
+from loguru import logger
+from scipy.sparse import csr_matrix, vstack
+
+
+class ModelReduction:
+	def __init__(self, model, tol=1e-9, max_passes=50):
+		self.model = model  # original problem (SparseMilp), already assembled
+		self.tol = tol  # absolute tolerance used when comparing bounds
+		self.max_passes = max_passes  # maximum number of passes over the reduction rules
+		# **************************************************************************************************************
+		#        POSTSOLVE INFORMATION
+		# **************************************************************************************************************
+		self.offset = 0.0  # constant added to the objective function by the removed variables
+		self.kept_cols = None  # original indices of the columns of the reduced problem
+		self.fixed_cols = None  # original indices of the columns fixed to a value
+		self.fixed_values = None  # values of the fixed columns
+		self.substitutions = []  # (columns, pivots, rhs, matrix of the remaining terms) of each substitution batch
+		self.infeasible = False  # True if the reduction proved the problem infeasible
+		# **************************************************************************************************************
+		#        WORKING ARRAYS
+		# **************************************************************************************************************
+		self.__A = None  # all constraints' matrix (equality rows first)
+		self.__row_l = None  # rows' lower bounds
+		self.__row_u = None  # rows' upper bounds
+		self.__c = None  # objective function coefficients
+		self.__lb = None  # variables' lower bounds
+		self.__ub = None  # variables' upper bounds
+		self.__integer = None  # True for integer variables
+		self.__alive_rows = None  # rows not yet removed
+		self.__alive_cols = None  # columns not yet removed
+		self.__x_fixed = None  # values of the fixed columns (NaN for the others)
+
+	def reduce(self):
+		"""
+		Applies the reduction rules until no further reduction is found:
+		1) columns with equal bounds are fixed and removed;
+		2) empty rows are removed and singleton rows become bounds of their column;
+		3) columns whose increase (or decrease) can never violate a row are fixed at their best bound (dual fixing);
+		4) continuous columns defined by a single equality row, whose bounds are implied by it, are substituted out.
+		:return: the reduced problem, or None if the problem was proven infeasible
+		:rtype: module.core.SparseMilp.SparseMilp
+		"""
+		self.__initialize()
+		for _ in range(self.max_passes):
+			changed = self.__fix_columns()
+			if not self.__alive_cols.any() or self.infeasible:
+				break
+			matrix, rows, cols = self.__alive_matrix()
+			changed = self.__singleton_rows(matrix, rows, cols) or changed
+			if self.infeasible:
+				break
+			if changed:
+				continue
+			changed = self.__dual_fixing(matrix, rows, cols) or self.__substitutions(matrix, rows, cols)
+			if not changed:
+				break
+
+		if self.infeasible:
+			logger.debug(' - model reduction: problem proven infeasible')
+			return None
+
+		return self.__reduced_model()
+
+	def postsolve(self, x_reduced):
+		"""
+		Reconstructs the values of all original variables from the solution of the reduced problem.
+		:param x_reduced: variables' values of the reduced problem
+		:type x_reduced: numpy.ndarray
+		:return: variables' values of the original problem
+		:rtype: numpy.ndarray
+		"""
+		x = self.__x_fixed.copy()
+		x[self.kept_cols] = x_reduced
+		for cols, pivots, rhs, remaining in reversed(self.substitutions):
+			x[cols] = (rhs - remaining @ x) / pivots
+		x[self.__integer] = np.round(x[self.__integer])
+
+		return x
+
+	def __initialize(self):
+		"""
+		Copies the original problem into the working arrays.
+		:return: None
+		:rtype: None
+		"""
+		m = self.model
+		self.__A = vstack([m.A_eq, m.A_ub]).tocsr()
+		self.__A.eliminate_zeros()
+		self.__row_l = np.concatenate([m.b_eq, np.full(m.n_rows['ub'], -np.inf)])
+		self.__row_u = np.concatenate([m.b_eq, m.b_ub])
+		self.__c = m.c.astype(float)
+		self.__lb = m.lb.astype(float)
+		self.__ub = m.ub.astype(float)
+		self.__integer = m.integrality.astype(bool)
+		self.__alive_rows = np.ones(self.__A.shape[0], dtype=bool)
+		self.__alive_cols = np.ones(m.n_cols, dtype=bool)
+		self.__x_fixed = np.full(m.n_cols, np.nan)
+
+	def __alive_matrix(self):
+		"""
+		Returns the submatrix of the rows and columns not yet removed.
+		:return: submatrix and the original indices of its rows and columns
+		:rtype: (scipy.sparse.csr_matrix, numpy.ndarray, numpy.ndarray)
+		"""
+		rows = np.flatnonzero(self.__alive_rows)
+		cols = np.flatnonzero(self.__alive_cols)
+
+		return self.__A[rows][:, cols].tocsr(), rows, cols
+
+	def __fix_columns(self):
+		"""
+		Removes the columns whose bounds are equal, moving their contribution to the rows' bounds and the offset.
+		:return: True if any column was removed
+		:rtype: bool
+		"""
+		fixed = np.flatnonzero(self.__alive_cols & (self.__ub - self.__lb <= self.tol))
+		if not fixed.size:
+			return False
+
+		values = self.__lb[fixed]
+		values[self.__integer[fixed]] = np.round(values[self.__integer[fixed]])
+		self.__x_fixed[fixed] = values
+		self.offset += self.__c[fixed] @ values
+		shift = self.__A[:, fixed] @ values
+		self.__row_l -= shift
+		self.__row_u -= shift
+		self.__alive_cols[fixed] = False
+
+		return True
+
+	def __singleton_rows(self, matrix, rows, cols):
+		"""
+		Removes the empty rows and converts the rows with a single coefficient into bounds of their column.
+		:return: True if any row was removed
+		:rtype: bool
+		"""
+		nnz = np.diff(matrix.indptr)
+		row_l, row_u = self.__row_l[rows], self.__row_u[rows]
+
+		empty = nnz == 0
+		if np.any(empty & ((row_l > self.tol) | (row_u < -self.tol))):
+			self.infeasible = True
+			return False
+
+		singleton = np.flatnonzero(nnz == 1)
+		if singleton.size:
+			entries = matrix.indptr[singleton]
+			a = matrix.data[entries]
+			j = cols[matrix.indices[entries]]
+			with np.errstate(invalid='ignore'):
+				low = np.where(a > 0, row_l[singleton] / a, row_u[singleton] / a)
+				high = np.where(a > 0, row_u[singleton] / a, row_l[singleton] / a)
+			is_int = self.__integer[j]
+			low[is_int] = np.ceil(low[is_int] - self.tol)
+			high[is_int] = np.floor(high[is_int] + self.tol)
+			np.maximum.at(self.__lb, j, low)
+			np.minimum.at(self.__ub, j, high)
+			if np.any(self.__lb[j] > self.__ub[j] + self.tol):
+				self.infeasible = True
+				return False
+			self.__ub[j] = np.maximum(self.__ub[j], self.__lb[j])
+
+		removed = rows[empty | (nnz == 1)]
+		self.__alive_rows[removed] = False
+
+		return bool(removed.size)
+
+	def __dual_fixing(self, matrix, rows, cols):
+		"""
+		Fixes the columns that can be moved towards their best bound without ever violating a row.
+		:return: True if any column was fixed
+		:rtype: bool
+		"""
+		csc = matrix.tocsc()
+		entry_cols = np.repeat(np.arange(len(cols)), np.diff(csc.indptr))
+		row_l, row_u = self.__row_l[rows][csc.indices], self.__row_u[rows][csc.indices]
+		a = csc.data
+
+		# Decreasing (increasing) the column keeps every row feasible
+		down_safe = ((a > 0) & np.isneginf(row_l)) | ((a < 0) & np.isposinf(row_u))
+		up_safe = ((a < 0) & np.isneginf(row_l)) | ((a > 0) & np.isposinf(row_u))
+		down_safe = np.bincount(entry_cols, weights=~down_safe, minlength=len(cols)) == 0
+		up_safe = np.bincount(entry_cols, weights=~up_safe, minlength=len(cols)) == 0
+
+		c, lb, ub = self.__c[cols], self.__lb[cols], self.__ub[cols]
+		to_lb = down_safe & (c >= 0) & np.isfinite(lb)
+		to_ub = up_safe & (c <= 0) & np.isfinite(ub) & ~to_lb
+		self.__ub[cols[to_lb]] = lb[to_lb]
+		self.__lb[cols[to_ub]] = ub[to_ub]
+
+		return bool(to_lb.any() or to_ub.any())
+
+	def __substitutions(self, matrix, rows, cols):
+		"""
+		Substitutes out the continuous columns that appear in a single equality row and whose bounds are implied by
+		that row; the row is removed and the column's cost is moved to the remaining columns of the row.
+		:return: True if any column was substituted
+		:rtype: bool
+		"""
+		csc = matrix.tocsc()
+		candidates = np.flatnonzero((np.diff(csc.indptr) == 1) & ~self.__integer[cols])
+		if not candidates.size:
+			return False
+		local_rows = csc.indices[csc.indptr[candidates]]
+		pivots = csc.data[csc.indptr[candidates]]
+		is_eq = self.__row_l[rows[local_rows]] == self.__row_u[rows[local_rows]]
+		candidates, local_rows, pivots = candidates[is_eq], local_rows[is_eq], pivots[is_eq]
+
+		# Only one substitution per row
+		local_rows, first = np.unique(local_rows, return_index=True)
+		candidates, pivots = candidates[first], pivots[first]
+		if not candidates.size:
+			return False
+
+		# Range of the remaining terms of each row, given the bounds of their columns
+		lb, ub = self.__lb[cols], self.__ub[cols]
+		entry_rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+		a = matrix.data
+		with np.errstate(invalid='ignore'):
+			low_terms = np.where(a > 0, a * lb[matrix.indices], a * ub[matrix.indices])
+			high_terms = np.where(a > 0, a * ub[matrix.indices], a * lb[matrix.indices])
+		low_rest = self.__sum_without(low_terms, entry_rows, matrix, local_rows, candidates, lb, ub, pivots, True)
+		high_rest = self.__sum_without(high_terms, entry_rows, matrix, local_rows, candidates, lb, ub, pivots, False)
+
+		rhs = self.__row_l[rows[local_rows]]
+		with np.errstate(invalid='ignore'):
+			low = np.where(pivots > 0, (rhs - high_rest) / pivots, (rhs - low_rest) / pivots)
+			high = np.where(pivots > 0, (rhs - low_rest) / pivots, (rhs - high_rest) / pivots)
+		implied = (low >= lb[candidates] - self.tol) & (high <= ub[candidates] + self.tol)
+		if not implied.any():
+			return False
+		candidates, local_rows, pivots, rhs = candidates[implied], local_rows[implied], pivots[implied], rhs[implied]
+
+		# Remaining terms of each substituted row, over the original columns
+		remaining = matrix[local_rows].tocoo()
+		keep = remaining.col != candidates[remaining.row]
+		remaining = csr_matrix((remaining.data[keep], (remaining.row[keep], cols[remaining.col[keep]])),
+		                       shape=(len(candidates), self.model.n_cols))
+
+		# Move the cost of each substituted column to the remaining columns of its row
+		j = cols[candidates]
+		weights = self.__c[j] / pivots
+		self.offset += weights @ rhs
+		self.__c -= remaining.T @ weights
+
+		self.substitutions.append((j, pivots, rhs, remaining))
+		self.__alive_cols[j] = False
+		self.__alive_rows[rows[local_rows]] = False
+
+		return True
+
+	@staticmethod
+	def __sum_without(terms, entry_rows, matrix, local_rows, candidates, lb, ub, pivots, lower):
+		"""
+		Sums the terms of the given rows, excluding the term of the candidate column of each row.
+		Infinite terms are counted apart so they are not mixed with the finite ones.
+		:return: sum of the remaining terms of each row (+/- inf if any of them is infinite)
+		:rtype: numpy.ndarray
+		"""
+		n_rows = matrix.shape[0]
+		finite = np.isfinite(terms)
+		finite_sum = np.bincount(entry_rows, weights=np.where(finite, terms, 0.0), minlength=n_rows)
+		infinite_count = np.bincount(entry_rows, weights=~finite, minlength=n_rows)
+
+		# Term of the candidate column itself
+		if lower:
+			own = np.where(pivots > 0, pivots * lb[candidates], pivots * ub[candidates])
+		else:
+			own = np.where(pivots > 0, pivots * ub[candidates], pivots * lb[candidates])
+		own_finite = np.isfinite(own)
+		rest_sum = finite_sum[local_rows] - np.where(own_finite, own, 0.0)
+		rest_infinite = infinite_count[local_rows] - ~own_finite
+
+		return np.where(rest_infinite > 0, -np.inf if lower else np.inf, rest_sum)
+
+	def __reduced_model(self):
+		"""
+		Builds the reduced problem from the rows and columns not removed.
+		:return: reduced problem
+		:rtype: module.core.SparseMilp.SparseMilp
+		"""
+		m = self.model
+		self.kept_cols = np.flatnonzero(self.__alive_cols)
+		self.fixed_cols = np.flatnonzero(~np.isnan(self.__x_fixed))
+		self.fixed_values = self.__x_fixed[self.fixed_cols]
+
+		n_eq = m.n_rows['eq']
+		eq_rows = np.flatnonzero(self.__alive_rows[:n_eq])
+		ub_rows = n_eq + np.flatnonzero(self.__alive_rows[n_eq:])
+		A = self.__A[:, self.kept_cols]
+
+		reduced = type(m)(f'{m.name}_reduced', persistent=m.persistent)
+		reduced.load_arrays(self.__c[self.kept_cols], self.__lb[self.kept_cols], self.__ub[self.kept_cols],
+		                    m.integrality[self.kept_cols], A[eq_rows], self.__row_u[eq_rows],
+		                    A[ub_rows], self.__row_u[ub_rows])
+
+		logger.debug(f' - model reduced from {m.n_cols} columns ({int(m.integrality.sum())} integer) and '
+		             f'{sum(m.n_rows.values())} rows to {reduced.n_cols} columns '
+		             f'({int(reduced.integrality.sum())} integer) and {sum(reduced.n_rows.values())} rows')
+
+		return reduced
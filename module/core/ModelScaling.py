@@ -0,0 +1,116 @@
+"""
+ModelScaling class. Row, column and objective scaling of a SparseMilp, to reduce the spread of magnitudes of its
+coefficients, and unscaling of the solution of the scaled problem.
+"""
+import numpy as np
+
+from loguru import logger
+from scipy.sparse import diags, vstack
+
+
+class ModelScaling:
+	def __init__(self, model, max_passes=10, tol=1e-2):
+		self.model = model  # original problem (SparseMilp), already assembled
+		self.max_passes = max_passes  # maximum number of geometric scaling passes
+		self.tol = tol  # the passes stop when the coefficients' ratio improves less than this (relative) value
+		self.row_scale = None  # factor multiplying each row (equality rows first)
+		self.col_scale = None  # factor such that x = col_scale * x_scaled (1 for integer variables)
+		self.obj_scale = 1.0  # factor multiplying the objective function
+		self.stats = dict()  # coefficients' ratio (max/min absolute value) before and after scaling
+
+	def scale(self):
+		"""
+		Computes geometric mean scaling factors for the rows and the continuous columns, rounded to powers of 2 so
+		that scaling does not introduce rounding errors, plus an objective factor that brings its largest
+		coefficient close to 1.
+		:return: the scaled problem
+		:rtype: module.core.SparseMilp.SparseMilp
+		"""
+		m = self.model
+		A = abs(vstack([m.A_eq, m.A_ub]).tocsr())
+		A.eliminate_zeros()
+		continuous = ~m.integrality.astype(bool)
+		row_scale = np.ones(A.shape[0])
+		col_scale = np.ones(m.n_cols)
+
+		ratio = self.__ratio(A.data)
+		self.stats['matrix_before'] = ratio
+		for _ in range(self.max_passes):
+			scaled = diags(row_scale) @ A @ diags(col_scale)
+			row_scale *= self.__geometric_factors(scaled.tocsr())
+			scaled = diags(row_scale) @ A @ diags(col_scale)
+			col_scale[continuous] *= self.__geometric_factors(scaled.T.tocsr())[continuous]
+			new_ratio = self.__ratio((diags(row_scale) @ A @ diags(col_scale)).data)
+			if new_ratio > ratio * (1 - self.tol):
+				break
+			ratio = new_ratio
+
+		self.row_scale = np.exp2(np.round(np.log2(row_scale)))
+		self.col_scale = np.exp2(np.round(np.log2(col_scale)))
+		c = m.c * self.col_scale
+		c_max = np.abs(c).max() if c.any() else 1.0
+		self.obj_scale = float(np.exp2(np.round(-np.log2(c_max))))
+
+		n_eq = m.n_rows['eq']
+		r_eq, r_ub, s = diags(self.row_scale[:n_eq]), diags(self.row_scale[n_eq:]), diags(self.col_scale)
+		scaled = type(m)(f'{m.name}_scaled', persistent=m.persistent)
+		scaled.load_arrays(c * self.obj_scale, m.lb / self.col_scale, m.ub / self.col_scale, m.integrality,
+		                   r_eq @ m.A_eq @ s, m.b_eq * self.row_scale[:n_eq],
+		                   r_ub @ m.A_ub @ s, m.b_ub * self.row_scale[n_eq:])
+
+		self.stats['matrix_after'] = self.__ratio(vstack([scaled.A_eq, scaled.A_ub]).data)
+		self.stats['objective_before'] = self.__ratio(m.c)
+		self.stats['objective_after'] = self.__ratio(scaled.c)
+		logger.debug(f' - model scaled: coefficients\' ratio {self.stats["matrix_before"]:.3g} -> '
+		             f'{self.stats["matrix_after"]:.3g}, objective\'s ratio {self.stats["objective_before"]:.3g} -> '
+		             f'{self.stats["objective_after"]:.3g}')
+
+		return scaled
+
+	def scale_values(self, x):
+		"""
+		Converts values of the original variables (e.g. a MIP start) to the scaled problem.
+		:param x: values of the original variables
+		:type x: numpy.ndarray
+		:return: values of the scaled variables
+		:rtype: numpy.ndarray
+		"""
+		return x / self.col_scale
+
+	def unscale(self, x_scaled):
+		"""
+		Converts the solution of the scaled problem back to the original variables.
+		:param x_scaled: values of the scaled variables
+		:type x_scaled: numpy.ndarray
+		:return: values of the original variables
+		:rtype: numpy.ndarray
+		"""
+		return x_scaled * self.col_scale
+
+	@staticmethod
+	def __geometric_factors(matrix):
+		"""
+		Returns 1 / sqrt(max * min) of the absolute values of each row of a matrix (1 for empty rows).
+		:rtype: numpy.ndarray
+		"""
+		nnz = np.diff(matrix.indptr)
+		factors = np.ones(matrix.shape[0])
+		rows = np.flatnonzero(nnz)
+		if rows.size:
+			starts = matrix.indptr[rows]
+			row_max = np.maximum.reduceat(matrix.data, starts)
+			row_min = np.minimum.reduceat(matrix.data, starts)
+			factors[rows] = 1 / np.sqrt(row_max * row_min)
+
+		return factors
+
+	@staticmethod
+	def __ratio(values):
+		"""
+		Returns the ratio between the largest and the smallest nonzero absolute values of an array.
+		:rtype: float
+		"""
+		data = np.abs(values)
+		data = data[data > 0]
+
+		return float(data.max() / data.min()) if data.size else 1.0
@@ -1,25 +1,53 @@
 import helpers.milp_helpers as mhelper
+import helpers.warm_start_helpers as wshelper
 import math
 import numpy as np
 import pandas as pd
 
+from module.core.DynamicProgramming import DynamicProgramming
+from module.core.FleetAggregation import FleetAggregation
+from module.core.LagrangianDecomposition import LagrangianDecomposition
+from module.core.SparseMilp import SparseMilp
+from module.core.ThresholdDispatch import ThresholdDispatch
+from module.core.TimeGrid import TimeGrid
 from module.tasks.BESS import BESS
 from loguru import logger
 from pulp import *
-from time import asctime
+from time import asctime, time
 from settings.general_settings import GeneralSettings
+from uuid import uuid4
 
 seconds_in_min = 60
 minutes_in_hour = 60
 
+# Map between PuLP's solution status and the status written by CBC in the first line of its .sol file
+pulp2real_status = {
+	LpSolutionOptimal: 'Optimal',
+	LpSolutionIntegerFeasible: 'Stopped on time',
+	LpSolutionInfeasible: 'Infeasible',
+	LpSolutionUnbounded: 'Unbounded',
+	LpSolutionNoSolutionFound: 'Not Solved',
+}
+
 class Optimizer:
-	def __init__(self, plot=False, solver='CBC'):
+	def __init__(self, plot=False, solver='CBC', write_artifacts=False, persistent=False, heuristic=None,
+	             reduce_model=False, scale_model=False, portfolio=None, dp_resolution=12, relaxed=False,
+	             decompose_units=False, aggregate_fleet=False, aggregation_tol=0.05, merge_steps=False, fine_hours=None,
+	             coarse_step=None):
 		# **************************************************************************************************************
 		#         MILP PARAMETERS: PULP PARAMETERS
 		# **************************************************************************************************************
-		self.solv = solver  # solver chosen for the MILP
+		self.solv = solver  # solver chosen for the MILP ('CBC', 'GUROBI', 'HIGHS'), 'DP' or 'THRESHOLD' (heuristic)
 		self.mipgap = None  # controls the solvers tolerance; intolerant [0 - 1] futile
 		self.timeout = None  # solvers temporal limit to find optimal solution, in seconds
+		self.heuristic = heuristic  # LP-rounding heuristic: None, 'incumbent' (MIP start and cutoff) or 'fast' (final)
+		self.portfolio = portfolio  # configurations raced in parallel processes (see SolverPortfolio); None to use solv
+		self.solved_by = None  # solver (portfolio configuration) that produced the last solution
+		self.dp_resolution = dp_resolution  # DP: energy grid steps covered by each BESS at full power in one time step
+		self.relaxed = relaxed  # If True, the binaries are relaxed and only the (sparse) LP is solved, e.g. annual studies
+		self.decompose_units = decompose_units  # If True, the (sparse) model is solved by Lagrangian decomposition
+		self.aggregate_fleet = aggregate_fleet  # If True, similar BESS are solved as virtual batteries
+		self.aggregation_tol = aggregation_tol  # relative tolerance of the parameters of BESS aggregated together
 		# **************************************************************************************************************
 		#         MILP PARAMETERS: TIME PARAMETERS
 		# **************************************************************************************************************
@@ -30,14 +58,31 @@ class Optimizer:
 		#self.step_in_days = None
 		self.time_intervals = None  # number of time intervals per horizon
 		self.time_series = None  # ex.: for 1 day, range(96)
+		self.durations = None  # time interval of each step of the model, in hours (merged steps are longer)
+		self.merge_steps = merge_steps  # If True, consecutive steps with the same forecasts are merged (see TimeGrid)
+		self.fine_hours = fine_hours  # hours at the requested step before coarser ones (lossy; None to only merge)
+		self.coarse_step = coarse_step  # time interval, in minutes, of the steps past fine_hours
+		self.time_grid = None  # merged steps of the current run, expanded back to the requested step in the outputs
 		self.start_at = None  # datetime for initial time step
-		self.common_fname = f'{asctime().replace(":", "_").replace(" ", "_")}'  # files' name
+		self.common_fname = f'{asctime().replace(":", "_").replace(" ", "_")}_{uuid4().hex[:8]}'  # files' name
 		# **************************************************************************************************************
 		#         MILP PARAMETERS: OTHER
 		# **************************************************************************************************************
 		self.milp = 0  # stores the entire MILP problem (variables, objective function, restrictions and results)
 		self.opt_val = None  # stores the milp numeric solution
+		self.lower_bound = None  # lower bound of the optimal objective function value, when known (THRESHOLD, DECOMP.)
+		self.gap = None  # relative gap between opt_val and lower_bound, when known (THRESHOLD, DECOMP.)
+		self.column_groups = None  # columns of the PCC and of each BESS in the sparse model (for the decomposition)
+		self.pulp_blocks = None  # PuLP variables of each block, per time step (as the blocks of the sparse model)
 		self.stat = None  # stores the status of the milp solution
+		self.status_real = None  # stores the status reported by the solver itself (e.g. "Stopped on time")
+		self.write_artifacts = write_artifacts  # If True, .lp/.mps/.sol and outputs.json are kept; else only on failure
+		self.persistent = persistent  # If True, the (HiGHS) model is built once and only updated in later solves
+		self.reduce_model = reduce_model  # If True, the (HiGHS) model is structurally reduced before being solved
+		self.scale_model = scale_model  # If True, the model's rows/columns are scaled before being solved
+		self.incumbent = None  # feasible solution (same structure as varis) passed to the solver as a MIP start
+		self.incumbent_cutoff = False  # If True, the MIP start's objective (binaries fixed) is also used as cutoff
+		self.symmetric_pairs = []  # suffixes of consecutive interchangeable BESS (symmetry-breaking constraints added)
 		self.varis = None  # Dictionary to store all output variables values
 		self.outputs = None  # Dictionary with the same structure as the outputs JSON that will be sent to the client
 		self.plot = plot  # If True, the results will be plotted after solving the MILP; only for test mode
@@ -46,13 +91,16 @@ class Optimizer:
 		# **************************************************************************************************************
 		self.pcc_limit_value = None  # power limit that can be transacted with the grid at PCC in kW
 		self.add_on_inv = None  # activate add-on to calculate piecewise inverters' efficiencies' segments?
-		self.seg_series = range(2)  # iterator over the number of segments considered (hardcoded to 2)
+		self.seg_series = range(2)  # iterator over the (maximum) number of segments of the efficiency curves
 		self.add_on_soc = None  # activate add-on that considers the more realistic battery characteristics?
 		# **************************************************************************************************************
 		#         BESS PARAMETERS
 		# **************************************************************************************************************
-		self.bess = None  # harbours a class with methods and parameters used for all bess in the system
-		self.bess2 = None  # harbours a class with methods and parameters used for all bess in the system
+		self.fleet = []  # harbours the configured BESS of the site, in order (see initialize_fleet)
+		self.suffixes = []  # suffix of the variables' names and outputs' keys of each BESS of the fleet
+		self.bess = None  # first BESS of the fleet
+		self.bess2 = None  # second BESS of the fleet (the PuLP model covers exactly two BESS)
+		self.deg_weights = None  # cost of each kWh degraded in each BESS of the fleet (€/kWh), in the last solve
 		# **************************************************************************************************************
 		#         FORECASTS
 		# **************************************************************************************************************
@@ -61,6 +109,19 @@ class Optimizer:
 		self.feedin_tariffs = None  # forecasted feed-in-tariffs in €/kWh
 		self.market_prices = None  # forecasted market prices in €/kWh
 
+	def options(self):
+		"""
+		Options the optimizer was created with that change the results of a run (not the plots nor the files written),
+		under the names of the constructor's arguments, e.g. to tell apart the results of differently configured runs.
+		:return: dictionary of the options
+		:rtype: dict
+		"""
+		return dict(solver=self.solv, heuristic=self.heuristic, reduce_model=self.reduce_model,
+		            scale_model=self.scale_model, portfolio=self.portfolio, dp_resolution=self.dp_resolution,
+		            relaxed=self.relaxed, decompose_units=self.decompose_units, aggregate_fleet=self.aggregate_fleet,
+		            aggregation_tol=self.aggregation_tol, merge_steps=self.merge_steps, fine_hours=self.fine_hours,
+		            coarse_step=self.coarse_step, persistent=self.persistent)
+
 	def initialize(self, settings, bess_asset, bess_asset2, milp_params, measures, measures2, forecasts):
 		"""
 		Function to initialize all internal variables of the Optimizer class with the inputs from the client.
@@ -81,6 +142,24 @@ class Optimizer:
 		:return: None
 		:rtype: None
 		"""
+		self.initialize_fleet(settings, [bess_asset, bess_asset2], milp_params, [measures, measures2], forecasts)
+
+	def initialize_fleet(self, settings, bess_assets, milp_params, measures, forecasts):
+		"""
+		Same as initialize, for a site with any number of BESS (a fleet).
+		:param settings: the system configuration settings
+		:type settings: dict
+		:param bess_assets: the BESS configured, in order
+		:type bess_assets: list of dict
+		:param milp_params: the parameters set by the client for the MILP run
+		:type milp_params: dict
+		:param measures: the real-time measurements of each BESS, in the same order
+		:type measures: list of dict
+		:param forecasts: the forecasts required for the optimization horizon
+		:type forecasts: pandas.core.frame.DataFrame
+		:return: None
+		:rtype: None
+		"""
 		# MILP parameters: PuLP parameters
 		self.mipgap = milp_params.get('mipgap')
 		self.timeout = milp_params.get('timeout')
@@ -101,13 +180,19 @@ class Optimizer:
 		self.add_on_soc = settings['addOnSoc']
 		self.add_on_inv = settings['addOnInv']
 
-		# BESS parameters
-		self.bess = BESS()
-		self.bess2 = BESS()
+		# BESS parameters (reconfigured, not recreated, when the optimizer is reused between runs)
+		if len(self.fleet) != len(bess_assets):
+			self.fleet = [BESS() for _ in bess_assets]
+			self.suffixes = [mhelper.unit_suffix(k) for k in range(len(self.fleet))]
+		self.bess = self.fleet[0]
+		self.bess2 = self.fleet[1] if len(self.fleet) > 1 else None
 		subset_add_ons = {add_on: settings[add_on] for add_on in ('addOnSoc', 'addOnInv')}
 		subset_add_ons['addOnDeg'] = False
-		self.bess.configure(bess_asset, measures.get('bessSoC'), subset_add_ons)
-		self.bess2.configure(bess_asset2, measures2.get('bessSoC'), subset_add_ons)
+		for bess, bess_asset, bess_measures in zip(self.fleet, bess_assets, measures):
+			bess.configure(bess_asset, bess_measures.get('bessSoC'), subset_add_ons)
+		if self.add_on_inv:
+			self.seg_series = range(max(len(segments) for bess in self.fleet
+			                            for segments in (bess.eff_segments_ch, bess.eff_segments_disch)))
 
 
 		# Parse forecasts
@@ -116,6 +201,43 @@ class Optimizer:
 		self.market_prices = forecasts.get('marketPrices')
 		#self.feedin_tariffs = forecasts.get('feedinTariffs')
 
+		# Non-uniform time grid: consecutive steps with the same forecasts merged (and coarser steps later on, if set)
+		self.durations = np.full(self.time_intervals, self.step_in_hours)
+		self.time_grid = None
+		if self.merge_steps and self.solv not in ('DP', 'THRESHOLD'):
+			grid = TimeGrid(self.time_intervals, self.step_in_hours, self.fine_hours, self.coarse_step)
+			load_forecasts, market_prices = grid.build(self.load_forecasts, self.market_prices)
+			if len(grid.durations) < self.time_intervals:
+				logger.debug(f' - time grid: {self.time_intervals} steps merged into {len(grid.durations)}')
+				self.time_grid = grid
+				self.load_forecasts, self.market_prices = load_forecasts, market_prices
+				self.durations = grid.durations
+				self.time_intervals = len(grid.durations)
+				self.time_series = range(self.time_intervals)
+
+		# A MIP start only applies to the inputs it was set for
+		self.incumbent, self.incumbent_cutoff = None, False
+
+	def set_incumbent(self, varis, cutoff=False):
+		"""
+		Sets the initial incumbent (MIP start) of the next solve from a previous solution, typically the previous day's
+		varis. The charge/discharge set points are shifted to the new horizon and repaired to be feasible under the
+		new initial SoC; binaries and energy trajectories are recomputed from them. Must be called after initialize.
+		:param varis: dictionary with the values of the decision variables of a previous solution
+		:type varis: dict
+		:param cutoff: if True, the LP with the incumbent's binaries fixed is solved before the MILP, and its solution
+		is used as MIP start and its objective as cutoff
+		:type cutoff: bool
+		:return: True if a feasible incumbent was found
+		:rtype: bool
+		"""
+		# The previous solution is on the requested grid: its set points at the beginning of each merged step
+		if varis and self.time_grid is not None:
+			varis = self.time_grid.reduce(varis)
+		self.incumbent = wshelper.repair_incumbent(varis, self) if varis else None
+		self.incumbent_cutoff = cutoff
+
+		return self.incumbent is not None
 
 	def solve_milp(self, objective_function, bess_asset, bess_asset2 ):
 		"""
@@ -123,27 +245,252 @@ class Optimizer:
 		:return: None
 		:rtype: None
 		"""
+		# The degradation costs of both BESS are read from the first asset (objective "A") or from the second one
+		deg_weights = (bess_asset['K1'], bess_asset['K2']) if objective_function == "A" else \
+			(bess_asset2['C1'], bess_asset2['C2'])
+		self.solve_fleet(deg_weights)
+
+	def solve_fleet(self, deg_weights):
+		"""
+		Same as solve_milp, for a site with any number of BESS (see initialize_fleet).
+		:param deg_weights: cost of each kWh degraded in each BESS of the fleet (€/kWh)
+		:type deg_weights: list
+		:return: None
+		:rtype: None
+		"""
+		self.deg_weights = list(deg_weights)
+		# Clusters of similar BESS solved as virtual batteries
+		if self.aggregate_fleet and self.__solve_aggregated():
+			return
+
+		# Interchangeable BESS (same parameters and degradation costs) yield equivalent solutions that only differ in
+		# which BESS does what; ordering consecutive ones by discharged energy removes those from the search
+		self.symmetric_pairs = [(self.suffixes[k], self.suffixes[k + 1]) for k in range(len(self.fleet) - 1)
+		                        if self.fleet[k].is_identical_to(self.fleet[k + 1])
+		                        and self.deg_weights[k] == self.deg_weights[k + 1]]
+
+		# Engines that only model constant efficiencies (and, for THRESHOLD, static energy content limits) of one or
+		# two BESS
+		if len(self.fleet) <= 2 and (self.solv == 'DP' and not self.add_on_inv or
+		                             self.solv == 'THRESHOLD' and not (self.add_on_inv or self.add_on_soc)):
+			self.__solve_without_milp()
+			return
+		if self.solv in ('DP', 'THRESHOLD'):
+			logger.warning(f'The {self.solv} solver does not model the active add-ons or more than two BESS; solving '
+			               f'the MILP with HiGHS')
+
+		if self.symmetric_pairs:
+			logger.debug(f' - identical BESS: adding {len(self.symmetric_pairs)} symmetry-breaking constraint(s)')
+
 		logger.debug(' - defining MILP')
-		self.milp = self.__define_milp(objective_function, bess_asset, bess_asset2)
+		pulp_model = not (self.solv in ('HIGHS', 'DP', 'THRESHOLD') or self.portfolio or self.relaxed or
+		                  self.decompose_units)
+		if pulp_model and len(self.fleet) != 2:
+			logger.warning(f'The {self.solv} model covers exactly two BESS; solving the MILP with HiGHS')
+			pulp_model = False
+		if not pulp_model:
+			model = self.__define_sparse_milp()
+			# Keep the model (and the solver instance) of the previous run, updating only the values that changed
+			if self.persistent and isinstance(self.milp, SparseMilp) and self.milp.has_same_structure(model):
+				self.milp.update(model)
+			else:
+				self.milp = model
+		else:
+			self.milp = self.__define_milp()
+
+		# Relaxed mode: the LP relaxation's solution is the final solution
+		if self.relaxed:
+			self.milp.solve_relaxation()
+			self.stat = LpStatus[self.milp.status]
+			self.status_real = 'Relaxed' if self.milp.x is not None else self.milp.status_real
+			self.opt_val = self.milp.objective_value
+			self.solved_by = 'HIGHS'
+			return
+
+		# Lagrangian decomposition across the BESS: the best repaired schedule is the final solution, if any
+		if self.decompose_units and self.__solve_decomposed():
+			return
+
+		# MIP start with its continuous variables re-optimized: its objective is the cutoff
+		cutoff = None
+		if self.incumbent_cutoff and self.incumbent is not None:
+			cutoff = self.__evaluate_incumbent()
+
+		# Feasible schedule from the LP relaxation: final solution in "fast" mode, otherwise MIP start and cutoff
+		if self.heuristic is not None:
+			start, start_cutoff = self.incumbent, cutoff
+			cutoff = self.__lp_rounding()
+			if self.heuristic == 'fast' and cutoff is not None:
+				self.stat = LpStatus[self.milp.status]
+				self.status_real = 'Heuristic'
+				self.opt_val = cutoff
+				return
+			# The best of both MIP starts is kept
+			if start_cutoff is not None and (cutoff is None or start_cutoff < cutoff):
+				self.incumbent, cutoff = start, start_cutoff
+		if cutoff is not None:
+			# Small tolerance so the incumbent itself is not cut off
+			cutoff += 1e-6 * max(1.0, abs(cutoff))
+		self.__set_mip_start()
+		if not isinstance(self.milp, SparseMilp):
+			self.__set_pulp_solver(cutoff)
 
 		logger.debug(' - actually solving MILP')
 		# noinspection PyBroadException
 		try:
-			self.milp.solve()
+			if isinstance(self.milp, SparseMilp):
+				self.milp.solve(time_limit=self.timeout, mip_rel_gap=self.mipgap, cutoff=cutoff,
+				                portfolio=self.portfolio)
+				opt_val = self.milp.objective_value
+				status_real = self.milp.status_real
+				self.solved_by = self.milp.solved_by
+			else:
+				self.milp.solve()
+				opt_val = value(self.milp.objective)
+				status_real = pulp2real_status.get(self.milp.sol_status, 'Not Solved')
+				self.solved_by = self.solv
 			stat = LpStatus[self.milp.status]
-			opt_val = value(self.milp.objective)
 
 		except Exception:
 			logger.warning('Solver raised an error. Considering problem as "infeasible".')
 			stat = 'Infeasible'
+			status_real = 'Infeasible'
 			opt_val = None
 
 		self.stat = stat
+		self.status_real = status_real
 		self.opt_val = opt_val
+		if self.portfolio:
+			logger.info(f' - solver portfolio: solution from {self.solved_by}')
 
-	def __define_milp(self, objective_function, bess_asset, bess_asset2):
+		# Keep the model on disk for debugging purposes when the solver did not reach a solution
+		if stat != 'Optimal' and not self.write_artifacts:
+			self.__write_model(self.milp)
+
+	def __solve_aggregated(self):
+		"""
+		Solves the problem of the fleet through virtual batteries (see FleetAggregation): each cluster of BESS with
+		similar parameters is replaced by a single BESS, the smaller problem is solved as usual and the set points of
+		each virtual battery are then split among the BESS of its cluster. Not available with add_on_inv, as the
+		piecewise linearizations of different BESS cannot be summed.
+		:return: True if the fleet was aggregated and solved
+		:rtype: bool
+		"""
+		if self.add_on_inv:
+			logger.warning('Fleet aggregation does not support the add_on_inv; solving the whole fleet')
+			return False
+
+		aggregation = FleetAggregation(f'{self.common_fname}', tolerance=self.aggregation_tol)
+		virtual, virtual_weights = aggregation.aggregate(self.fleet, self.deg_weights, dynamic_limits=self.add_on_soc)
+		if len(virtual) == len(self.fleet):
+			logger.debug(' - fleet aggregation: no similar BESS to aggregate')
+			return False
+		logger.info(f' - fleet aggregation: {len(self.fleet)} BESS solved as {len(virtual)} virtual batteries')
+
+		# Solve the virtual batteries as the fleet (a MIP start of the BESS does not apply to them)
+		fleet = (self.fleet, self.suffixes, self.bess, self.bess2, self.deg_weights)
+		self.fleet, self.suffixes = virtual, [mhelper.unit_suffix(k) for k in range(len(virtual))]
+		self.bess, self.bess2 = virtual[0], virtual[1] if len(virtual) > 1 else None
+		self.aggregate_fleet, self.incumbent = False, None
+		try:
+			self.solve_fleet(virtual_weights)
+		finally:
+			self.fleet, self.suffixes, self.bess, self.bess2, self.deg_weights = fleet
+			self.aggregate_fleet, self.symmetric_pairs = True, []
+		if self.opt_val is None:
+			return True
+
+		if aggregation.disaggregate(self.milp, self.fleet, self.suffixes, self.deg_weights, self.market_prices,
+		                            self.durations, self.step_in_hours, self.add_on_soc) != LpStatusOptimal:
+			logger.warning(f'{aggregation.message}; solving the whole fleet')
+			return False
+
+		self.milp = aggregation
+		self.status_real = aggregation.status_real
+		self.opt_val = aggregation.objective_value
+		# The bound of the virtual batteries' problem, if any, does not apply to the fleet
+		self.lower_bound, self.gap = None, None
+
+		return True
+
+	def __solve_decomposed(self):
+		"""
+		Solves the sparse model by Lagrangian decomposition (see LagrangianDecomposition): the PCC and each BESS are
+		solved as separate subproblems, coupled only through the multipliers of the power equilibrium (and of the
+		symmetry-breaking constraint), and each combined schedule is repaired into a feasible one. A schedule outside
+		the gap tolerance is not final: it becomes the MIP start (and cutoff) of the whole MILP.
+		:return: True if a schedule within the gap tolerance was found
+		:rtype: bool
+		"""
+		logger.debug(' - solving by Lagrangian decomposition across the BESS')
+		decomposition = LagrangianDecomposition(self.milp, self.column_groups, repair=self.__repair_schedule,
+		                                        gap_tol=self.mipgap or 1e-3)
+		decomposition.solve()
+		if decomposition.values is None:
+			logger.warning('The Lagrangian decomposition found no feasible schedule; solving the whole MILP')
+			return False
+		if decomposition.status != LpStatusOptimal:
+			logger.info(f' - decomposition: gap {decomposition.gap:.2%} above the tolerance; solving the whole MILP '
+			            f'from its schedule')
+			self.incumbent = wshelper.unflatten_values(decomposition.values)
+			self.incumbent_cutoff = True
+			return False
+
+		# Load the best schedule into the model, as its solution
+		self.milp.solve_relaxation(decomposition.values)
+		self.stat = LpStatus[self.milp.status]
+		self.status_real = decomposition.status_real
+		self.opt_val = self.milp.objective_value
+		self.lower_bound = decomposition.lower_bound
+		self.gap = decomposition.gap
+		self.solved_by = 'DECOMPOSITION'
+		logger.info(f' - decomposition: objective {self.opt_val:.4f}, lower bound {self.lower_bound:.4f} '
+		            f'(gap {self.gap:.2%}, {decomposition.iterations} iteration(s))')
+
+		return True
+
+	def __solve_without_milp(self):
+		"""
+		Solves the dispatch problem without a MILP: by dynamic programming over a discretized energy content grid of
+		both BESS (DP, see DynamicProgramming) or by the price-threshold heuristic (THRESHOLD, see ThresholdDispatch),
+		both with a lower bound of the optimum (for DP, the LP relaxation of the MILP). Only valid with constant
+		efficiencies (add_on_inv off), one or two BESS and, for THRESHOLD, static energy content limits (add_on_soc
+		off).
+		:return: None
+		:rtype: None
 		"""
-		Method to define the generic MILP problem.
+		logger.debug(f' - solving with the {self.solv} engine')
+		if self.solv == 'DP':
+			self.milp = DynamicProgramming(f'{self.common_fname}', resolution=self.dp_resolution)
+			unit_options = dict(dynamic_limits=self.add_on_soc)
+		else:
+			self.milp = ThresholdDispatch(f'{self.common_fname}')
+			unit_options = dict()
+		self.milp.set_pcc(self.load_forecasts, self.market_prices, self.pcc_limit_value, self.step_in_hours)
+		for bess, sfx, deg_weight in zip(self.fleet, self.suffixes, self.deg_weights):
+			self.milp.add_unit(bess, sfx, deg_weight, **unit_options)
+		self.milp.solve()
+
+		self.stat = LpStatus[self.milp.status]
+		self.status_real = self.milp.status_real
+		self.opt_val = self.milp.objective_value
+		self.lower_bound = getattr(self.milp, 'lower_bound', None)
+		self.gap = getattr(self.milp, 'gap', None)
+		self.solved_by = self.solv
+		# The DP schedule is only optimal on its grid: the LP relaxation of the MILP bounds its distance to the optimum
+		if self.solv == 'DP' and self.opt_val is not None:
+			relaxation = self.__define_sparse_milp()
+			relaxation.solve_relaxation()
+			if relaxation.x is not None:
+				self.lower_bound = relaxation.objective_value
+				self.gap = (self.opt_val - self.lower_bound) / max(abs(self.opt_val), 1e-9)
+		if self.gap is not None:
+			logger.info(f' - {self.solv}: objective {self.opt_val:.4f}, lower bound {self.lower_bound:.4f} '
+			            f'(gap {self.gap:.2%})')
+
+	def __define_milp(self):
+		"""
+		Method to define the generic MILP problem, for a site with exactly two BESS.
 		:return: object with the milp problem ready for solving and easy access to all parameters, variables and results
 		:rtype: pulp.pulp.LpProblem
 		"""
@@ -151,11 +498,7 @@ class Optimizer:
 		#        ADDITIONAL PARAMETERS
 		# **************************************************************************************************************
 		T = self.time_series
-		S = self.seg_series
-		k1 = bess_asset['K1']
-		k2 = bess_asset['K2']
-		C1 = bess_asset2['C1']
-		C2 = bess_asset2['C2']
+		k1, k2 = self.deg_weights
 		# To calculate the dynamic energy content limits, in kWh, a linearization was generated which is dependent on
 		# the charge/discharge current (kA) and not directly on the charge/discharge power (kW).
 		# Being so, we create a constant here that will
@@ -172,84 +515,55 @@ class Optimizer:
 		#        OPTIMIZATION PROBLEM
 		# **************************************************************************************************************
 		self.milp = LpProblem(f'{self.common_fname}', LpMinimize)
+		self.pulp_blocks = dict()
 
 		# **************************************************************************************************************
 		#       INITIALIZE DECISION VARIABLES
 		# **************************************************************************************************************
 		# P absorption at the PCC (kW)
-		p_abs = [LpVariable(f'p_abs_{t:03d}', lowBound=0) for t in T]
+		p_abs = self.__add_pulp_variables('p_abs', lowBound=0)
 		# P injection at the PCC (kW)
-		#p_inj = [LpVariable(f'p_inj_{t:03d}', lowBound=0) for t in T]
+		#p_inj = self.__add_pulp_variables('p_inj', lowBound=0)
 		# Aux. binary variable for non simultaneity of PCC flows
-		delta_pcc = [LpVariable(f'delta_pcc_{t:03d}', cat=LpBinary) for t in T]
+		delta_pcc = self.__add_pulp_variables('delta_pcc', cat=LpBinary)
 		# Energy content of the BESS (kWh)
-		e_bess = [LpVariable(f'e_bess_{t:03d}', lowBound=0) for t in T]
+		e_bess = self.__add_pulp_variables('e_bess', lowBound=0)
 		# Energy content of the BESS (kWh)
-		e_bess2 = [LpVariable(f'e_bess2_{t:03d}', lowBound=0) for t in T]
+		e_bess2 = self.__add_pulp_variables('e_bess2', lowBound=0)
 		# Energy degraded per time step (kWh)
-		e_deg = [LpVariable(f'e_deg_{t:03d}', lowBound=0) for t in T]
+		e_deg = self.__add_pulp_variables('e_deg', lowBound=0)
 		# Energy degraded per time step (kWh)
-		e_deg2 = [LpVariable(f'e_deg2_{t:03d}', lowBound=0) for t in T]
+		e_deg2 = self.__add_pulp_variables('e_deg2', lowBound=0)
 		# Max E content for p_ch set point (kWh)
-		max_e_bes = [LpVariable(f'max_e_bes_{t:03d}', lowBound=0) for t in T]
+		max_e_bes = self.__add_pulp_variables('max_e_bes', lowBound=0)
 		# Min E content for p_disch set point (kWh)
-		min_e_bes = [LpVariable(f'min_e_bes_{t:03d}', lowBound=0) for t in T]
+		min_e_bes = self.__add_pulp_variables('min_e_bes', lowBound=0)
 		# Max E content for p_ch set point (kWh)
-		max_e_bes2 = [LpVariable(f'max_e_bes2_{t:03d}', lowBound=0) for t in T]
+		max_e_bes2 = self.__add_pulp_variables('max_e_bes2', lowBound=0)
 		# Min E content for p_disch set point (kWh)
-		min_e_bes2 = [LpVariable(f'min_e_bes2_{t:03d}', lowBound=0) for t in T]
+		min_e_bes2 = self.__add_pulp_variables('min_e_bes2', lowBound=0)
 
 		if not self.add_on_inv:
 			# Charge P at AC-side of the BESS (kW)
-			p_ch = [LpVariable(f'p_ch_{t:03d}', lowBound=0) for t in T]
+			p_ch = self.__add_pulp_variables('p_ch', lowBound=0)
 			# Discharge P at AC-side of the BESS (kW)
-			p_disch = [LpVariable(f'p_disch_{t:03d}', lowBound=0) for t in T]
+			p_disch = self.__add_pulp_variables('p_disch', lowBound=0)
 			# Aux. binary variable for non simultaneity of BESS flows
-			delta_bess = [LpVariable(f'delta_bess_{t:03d}', cat=LpBinary) for t in T]
+			delta_bess = self.__add_pulp_variables('delta_bess', cat=LpBinary)
 
 
 			# Charge P at AC-side of the BESS (kW)
-			p_ch2 = [LpVariable(f'p_ch2_{t:03d}', lowBound=0) for t in T]
+			p_ch2 = self.__add_pulp_variables('p_ch2', lowBound=0)
 			# Discharge P at AC-side of the BESS (kW)
-			p_disch2 = [LpVariable(f'p_disch2_{t:03d}', lowBound=0) for t in T]
+			p_disch2 = self.__add_pulp_variables('p_disch2', lowBound=0)
 			# Aux. binary variable for non simultaneity of BESS flows
-			delta_bess2 = [LpVariable(f'delta_bess2_{t:03d}', cat=LpBinary) for t in T]
+			delta_bess2 = self.__add_pulp_variables('delta_bess2', cat=LpBinary)
 
 
 		else:
-			# Charge P in 1st segment at DC-side of the BESS (kW)
-			z_ch = [LpVariable(f'z_ch_{t:03d}', lowBound=0) for t in T]
-			# Discharge P in 1st segment at DC-side of the BESS (kW)
-			z_disch = [LpVariable(f'z_disch_{t:03d}', lowBound=0) for t in T]
-			# Charge P at AC-side of the BESS (kW)
-			p_ch = {s: [LpVariable(f'p_ch_{s}_{t:03d}', lowBound=0) for t in T] for s in S}
-			# Discharge P at AC-side of the BESS (kW)
-			p_disch = {s: [LpVariable(f'p_disch_{s}_{t:03d}', lowBound=0) for t in T] for s in S}
-			# Aux. binary for setting the charge limits of the BESS
-			delta_bess_ch = {s: [LpVariable(f'delta_bess_ch_{s}_{t:03d}', cat=LpBinary) for t in T] for s in S}
-			# Aux. binary for setting the discharge limits of the BESS
-			delta_bess_disch = {s: [LpVariable(f'delta_bess_disch_{s}_{t:03d}', cat=LpBinary) for t in T] for s in S}
-			# Charge P at AC-side of the BESS (kW)
-			e_bess = [LpVariable(f'e_bess_{t:03d}', lowBound=0) for t in T]
-			# Aux. binary variable for non simultaneity of BESS flows
-			delta_bess = [LpVariable(f'delta_bess_{t:03d}', cat=LpBinary) for t in T]
-
-			# Charge P in 1st segment at DC-side of the BESS (kW)
-			z_ch2 = [LpVariable(f'z_ch2_{t:03d}', lowBound=0) for t in T]
-			# Discharge P in 1st segment at DC-side of the BESS (kW)
-			z_disch2 = [LpVariable(f'z_disch2_{t:03d}', lowBound=0) for t in T]
-			# Charge P at AC-side of the BESS (kW)
-			p_ch2 = {s: [LpVariable(f'p_ch2_{s}_{t:03d}', lowBound=0) for t in T] for s in S}
-			# Discharge P at AC-side of the BESS (kW)
-			p_disch2 = {s: [LpVariable(f'p_disch2_{s}_{t:03d}', lowBound=0) for t in T] for s in S}
-			# Aux. binary for setting the charge limits of the BESS
-			delta_bess_ch2 = {s: [LpVariable(f'delta_bess_ch2_{s}_{t:03d}', cat=LpBinary) for t in T] for s in S}
-			# Aux. binary for setting the discharge limits of the BESS
-			delta_bess_disch2 = {s: [LpVariable(f'delta_bess_disch2_{s}_{t:03d}', cat=LpBinary) for t in T] for s in S}
-			# Charge P at AC-side of the BESS (kW)
-			e_bess2 = [LpVariable(f'e_bess2_{t:03d}', lowBound=0) for t in T]
-			# Aux. binary variable for non simultaneity of BESS flows
-			delta_bess2 = [LpVariable(f'delta_bess2_{t:03d}', cat=LpBinary) for t in T]
+			# Variables and constraints of the piecewise linearization of the efficiency curves, per BESS
+			p_ch, p_disch, bes_charges, bes_discharges = self.__add_piecewise_eff(self.bess, '')
+			p_ch2, p_disch2, bes_charges2, bes_discharges2 = self.__add_piecewise_eff(self.bess2, '2')
 
 		# **************************************************************************************************************
 		#        OBJECTIVE FUNCTION
@@ -258,10 +572,7 @@ class Optimizer:
 		# self.milp += lpSum(p_abs[t] * self.market_prices[t] + e_deg[t] + e_deg2[t] for t in self.time_series) * self.step_in_hours, 'Objective Function'
 		#self.milp += lpSum(p_abs[t] * self.market_prices[t] for t in self.time_series) * self.step_in_hours, 'Objective Function'
 
-		if objective_function == "A":
-			self.milp += lpSum((p_abs[t] * self.market_prices[t] + k1 * e_deg[t] + k2 * e_deg2[t]) for t in self.time_series) * self.step_in_hours, 'Objective Function'
-		else:
-			self.milp += lpSum((p_abs[t] * self.market_prices[t] + C1 * e_deg[t] + C2 * e_deg2[t]) for t in self.time_series) * self.step_in_hours, 'Objective Function'
+		self.milp += lpSum(p_abs[t] * self.market_prices[t] * self.durations[t] + (k1 * e_deg[t] + k2 * e_deg2[t]) * self.step_in_hours for t in self.time_series), 'Objective Function'
 
 		#self.milp += lpSum(p_abs[t] * self.market_prices[t] - p_inj[t] * self.feedin_tariffs[t] for t in self.time_series) * self.step_in_hours, 'Objective Function'
 
@@ -275,8 +586,8 @@ class Optimizer:
 				bess_flows = p_ch[t] - p_disch[t]
 				bess_flows2 = p_ch2[t] - p_disch2[t]
 			else:
-				bess_flows = lpSum((p_ch[s][t] - p_disch[s][t]) for s in S)
-				bess_flows2 = lpSum((p_ch2[s][t] - p_disch2[s][t]) for s in S)
+				bess_flows = lpSum(p_ch[s][t] for s in p_ch) - lpSum(p_disch[s][t] for s in p_disch)
+				bess_flows2 = lpSum(p_ch2[s][t] for s in p_ch2) - lpSum(p_disch2[s][t] for s in p_disch2)
 
 			#  -- define the liquid consumption as load - generation (without bess flows)
 			#generation_and_demand = (self.load_forecasts[t] - self.pv_forecasts[t])
@@ -315,74 +626,11 @@ class Optimizer:
 							 f'Max_AC_discharge2_rate_{t:03d}'
 
 			else:
-				# Define variables for charging and discharging at DC-side
-				bes_charge = z_ch[t] + p_ch[1][t] * self.bess.const_eff_ch
-				bes_discharge = z_disch[t] + p_disch[1][t] * 1 / self.bess.const_eff_disch
-				bes_charge2 = z_ch2[t] + p_ch2[1][t] * self.bess2.const_eff_ch
-				bes_discharge2 = z_disch2[t] + p_disch2[1][t] * 1 / self.bess2.const_eff_disch
-
-				# Eq. (16) and (17)
-				# -- define the applicable charge and discharge limits at AC-side
-				for s in self.seg_series:
-						if s == 0:
-							min_climit = self.bess.p_ac_min_c_1 * delta_bess_ch[s][t]
-							max_climit = self.bess.p_ac_max_c_1 * delta_bess_ch[s][t]
-							min_dlimit = self.bess.p_ac_min_d_1 * delta_bess_disch[s][t]
-							max_dlimit = self.bess.p_ac_max_d_1 * delta_bess_disch[s][t]
-							min_climit2 = self.bess2.p_ac_min_c_1 * delta_bess_ch2[s][t]
-							max_climit2 = self.bess2.p_ac_max_c_1 * delta_bess_ch2[s][t]
-							min_dlimit2 = self.bess2.p_ac_min_d_1 * delta_bess_disch2[s][t]
-							max_dlimit2 = self.bess2.p_ac_max_d_1 * delta_bess_disch2[s][t]
-
-						else:
-							min_climit = self.bess.p_ac_min_c_2 * delta_bess_ch[s][t]
-							max_climit = self.bess.p_ac_max_c * delta_bess_ch[s][t]
-							min_dlimit = self.bess.p_ac_min_d_2 * delta_bess_disch[s][t]
-							max_dlimit = self.bess.p_ac_max_d * delta_bess_disch[s][t]
-							min_climit2 = self.bess2.p_ac_min_c_2 * delta_bess_ch2[s][t]
-							max_climit2 = self.bess2.p_ac_max_c * delta_bess_ch2[s][t]
-							min_dlimit2 = self.bess2.p_ac_min_d_2 * delta_bess_disch2[s][t]
-							max_dlimit2= self.bess2.p_ac_max_d * delta_bess_disch2[s][t]
-
-
-						# -- Eq. (16 left-side)
-						self.milp += min_climit <= p_ch[s][t], f'Min_AC_charge_rate_{s}_{t:03d}'
-						self.milp += min_climit2 <= p_ch2[s][t], f'Min_AC_charge_rate2_{s}_{t:03d}'
-						# -- Eq. (16 right-side)
-						self.milp += p_ch[s][t] <= max_climit, f'Max_AC_charge_rate_{s}_{t:03d}'
-						self.milp += p_ch2[s][t] <= max_climit2, f'Max_AC_charge_rate2_{s}_{t:03d}'
-						# -- Eq. (17 left-side)
-						self.milp += min_dlimit <= p_disch[s][t], f'Min_AC_discharge_rate_{s}_{t:03d}'
-						self.milp += min_dlimit2 <= p_disch2[s][t], f'Min_AC_discharge_rate2_{s}_{t:03d}'
-						# -- Eq. (17 right-side)
-						self.milp += p_disch[s][t] <= max_dlimit, f'Max_AC_discharge_rate_{s}_{t:03d}'
-						self.milp += p_disch2[s][t] <= max_dlimit2, f'Max_AC_discharge_rate2_{s}_{t:03d}'
-
-				# Eq. (25)
-				self.milp += z_ch[t] == self.bess.sl_eff_ch * p_ch[0][t] \
-								+ self.bess.or_eff_ch * delta_bess_ch[0][t], \
-								f'Z_ch_{t:03d}'
-				self.milp += z_ch2[t] == self.bess2.sl_eff_ch * p_ch2[0][t] \
-								+ self.bess2.or_eff_ch * delta_bess_ch2[0][t], \
-							    f'Z_ch2_{t:03d}'
-
-
-				# Eq. (26)
-				self.milp += z_disch[t] == self.bess.sl_eff_disch * p_disch[0][t] \
-									 + self.bess.or_eff_disch * delta_bess_disch[0][t], \
-									 f'Z_disch_{t:03d}'
-
-				self.milp += z_disch2[t] == self.bess2.sl_eff_disch * p_disch2[0][t] \
-								 + self.bess2.or_eff_disch * delta_bess_disch2[0][t], \
-						f'Z_disch2_{t:03d}'
-
-
-				# Eq. (27)
-				self.milp += lpSum((delta_bess_ch[s][t] + delta_bess_disch[s][t]) for s in self.seg_series) <= 1, \
-									 f'Non_BESS_simultaneity_{t:03d}'
-
-				self.milp += lpSum((delta_bess_ch2[s][t] + delta_bess_disch2[s][t]) for s in self.seg_series) <= 1, \
-						f'Non_BESS_simultaneity2_{t:03d}'
+				# Charging and discharging at DC-side, from the piecewise linearization of the efficiency curves
+				bes_charge = bes_charges[t]
+				bes_discharge = bes_discharges[t]
+				bes_charge2 = bes_charges2[t]
+				bes_discharge2 = bes_discharges2[t]
 
 			# Eq. (7) / (18)
 			self.milp += bes_charge <= self.bess.p_dc_max_c, f'Max_DC_charge_rate_{t:03d}'
@@ -395,8 +643,8 @@ class Optimizer:
 			#self.milp += p_disch2[t] <= self.bess2.p_dc_max_d * (1 - delta_bess[t]), f'Max_DC_discharge2_rate_{t:03d}'
 
 			# Update to BESS energy content
-			e_bess_update = (bes_charge - bes_discharge) * self.step_in_hours
-			e_bess_update2 = (bes_charge2 - bes_discharge2) * self.step_in_hours
+			e_bess_update = (bes_charge - bes_discharge) * self.durations[t]
+			e_bess_update2 = (bes_charge2 - bes_discharge2) * self.durations[t]
 			if t == 0:
 				# Eq. (9) / (20)
 				self.milp += e_bess[t] == self.bess.initial_e_bess + e_bess_update, f'Initial_E_update_{t:03d}'
@@ -437,286 +685,678 @@ class Optimizer:
 			self.milp += e_bess2[t] <= max_e_bes2[t], f'E_content_high_boundary2_{t:03d}'
 
 		 	#Eq. (12) / (23)
-			self.milp += e_deg[t] == self.bess.deg_slope * bes_discharge * self.step_in_hours, f'Degradation_{t:03d}'
-			self.milp += e_deg2[t] == self.bess2.deg_slope * bes_discharge2 * self.step_in_hours, f'Degradation2_{t:03d}'
+			self.milp += e_deg[t] == self.bess.deg_slope * bes_discharge * self.durations[t], f'Degradation_{t:03d}'
+			self.milp += e_deg2[t] == self.bess2.deg_slope * bes_discharge2 * self.durations[t], f'Degradation2_{t:03d}'
 
+		# Symmetry breaking: with interchangeable BESS, the first one discharges at least as much energy as the second
+		if self.symmetric_pairs:
+			if not self.add_on_inv:
+				self.milp += lpSum(p_disch) >= lpSum(p_disch2), 'Symmetry_breaking'
+			else:
+				self.milp += lpSum(p_disch[s][t] for s in p_disch for t in T) >= \
+				             lpSum(p_disch2[s][t] for s in p_disch2 for t in T), 'Symmetry_breaking'
 
-		# **************************************************************************************************************
 
-		dir_name = os.path.abspath(os.path.join(__file__, '..'))
-		lp_name = os.path.join(dir_name, f'{self.common_fname}.lp')
-		self.milp.writeLP(lp_name)
+		# **************************************************************************************************************
 
-		# The problem is solved using PuLP's choice of Solver
-		if self.solv == 'CBC':
-			self.milp.setSolver(pulp.PULP_CBC_CMD(msg=False, timeLimit=self.timeout, gapRel=self.mipgap, keepFiles=True))
-		elif self.solv == 'GUROBI':
-			self.milp.setSolver(GUROBI_CMD(msg=False, timeLimit=self.timeout, mip=self.mipgap))
+		if self.write_artifacts:
+			self.__write_model(self.milp)
 
 		return self.milp
 
-	def generate_outputs(self, objective_function, bess_asset, bess_asset2):
+	def __add_pulp_variables(self, name, **kwargs):
 		"""
-		Function for generating the outputs of optimization, namely the set points for each asset and all relevant
-		variables, and to convert them into JSON format.
-		:return: None
-		:rtype: None
+		Creates a block of PuLP variables, one per time step, and registers it under its name (as the blocks of the
+		sparse model), so that the variables are later accessed by block and time step index, not by parsing names.
+		:param name: name of the block of variables
+		:type name: str
+		:return: variables of the block, per time step
+		:rtype: list of pulp.LpVariable
 		"""
-		if self.opt_val is None:
-			# To avoid raising error whenever encountering the puLP solver error with CBC
-			self.outputs = {}
+		self.pulp_blocks[name] = [LpVariable(f'{name}_{t:03d}', **kwargs) for t in self.time_series]
+
+		return self.pulp_blocks[name]
+
+	def __add_piecewise_eff(self, bess, sfx):
+		"""
+		Adds the variables and constraints of the piecewise linearization of the efficiency curves of a BESS to the
+		PuLP problem (add_on_inv). With convex curves, the segments are filled in order without segment binaries and a
+		single binary per time step prevents simultaneous charge and discharge.
+		:param bess: the BESS configured
+		:type bess: module.tasks.BESS.BESS
+		:param sfx: suffix of the BESS's variables and constraints' names
+		:type sfx: str
+		:return: AC charge and discharge P variables per segment and DC charge and discharge P per time step
+		:rtype: (dict, dict, list, list)
+		"""
+		T = self.time_series
+		Sc = range(len(bess.eff_segments_ch))
+		Sd = range(len(bess.eff_segments_disch))
+
+		# Charge/discharge P in all but the last segment at DC-side of the BESS (kW)
+		z_ch = self.__add_pulp_variables(f'z_ch{sfx}', lowBound=0)
+		z_disch = self.__add_pulp_variables(f'z_disch{sfx}', lowBound=0)
+		# Charge/discharge P at AC-side of the BESS (kW)
+		p_ch = {s: self.__add_pulp_variables(f'p_ch{sfx}_{s}', lowBound=0) for s in Sc}
+		p_disch = {s: self.__add_pulp_variables(f'p_disch{sfx}_{s}', lowBound=0) for s in Sd}
+
+		if bess.convex_eff:
+			# Aux. binary variable for non simultaneity of BESS flows
+			delta_bess = self.__add_pulp_variables(f'delta_bess{sfx}', cat=LpBinary)
+			# Filled in order, the segments' origins cancel out
+			delta_bess_ch, delta_bess_disch = None, None
 		else:
-			self.__get_variables_values()
-			self.__initialize_and_populate_outputs(objective_function, bess_asset, bess_asset2)
+			# Aux. binaries for setting the charge/discharge limits of the BESS
+			delta_bess_ch = {s: self.__add_pulp_variables(f'delta_bess_ch{sfx}_{s}', cat=LpBinary) for s in Sc}
+			delta_bess_disch = {s: self.__add_pulp_variables(f'delta_bess_disch{sfx}_{s}', cat=LpBinary)
+			                    for s in Sd}
+
+		def dc_power(segments, p, delta, s_range, t):
+			# DC power of the segments in s_range: slope * AC power (+ origin when the segment is active)
+			return lpSum(segments[s][2] * p[s][t] + (segments[s][3] * delta[s][t] if delta and segments[s][3] else 0)
+			             for s in s_range)
+
+		bes_charges, bes_discharges = [], []
+		for t in T:
+			# Eq. (16) and (17)
+			# -- define the applicable charge and discharge limits at AC-side
+			if bess.convex_eff:
+				for s, (low, high, _, _) in enumerate(bess.eff_segments_ch):
+					self.milp += p_ch[s][t] <= (high - low) * delta_bess[t], f'Max_AC_charge_rate{sfx}_{s}_{t:03d}'
+				for s, (low, high, _, _) in enumerate(bess.eff_segments_disch):
+					self.milp += p_disch[s][t] <= (high - low) * (1 - delta_bess[t]), \
+					             f'Max_AC_discharge_rate{sfx}_{s}_{t:03d}'
+			else:
+				for s, (low, high, _, _) in enumerate(bess.eff_segments_ch):
+					self.milp += low * delta_bess_ch[s][t] <= p_ch[s][t], f'Min_AC_charge_rate{sfx}_{s}_{t:03d}'
+					self.milp += p_ch[s][t] <= high * delta_bess_ch[s][t], f'Max_AC_charge_rate{sfx}_{s}_{t:03d}'
+				for s, (low, high, _, _) in enumerate(bess.eff_segments_disch):
+					self.milp += low * delta_bess_disch[s][t] <= p_disch[s][t], \
+					             f'Min_AC_discharge_rate{sfx}_{s}_{t:03d}'
+					self.milp += p_disch[s][t] <= high * delta_bess_disch[s][t], \
+					             f'Max_AC_discharge_rate{sfx}_{s}_{t:03d}'
 
-		# Generate the outputs JSON file
-		master_path = os.path.abspath(os.path.join(__file__, '..', '..', '..'))
-		#structures_path = os.path.join('json', 'outputs.json')
-		structures_path = os.path.join('outputs.json')
-		output_path = os.path.join(master_path, structures_path)
-		with open(output_path, 'w') as outfile:
-			json.dump(self.outputs, outfile)
+				# Eq. (27)
+				self.milp += lpSum(delta_bess_ch[s][t] for s in Sc) + lpSum(delta_bess_disch[s][t] for s in Sd) <= 1, \
+				             f'Non_BESS_simultaneity{sfx}_{t:03d}'
 
-		if self.plot:
-			from graphics.plot_results import plot_results
-			plot_results(self)
+			# Eq. (25) and (26)
+			self.milp += z_ch[t] == dc_power(bess.eff_segments_ch, p_ch, delta_bess_ch, Sc[:-1], t), \
+			             f'Z_ch{sfx}_{t:03d}'
+			self.milp += z_disch[t] == dc_power(bess.eff_segments_disch, p_disch, delta_bess_disch, Sd[:-1], t), \
+			             f'Z_disch{sfx}_{t:03d}'
 
-	def __get_variables_values(self):
+			bes_charges.append(z_ch[t] + dc_power(bess.eff_segments_ch, p_ch, delta_bess_ch, Sc[-1:], t))
+			bes_discharges.append(z_disch[t] + dc_power(bess.eff_segments_disch, p_disch, delta_bess_disch, Sd[-1:], t))
+
+		return p_ch, p_disch, bes_charges, bes_discharges
+
+	def __set_pulp_solver(self, cutoff=None):
 		"""
-		Function for retrieving and storing the values of each decision variable into a dictionary.
+		Sets the solver of the PuLP problem, with the MIP start and cutoff when available.
+		:param cutoff: objective value above which solutions are discarded
+		:type cutoff: float
 		:return: None
 		:rtype: None
 		"""
-		# **************************************************************************************************************
-		#        INITIALIZE DECISION VARIABLES
-		# **************************************************************************************************************
-		self.varis = dict()
+		# The problem is solved using PuLP's choice of Solver
+		if self.solv == 'CBC':
+			options = [f'cutoff {cutoff}'] if cutoff is not None else []
+			if self.scale_model:
+				# The PuLP model is not assembled as arrays, so the scaling is left to CBC itself
+				options.append('scaling geometric')
+			self.milp.setSolver(pulp.PULP_CBC_CMD(msg=False, timeLimit=self.timeout, gapRel=self.mipgap,
+			                                      keepFiles=self.write_artifacts,
+			                                      warmStart=self.incumbent is not None, options=options))
+		elif self.solv == 'GUROBI':
+			self.milp.setSolver(GUROBI_CMD(msg=False, timeLimit=self.timeout, mip=self.mipgap,
+			                               warmStart=self.incumbent is not None))
 
-		# P absorption at the PCC (kW)
-		self.varis['p_abs'] = list(np.full(self.time_intervals, np.nan))
-		# P injection at the PCC (kW)
-		self.varis['p_inj'] = list(np.full(self.time_intervals, np.nan))
-		# Aux. binary variable for non simultaneity of PCC flows
-		self.varis['delta_pcc'] = list(np.full(self.time_intervals, np.nan))
-		# Energy content of the BESS (kWh)
-		self.varis['e_bess'] = list(np.full(self.time_intervals, np.nan))
-		# Energy content of the BESS (kWh)
-		self.varis['e_bess2'] = list(np.full(self.time_intervals, np.nan))
-		# Energy degraded per time step (kWh)
-		self.varis['e_deg'] = list(np.full(self.time_intervals, np.nan))
-		# Energy degraded per time step (kWh)
-		self.varis['e_deg2'] = list(np.full(self.time_intervals, np.nan))
-		# Max E content for p_ch set point (kWh)
-		self.varis['max_e_bes'] = list(np.full(self.time_intervals, np.nan))
-		# Min E content for p_disch set point (kWh)
-		self.varis['min_e_bes'] = list(np.full(self.time_intervals, np.nan))
-		# Max E content for p_ch set point (kWh)
-		self.varis['max_e_bes2'] = list(np.full(self.time_intervals, np.nan))
-		# Min E content for p_disch set point (kWh)
-		self.varis['min_e_bes2'] = list(np.full(self.time_intervals, np.nan))
+	def __set_mip_start(self):
+		"""
+		Passes the incumbent, if any, to the problem as a MIP start.
+		:return: None
+		:rtype: None
+		"""
+		if self.incumbent is None:
+			return
+
+		if self.symmetric_pairs:
+			self.incumbent = wshelper.order_identical_units(self.incumbent, self.symmetric_pairs)
+		start = wshelper.flatten_incumbent(self.incumbent)
+		if isinstance(self.milp, SparseMilp):
+			self.milp.set_start(start)
+		else:
+			for name, variables in self.pulp_blocks.items():
+				if name in start:
+					# Round-off below the variables' bounds is left to the solver's feasibility tolerance
+					for v, val in zip(variables, start[name]):
+						v.setInitialValue(val, check=False)
 
-		if not self.add_on_inv:
-			# Charge P at AC-side of the BESS (kW)
-			self.varis['p_ch'] = list(np.full(self.time_intervals, np.nan))
-			# Discharge P at AC-side of the BESS (kW)
-			self.varis['p_disch'] = list(np.full(self.time_intervals, np.nan))
-			# Charge P at AC-side of the BESS (kW)
-			# Aux. binary variable for non simultaneity of BESS flows
-			self.varis['delta_bess'] = list(np.full(self.time_intervals, np.nan))
-			# Charge P at AC-side of the BESS (kW)
-			self.varis['p_ch2'] = list(np.full(self.time_intervals, np.nan))
-			# Discharge P at AC-side of the BESS (kW)
-			self.varis['p_disch2'] = list(np.full(self.time_intervals, np.nan))
-			# Aux. binary variable for non simultaneity of BESS flows
-			self.varis['delta_bess2'] = list(np.full(self.time_intervals, np.nan))
+	def __lp_rounding(self):
+		"""
+		LP-rounding heuristic: solves the LP relaxation, repairs its charge/discharge set points into a feasible
+		schedule (one flow direction and one efficiency segment per BESS and time step) from which all binaries are
+		rounded, and re-solves the LP with the binaries fixed. The result is kept as the incumbent.
+		:return: objective function value of the incumbent, or None if the heuristic failed
+		:rtype: float
+		"""
+		heuristic_t = time()
+		relaxed, _ = self.__solve_relaxation()
+		if relaxed is None:
+			logger.debug(' - LP rounding: relaxation not solved')
+			return None
 
-		else:
-			# Charge P in 1st segment at DC-side of the BESS (kW)
-			self.varis['z_ch'] = list(np.full(self.time_intervals, np.nan))
-			# Discharge P in 1st segment at DC-side of the BESS (kW)
-			self.varis['z_disch'] = list(np.full(self.time_intervals, np.nan))
-			# Charge P at AC-side of the BESS (kW)
-			self.varis['p_ch'] = {s: list(np.full(self.time_intervals, np.nan)) for s in self.seg_series}
-			# Discharge P at AC-side of the BESS (kW)
-			self.varis['p_disch'] = {s: list(np.full(self.time_intervals, np.nan)) for s in self.seg_series}
-			# Aux. binary for setting the charge limits of the BESS
-			self.varis['delta_bess_ch'] = {s: list(np.full(self.time_intervals, np.nan)) for s in self.seg_series}
-			# Aux. binary for setting the discharge limits of the BESS
-			self.varis['delta_bess_disch'] = {s: list(np.full(self.time_intervals, np.nan)) for s in self.seg_series}
-
-			# Charge P in 1st segment at DC-side of the BESS (kW)
-			self.varis['z_ch2'] = list(np.full(self.time_intervals, np.nan))
-			# Discharge P in 1st segment at DC-side of the BESS (kW)
-			self.varis['z_disch2'] = list(np.full(self.time_intervals, np.nan))
-			# Charge P at AC-side of the BESS (kW)
-			self.varis['p_ch2'] = {s: list(np.full(self.time_intervals, np.nan)) for s in self.seg_series}
-			# Discharge P at AC-side of the BESS (kW)
-			self.varis['p_disch2'] = {s: list(np.full(self.time_intervals, np.nan)) for s in self.seg_series}
-			# Aux. binary for setting the charge limits of the BESS
-			self.varis['delta_bess_ch2'] = {s: list(np.full(self.time_intervals, np.nan)) for s in self.seg_series}
-			# Aux. binary for setting the discharge limits of the BESS
-			self.varis['delta_bess_disch2'] = {s: list(np.full(self.time_intervals, np.nan)) for s in self.seg_series}
+		values, objective = self.__repair_schedule(relaxed)
+		if values is None:
+			logger.debug(' - LP rounding: relaxation could not be repaired')
+			return None
 
-		# **************************************************************************************************************
-		#        FILL DECISION VARIABLES
-		# **************************************************************************************************************
-		for v in self.milp.variables():
-			if not re.search('dummy', v.name):
-				t = int(v.name[-3:])
+		self.incumbent = wshelper.unflatten_values(values)
+		logger.debug(f' - LP rounding: incumbent with objective {objective:.6f} ({time() - heuristic_t:.3f}s)')
 
-			if re.search('p_abs_', v.name):
-				self.varis['p_abs'][t] = v.varValue
+		return objective
 
-			#elif re.search('p_inj_', v.name):
-				#self.varis['p_inj'][t] = v.varValue
+	def __evaluate_incumbent(self):
+		"""
+		Solves the LP with the binaries fixed to those of the incumbent (set by set_incumbent), whose solution replaces
+		the incumbent.
+		:return: objective function value of the incumbent, or None if the LP could not be solved
+		:rtype: float
+		"""
+		incumbent = self.incumbent
+		if self.symmetric_pairs:
+			incumbent = wshelper.order_identical_units(incumbent, self.symmetric_pairs)
+		values, objective = self.__solve_relaxation(wshelper.flatten_incumbent(incumbent))
+		if values is None:
+			logger.debug(' - MIP start: LP with its binaries fixed not solved')
+			return None
 
-			elif re.search('delta_pcc_', v.name):
-				self.varis['delta_pcc'][t] = v.varValue
+		self.incumbent = wshelper.unflatten_values(values)
+		logger.debug(f' - MIP start: objective {objective:.6f}')
 
-			elif re.search(f'e_bess_', v.name):
-				self.varis['e_bess'][t] = v.varValue
+		return objective
 
-			elif re.search(f'e_bess2_', v.name):
-				self.varis['e_bess2'][t] = v.varValue
+	def __repair_schedule(self, values):
+		"""
+		Repairs the charge/discharge set points in "values" into a feasible schedule (see
+		warm_start_helpers.repair_incumbent) and solves the LP with the binaries fixed to those of the repaired schedule.
+		:param values: dictionary of variable block name -> values
+		:type values: dict
+		:return: dictionary of variable block name -> values and objective function value, or (None, None)
+		:rtype: (dict, float)
+		"""
+		incumbent = wshelper.repair_incumbent(wshelper.unflatten_values(values), self)
+		if incumbent is None:
+			return None, None
+		if self.symmetric_pairs:
+			incumbent = wshelper.order_identical_units(incumbent, self.symmetric_pairs)
 
-			elif re.search(f'e_deg_', v.name):
-				self.varis['e_deg'][t] = v.varValue
+		return self.__solve_relaxation(wshelper.flatten_incumbent(incumbent))
 
-			elif re.search(f'e_deg2_', v.name):
-				self.varis['e_deg2'][t] = v.varValue
+	def __solve_relaxation(self, fixed=None):
+		"""
+		Solves the LP relaxation of the problem, optionally with the binaries fixed to given values.
+		:param fixed: dictionary of variable block name -> values, of which only the binaries are used
+		:type fixed: dict
+		:return: dictionary of variable block name -> values and objective function value, or (None, None)
+		:rtype: (dict, float)
+		"""
+		if isinstance(self.milp, SparseMilp):
+			self.milp.solve_relaxation(fixed)
+			if self.milp.x is None:
+				return None, None
+			return {name: self.milp.values(name) for name in self.milp.columns}, self.milp.objective_value
+
+		binaries = [(name, t, v) for name, variables in self.pulp_blocks.items() for t, v in enumerate(variables)
+		            if v.cat == LpInteger]
+		bounds = [(v.lowBound, v.upBound) for _, _, v in binaries]
+		if fixed is not None:
+			for name, t, v in binaries:
+				v.lowBound = v.upBound = round(fixed[name][t])
+		try:
+			self.milp.solve(pulp.PULP_CBC_CMD(msg=False, mip=False))
+		finally:
+			for (_, _, v), (low, up) in zip(binaries, bounds):
+				v.lowBound, v.upBound = low, up
+		if self.milp.status != LpStatusOptimal:
+			return None, None
 
-			elif re.search(f'max_e_bes_', v.name):
-				self.varis['max_e_bes'][t] = v.varValue
+		values = {name: np.array([v.varValue for v in variables], dtype=float)
+		          for name, variables in self.pulp_blocks.items()}
 
-			elif re.search(f'min_e_bes_', v.name):
-				self.varis['min_e_bes'][t] = v.varValue
+		return values, value(self.milp.objective)
 
-			elif re.search(f'max_e_bes2_', v.name):
-				self.varis['max_e_bes2'][t] = v.varValue
+	def __define_sparse_milp(self):
+		"""
+		Method to define the same MILP problem as __define_milp, but assembled as vectorized sparse arrays, for a fleet
+		of any number of BESS: the variables and constraints of all BESS are added at once, as blocks indexed by
+		(BESS, time step), instead of one PuLP object per time step. Only the piecewise linearization of the
+		efficiency curves (add_on_inv), whose segments differ between BESS, is added BESS by BESS.
+		:return: object with the milp problem ready for solving with HiGHS
+		:rtype: module.core.SparseMilp.SparseMilp
+		"""
+		# **************************************************************************************************************
+		#        ADDITIONAL PARAMETERS
+		# **************************************************************************************************************
+		T = self.time_intervals
+		dt = self.step_in_hours
+		# Time interval of each (BESS, time step), in hours
+		durations = np.tile(self.durations, len(self.fleet))
+		N = len(self.fleet)
+		# Position of each (BESS, time step) in the blocks of constraints of the fleet
+		positions = np.arange(N * T).reshape(N, T)
+
+		def unit_names(name):
+			# Names of a block of variables of each BESS
+			return [f'{name}{sfx}' for sfx in self.suffixes]
+
+		def per_unit(values):
+			# Parameter (attribute name) or values of each BESS, repeated over its time steps
+			if isinstance(values, str):
+				values = [getattr(bess, values) for bess in self.fleet]
+			return np.repeat(np.asarray(values, dtype=float), T)
+
+		def scaled(terms, factors):
+			# (columns, coefficient, positions) terms with each coefficient multiplied by the factor of its position
+			factors = np.broadcast_to(np.asarray(factors, dtype=float), N * T)
+			return [(cols, coef * factors[rows], rows) for cols, coef, rows in terms]
+
+		model = SparseMilp(f'{self.common_fname}', persistent=self.persistent, reduce=self.reduce_model,
+		                   scale=self.scale_model)
 
-			elif re.search(f'min_e_bes2_', v.name):
-				self.varis['min_e_bes2'][t] = v.varValue
+		# **************************************************************************************************************
+		#        PCC
+		# **************************************************************************************************************
+		# P absorption at the PCC (kW)
+		p_abs = model.add_variables('p_abs', T)
+		# Aux. binary variable for non simultaneity of PCC flows
+		delta_pcc = model.add_variables('delta_pcc', T, binary=True)
 
-			elif re.search(f'p_ch_', v.name) and not self.add_on_inv:
-				self.varis['p_ch'][t] = v.varValue
+		# Eq. (1)
+		model.add_objective(p_abs, np.asarray(self.market_prices, dtype=float) * self.durations)
 
-			elif re.search(f'p_disch_', v.name) and not self.add_on_inv:
-				self.varis['p_disch'][t] = v.varValue
+		# Eq. (3)
+		model.add_constraints('PCC_abs_limit', 'ub', [(p_abs, 1.0), (delta_pcc, -self.pcc_limit_value)], 0.0)
 
-			elif re.search(f'p_ch2_', v.name) and not self.add_on_inv:
-				self.varis['p_ch2'][t] = v.varValue
+		# **************************************************************************************************************
+		#        BESS
+		# **************************************************************************************************************
+		# Energy content of the BESS (kWh)
+		e_bess = model.add_variables(unit_names('e_bess'), T)
+		# Energy degraded per time step (kWh)
+		e_deg = model.add_variables(unit_names('e_deg'), T)
+		# Max E content for p_ch set point (kWh)
+		max_e_bes = model.add_variables(unit_names('max_e_bes'), T)
+		# Min E content for p_disch set point (kWh)
+		min_e_bes = model.add_variables(unit_names('min_e_bes'), T)
 
-			elif re.search(f'p_disch2_', v.name) and not self.add_on_inv:
-				self.varis['p_disch2'][t] = v.varValue
+		if not self.add_on_inv:
+			# Charge P at AC-side of the BESS (kW)
+			p_ch = model.add_variables(unit_names('p_ch'), T)
+			# Discharge P at AC-side of the BESS (kW)
+			p_disch = model.add_variables(unit_names('p_disch'), T)
+			# Aux. binary variable for non simultaneity of BESS flows
+			delta_bess = model.add_variables(unit_names('delta_bess'), T, binary=True)
 
-			elif re.search(f'delta_bess_', v.name):
-				self.varis['delta_bess'][t] = v.varValue
+			# Eq. (5)
+			model.add_constraints('Max_AC_charge_rate', 'ub',
+			                      [(p_ch.ravel(), 1.0), (delta_bess.ravel(), -per_unit('p_ac_max_c'))], 0.0)
+			# Eq. (6)
+			model.add_constraints('Max_AC_discharge_rate', 'ub',
+			                      [(p_disch.ravel(), 1.0), (delta_bess.ravel(), per_unit('p_ac_max_d'))],
+			                      per_unit('p_ac_max_d'))
 
-			elif re.search(f'z_ch_', v.name) and self.add_on_inv:
-				self.varis['z_ch'][t] = v.varValue
+			# Charging and discharging at DC-side and AC flows, as (columns, coefficient, positions) terms
+			bes_charge = [(p_ch.ravel(), per_unit('const_eff_ch'), positions.ravel())]
+			bes_discharge = [(p_disch.ravel(), 1 / per_unit('const_eff_disch'), positions.ravel())]
+			bess_flows = [(p_ch.ravel(), 1.0, positions.ravel()), (p_disch.ravel(), -1.0, positions.ravel())]
+			discharge_cols = dict(zip(self.suffixes, p_disch))
+			unit_cols = [np.concatenate(cols) for cols in zip(p_ch, p_disch, delta_bess)]
 
-			elif re.search(f'z_disch_', v.name) and self.add_on_inv:
-				self.varis['z_disch'][t] = v.varValue
+		else:
+			bes_charge, bes_discharge, bess_flows, discharge_cols, unit_cols = [], [], [], dict(), []
+			for bess, sfx, rows in zip(self.fleet, self.suffixes, positions):
+				first_col = model.n_cols
+				charge, discharge, flows = self.__add_sparse_piecewise_eff(model, bess, sfx)
+				bes_charge += [(cols, coef, rows) for cols, coef in charge]
+				bes_discharge += [(cols, coef, rows) for cols, coef in discharge]
+				bess_flows += [(cols, coef, rows) for cols, coef in flows]
+				discharge_cols[sfx] = np.concatenate([cols for cols, coef in flows if coef < 0])
+				unit_cols.append(np.arange(first_col, model.n_cols))
+
+		# Eq. (7) / (18)
+		model.add_constraints('Max_DC_charge_rate', 'ub', bes_charge, per_unit('p_dc_max_c'), size=N * T)
+		# Eq. (8) / (19)
+		model.add_constraints('Max_DC_discharge_rate', 'ub', bes_discharge, per_unit('p_dc_max_d'), size=N * T)
+
+		# Eq. (9) / (20) and (10) / (21)
+		e_update_rhs = np.zeros((N, T))
+		e_update_rhs[:, 0] = [bess.initial_e_bess for bess in self.fleet]
+		model.add_constraints('E_update', 'eq',
+		                      [(e_bess.ravel(), 1.0), (e_bess[:, :-1].ravel(), -1.0, positions[:, 1:].ravel())]
+		                      + scaled(bes_charge, -durations) + scaled(bes_discharge, durations),
+		                      e_update_rhs.ravel())
+
+		# Define energy content limits
+		if self.add_on_soc:
+			_dslope = per_unit('discharge_slope') / per_unit('v_nom_discharge')
+			_cslope = per_unit('charge_slope') / per_unit('v_nom_charge')
+			model.add_constraints('Minimum_E_content', 'eq', [(min_e_bes.ravel(), 1.0)] + scaled(bes_charge, -_dslope),
+			                      per_unit('discharge_origin'))
+			model.add_constraints('Maximum_E_content', 'eq',
+			                      [(max_e_bes.ravel(), 1.0)] + scaled(bes_discharge, -_cslope),
+			                      per_unit('charge_origin'))
+		else:
+			model.add_constraints('Minimum_E_content', 'eq', [(min_e_bes.ravel(), 1.0)], per_unit('min_e_bess'))
+			model.add_constraints('Maximum_E_content', 'eq', [(max_e_bes.ravel(), 1.0)], per_unit('max_e_bess'))
+
+		# Eq. (11) / (14) / (22)
+		model.add_constraints('E_content_low_boundary', 'ub', [(min_e_bes.ravel(), 1.0), (e_bess.ravel(), -1.0)], 0.0)
+		model.add_constraints('E_content_high_boundary', 'ub', [(e_bess.ravel(), 1.0), (max_e_bes.ravel(), -1.0)],
+		                      0.0)
+
+		# Eq. (12) / (23)
+		model.add_constraints('Degradation', 'eq',
+		                      [(e_deg.ravel(), 1.0)] + scaled(bes_discharge, -per_unit('deg_slope') * durations), 0.0)
+		model.add_objective(e_deg.ravel(), per_unit(self.deg_weights) * dt)
+
+		# Eq. (2) (the BESS flows are moved to the left-hand side)
+		model.add_constraints('Equilibrium', 'eq',
+		                      [(p_abs, 1.0)] + [(cols, -coef, rows % T) for cols, coef, rows in bess_flows],
+		                      np.asarray(self.load_forecasts, dtype=float))
+
+		# Symmetry breaking: of two consecutive interchangeable BESS, the first one discharges at least as much energy
+		# as the second
+		if self.symmetric_pairs:
+			model.add_constraints('Symmetry_breaking', 'ub',
+			                      [(discharge_cols[sfx], coef, np.full(len(discharge_cols[sfx]), p))
+			                       for p, pair in enumerate(self.symmetric_pairs)
+			                       for sfx, coef in zip(pair[::-1], (1.0, -1.0))],
+			                      0.0, size=len(self.symmetric_pairs))
+
+		# Columns of the PCC and of each BESS (see LagrangianDecomposition)
+		self.column_groups = [np.concatenate((p_abs, delta_pcc))] + \
+			[np.concatenate((e_bess[k], e_deg[k], max_e_bes[k], min_e_bes[k], unit_cols[k])) for k in range(N)]
+
+		model.assemble()
+		if self.write_artifacts:
+			self.__write_model(model)
+
+		return model
+
+	def __add_sparse_piecewise_eff(self, model, bess, sfx):
+		"""
+		Adds the variables and constraints of the piecewise linearization of the efficiency curves of a BESS to the
+		sparse model (add_on_inv), as in __add_piecewise_eff.
+		:param model: the sparse MILP problem
+		:type model: module.core.SparseMilp.SparseMilp
+		:param bess: the BESS configured
+		:type bess: module.tasks.BESS.BESS
+		:param sfx: suffix of the BESS's variables and constraints' names
+		:type sfx: str
+		:return: DC charge P, DC discharge P and AC flows (charge positive) of the BESS, as (columns, coefficient)
+		terms with one column per time step
+		:rtype: (list, list, list)
+		"""
+		T = self.time_intervals
+		Sc = range(len(bess.eff_segments_ch))
+		Sd = range(len(bess.eff_segments_disch))
+		# Charge/discharge P in all but the last segment at DC-side of the BESS (kW)
+		z_ch = model.add_variables(f'z_ch{sfx}', T)
+		z_disch = model.add_variables(f'z_disch{sfx}', T)
+		# Charge/discharge P at AC-side of the BESS (kW), per segment
+		p_ch = {s: model.add_variables(f'p_ch{sfx}_{s}', T) for s in Sc}
+		p_disch = {s: model.add_variables(f'p_disch{sfx}_{s}', T) for s in Sd}
+
+		# DC power of each segment, as (columns, coefficient) terms
+		ch_terms = [[(p_ch[s], slope)] for s, (_, _, slope, _) in enumerate(bess.eff_segments_ch)]
+		disch_terms = [[(p_disch[s], slope)] for s, (_, _, slope, _) in enumerate(bess.eff_segments_disch)]
+
+		if bess.convex_eff:
+			# Convex curves: filled in order, the segments need no binaries (and their origins cancel out)
+			# Aux. binary variable for non simultaneity of BESS flows
+			delta_bess = model.add_variables(f'delta_bess{sfx}', T, binary=True)
 
-			elif re.search(f'delta_bess2_', v.name):
-				self.varis['delta_bess2'][t] = v.varValue
+			# Eq. (16) and (17)
+			for s, (low, high, _, _) in enumerate(bess.eff_segments_ch):
+				model.add_constraints(f'Max_AC_charge_rate{sfx}_{s}', 'ub',
+				                      [(p_ch[s], 1.0), (delta_bess, low - high)], 0.0)
+			for s, (low, high, _, _) in enumerate(bess.eff_segments_disch):
+				model.add_constraints(f'Max_AC_discharge_rate{sfx}_{s}', 'ub',
+				                      [(p_disch[s], 1.0), (delta_bess, high - low)], high - low)
 
-			elif re.search(f'z_ch2_', v.name) and self.add_on_inv:
-				self.varis['z_ch2'][t] = v.varValue
+		else:
+			# Aux. binaries for setting the charge/discharge limits of the BESS
+			delta_bess_ch = {s: model.add_variables(f'delta_bess_ch{sfx}_{s}', T, binary=True) for s in Sc}
+			delta_bess_disch = {s: model.add_variables(f'delta_bess_disch{sfx}_{s}', T, binary=True) for s in Sd}
+
+			# Eq. (16) and (17)
+			for s, (low, high, _, origin) in enumerate(bess.eff_segments_ch):
+				model.add_constraints(f'Min_AC_charge_rate{sfx}_{s}', 'ub',
+				                      [(delta_bess_ch[s], low), (p_ch[s], -1.0)], 0.0)
+				model.add_constraints(f'Max_AC_charge_rate{sfx}_{s}', 'ub',
+				                      [(p_ch[s], 1.0), (delta_bess_ch[s], -high)], 0.0)
+				if origin:
+					ch_terms[s].append((delta_bess_ch[s], origin))
+			for s, (low, high, _, origin) in enumerate(bess.eff_segments_disch):
+				model.add_constraints(f'Min_AC_discharge_rate{sfx}_{s}', 'ub',
+				                      [(delta_bess_disch[s], low), (p_disch[s], -1.0)], 0.0)
+				model.add_constraints(f'Max_AC_discharge_rate{sfx}_{s}', 'ub',
+				                      [(p_disch[s], 1.0), (delta_bess_disch[s], -high)], 0.0)
+				if origin:
+					disch_terms[s].append((delta_bess_disch[s], origin))
+
+			# Eq. (27)
+			model.add_constraints(f'Non_BESS_simultaneity{sfx}', 'ub',
+			                      [(delta_bess_ch[s], 1.0) for s in Sc] + [(delta_bess_disch[s], 1.0) for s in Sd], 1.0)
+
+		# Eq. (25)
+		model.add_constraints(f'Z_ch{sfx}', 'eq',
+		                      [(z_ch, 1.0)] + [(cols, -coef) for terms in ch_terms[:-1] for cols, coef in terms], 0.0)
+		# Eq. (26)
+		model.add_constraints(f'Z_disch{sfx}', 'eq',
+		                      [(z_disch, 1.0)] + [(cols, -coef) for terms in disch_terms[:-1] for cols, coef in terms],
+		                      0.0)
+
+		bes_charge = [(z_ch, 1.0)] + ch_terms[-1]
+		bes_discharge = [(z_disch, 1.0)] + disch_terms[-1]
+		bess_flows = [(p_ch[s], 1.0) for s in Sc] + [(p_disch[s], -1.0) for s in Sd]
+
+		return bes_charge, bes_discharge, bess_flows
+
+	def __write_model(self, model):
+		"""
+		Writes a model to the "core" folder, as an .lp file (PuLP) or an .npz file (sparse model).
+		:param model: the MILP problem
+		:type model: Union[pulp.pulp.LpProblem, module.core.SparseMilp.SparseMilp]
+		:return: None
+		:rtype: None
+		"""
+		dir_name = os.path.abspath(os.path.join(__file__, '..'))
+		if isinstance(model, SparseMilp):
+			model.write(os.path.join(dir_name, f'{self.common_fname}.npz'))
+		else:
+			model.writeLP(os.path.join(dir_name, f'{self.common_fname}.lp'))
 
-			elif re.search(f'z_disch2_', v.name) and self.add_on_inv:
-				self.varis['z_disch2'][t] = v.varValue
+	def generate_outputs(self, objective_function=None, bess_asset=None, bess_asset2=None):
+		"""
+		Function for generating the outputs of optimization, namely the set points for each asset and all relevant
+		variables, and to convert them into JSON format. The degradation costs are those of the last solve (see
+		solve_fleet), so the arguments, kept for the two-BESS callers, are not needed.
+		:return: None
+		:rtype: None
+		"""
+		if self.opt_val is None:
+			# No solution (e.g. infeasible, whatever the solver): the outputs keep their structure, with all BESS idle,
+			# so the energy content is carried forward; milpStatus tells the solve failed
+			self.__get_idle_variables_values()
+		elif isinstance(self.milp, (SparseMilp, DynamicProgramming, ThresholdDispatch, FleetAggregation)):
+			self.__get_sparse_variables_values()
+		else:
+			self.__get_variables_values()
+		if self.time_grid is not None:
+			self.__expand_time_grid()
+		self.__initialize_and_populate_outputs()
+
+		# Generate the outputs JSON file, only when requested or on failure
+		if self.write_artifacts or self.stat != 'Optimal':
+			master_path = os.path.abspath(os.path.join(__file__, '..', '..', '..'))
+			#structures_path = os.path.join('json', 'outputs.json')
+			structures_path = os.path.join('outputs.json')
+			output_path = os.path.join(master_path, structures_path)
+			with open(output_path, 'w') as outfile:
+				json.dump(self.outputs, outfile)
 
-			else:
-				for s in self.seg_series:
-					if re.search(f'p_ch_{s}_', v.name) and self.add_on_inv:
-						self.varis[f'p_ch'][s][t] = v.varValue
+		if self.plot:
+			from graphics.plot_results import plot_results
+			plot_results(self)
 
-					if re.search(f'p_ch2_{s}_', v.name) and self.add_on_inv:
-						self.varis[f'p_ch2'][s][t] = v.varValue
+	def split_outputs(self, steps):
+		"""
+		Splits the outputs into consecutive periods of "steps" time steps (e.g. the days of an annual run), each one
+		with the same structure as the outputs of a single run; the last period keeps any remaining time steps.
+		:param steps: number of time steps of each period
+		:type steps: int
+		:return: list with the outputs of each period (empty if there are no outputs)
+		:rtype: list
+		"""
+		if not self.outputs:
+			return []
 
-					elif re.search(f'p_disch_{s}_', v.name) and self.add_on_inv:
-						self.varis[f'p_disch'][s][t] = v.varValue
+		# Number of time steps from the outputs themselves (they may have been loaded from a cache, see main.cached_run)
+		nr_steps = max(len(val) for val in self.outputs.values() if isinstance(val, list))
+		nr_periods = max(nr_steps // steps, 1)
+		limits = [p * steps for p in range(nr_periods)] + [nr_steps]
 
-					elif re.search(f'p_disch2_{s}_', v.name) and self.add_on_inv:
-						self.varis[f'p_disch2'][s][t] = v.varValue
+		return [{key: val[start:end] if isinstance(val, list) else val for key, val in self.outputs.items()}
+		        for start, end in zip(limits[:-1], limits[1:])]
 
-					elif re.search(f'delta_bess_ch_{s}_', v.name) and self.add_on_inv:
-						self.varis[f'delta_bess_ch'][s][t] = v.varValue
+	def __get_variables_values(self):
+		"""
+		Function for retrieving and storing the values of each decision variable into a dictionary, from the blocks of
+		PuLP variables registered when defining the MILP (by block and time step index, whatever the horizon's length).
+		:return: None
+		:rtype: None
+		"""
+		self.varis = dict()
+
+		# P injection at the PCC (kW); not modelled
+		self.varis['p_inj'] = list(np.full(self.time_intervals, np.nan))
 
-					elif re.search(f'delta_bess_ch2_{s}_', v.name) and self.add_on_inv:
-						self.varis[f'delta_bess_ch'][s][t] = v.varValue
+		# Variables with a single value per time step
+		for name, variables in self.pulp_blocks.items():
+			self.varis[name] = [np.nan if v.varValue is None else v.varValue for v in variables]
 
-					elif re.search(f'delta_bess_disch_{s}_', v.name) and self.add_on_inv:
-						self.varis[f'delta_bess_disch'][s][t] = v.varValue
+		# Variables with a value per segment and per time step, in case add_on_inv is active
+		if self.add_on_inv:
+			self.varis = wshelper.unflatten_values(self.varis)
 
-					elif re.search(f'delta_bess_disch2_{s}_', v.name) and self.add_on_inv:
-						self.varis[f'delta_bess_disch2'][s][t] = v.varValue
-	def __initialize_and_populate_outputs(self, objective_function, bess_asset, bess_asset2 ):
+	def __get_sparse_variables_values(self):
 		"""
-		Initializes and populates the outputs' structure as a dictionary matching the outputs JSON format.
+		Function for retrieving and storing the values of each decision variable into a dictionary, from the HiGHS
+		solution of the sparse MILP (or the DP/THRESHOLD schedule, which exposes the same blocks). The dictionary
+		follows the same structure as in __get_variables_values.
 		:return: None
 		:rtype: None
 		"""
-		k1 = bess_asset['K1']
-		k2 = bess_asset['K2']
-		C1 = bess_asset2['C1']
-		C2 = bess_asset2 ['C2']
+		self.varis = dict()
 
-		# Sum the variables p_ch and p_dis values across the different segments to obtain a single value per asset
-		# and per time step, in case add_on_inv is active
-		if not self.add_on_inv:
-			p_ch = self.varis.get('p_ch')
-			p_disch = self.varis.get('p_disch')
-			p_ch2 = self.varis.get('p_ch2')
-			p_disch2 = self.varis.get('p_disch2')
+		# P injection at the PCC (kW); not modelled
+		self.varis['p_inj'] = list(np.full(self.time_intervals, np.nan))
 
-		else:
-			p_ch = list(pd.DataFrame(self.varis.get('p_ch')).sum(axis=1))
-			p_disch = list(pd.DataFrame(self.varis.get('p_disch')).sum(axis=1))
-			p_ch2 = list(pd.DataFrame(self.varis.get('p_ch2')).sum(axis=1))
-			p_disch2 = list(pd.DataFrame(self.varis.get('p_disch2')).sum(axis=1))
+		# Variables with a single value per time step
+		for name in self.milp.columns:
+			self.varis[name] = list(self.milp.values(name))
 
+		# Variables with a value per segment and per time step, in case add_on_inv is active
+		if self.add_on_inv:
+			self.varis = wshelper.unflatten_values(self.varis)
+
+	def __get_idle_variables_values(self):
+		"""
+		Function for storing, in the same structure as __get_variables_values, the values of a schedule with all BESS
+		idle (no charge, discharge nor degradation; the energy content kept) and the load supplied by the PCC, used
+		as outputs when the solve did not reach a solution.
+		:return: None
+		:rtype: None
+		"""
+		T = self.time_intervals
+		self.varis = dict(p_inj=list(np.full(T, np.nan)), p_abs=list(np.asarray(self.load_forecasts, dtype=float)[:T]))
+		for bess, sfx in zip(self.fleet, self.suffixes):
+			idle = list(np.zeros(T))
+			# A single segment, in case add_on_inv is active
+			self.varis[f'p_ch{sfx}'] = {0: idle} if self.add_on_inv else idle
+			self.varis[f'p_disch{sfx}'] = {0: idle} if self.add_on_inv else idle
+			self.varis[f'e_bess{sfx}'] = list(np.full(T, bess.initial_e_bess))
+			self.varis[f'e_deg{sfx}'] = idle
+
+	def __expand_time_grid(self):
+		"""
+		Expands the values of the decision variables from the merged steps (see TimeGrid) back to the requested step,
+		and restores the requested grid and forecasts, so the outputs (and split_outputs) follow the requested step.
+		:return: None
+		:rtype: None
+		"""
+		grid = self.time_grid
+		states = {f'e_bess{sfx}': bess.initial_e_bess for bess, sfx in zip(self.fleet, self.suffixes)}
+		amounts = {f'e_deg{sfx}' for sfx in self.suffixes}
+		self.varis = grid.expand(self.varis, states, amounts)
 
+		self.load_forecasts, self.market_prices = grid.series
+		self.time_intervals = grid.nr_steps
+		self.time_series = range(self.time_intervals)
+		self.durations = np.full(self.time_intervals, self.step_in_hours)
+		self.time_grid = None
 
+	def __initialize_and_populate_outputs(self):
+		"""
+		Initializes and populates the outputs' structure as a dictionary matching the outputs JSON format, with the
+		set points of each BESS of the fleet under its own keys ("pCharge", "pCharge2", "pCharge3", ...).
+		:return: None
+		:rtype: None
+		"""
 		# Create a list of the set points' datetime corresponding values, as strings, in ISO 8601 format
 		list_of_dates = mhelper.create_strftime_list(self.horizon, self.step_in_hours, self.start_at)
 
+		def set_points(values):
+			return [{'datetime': dt, 'setpoint': val} for dt, val in zip(list_of_dates, values)]
+
 		# Calculate the expected revenues
 		pcc_absorption = np.array(self.varis.get('p_abs'))
-		edeg = np.array(self.varis.get('e_deg'))
-		edeg2 = np.array(self.varis.get('e_deg2'))
 		of = (pcc_absorption * self.market_prices ) * self.step_in_hours
-
-
-		if objective_function == "A":
-			totdeg = k1 * edeg + k2 * edeg2
-		else:
-			totdeg = C1 * edeg + C2 * edeg2
+		totdeg = sum(weight * np.array(self.varis.get(f'e_deg{sfx}'))
+		             for sfx, weight in zip(self.suffixes, self.deg_weights))
 		tot = of + totdeg
-		#merge = p_ch - p_disch
-		merge = np.array(self.varis.get('p_ch')) - np.array(self.varis.get('p_disch'))
-		merge2 = np.array(self.varis.get('p_ch2')) - np.array(self.varis.get('p_disch2'))
 
 		#Initialize outputs as a dictionary
-		self.outputs = dict(
-			milpStatus=self.milp.status,
-			pCharge=[{'datetime': dt, 'setpoint': val} for dt, val in zip(list_of_dates, p_ch)],
-			pDischarge=[{'datetime': dt, 'setpoint': val} for dt, val in zip(list_of_dates, p_disch)],
-			eBess=[{'datetime': dt, 'setpoint': val} for dt, val in zip(list_of_dates, self.varis.get('e_bess'))],
-			eDeg=[{'datetime': dt, 'setpoint': val} for dt, val in zip(list_of_dates, self.varis.get('e_deg'))],
-			pCharge2=[{'datetime': dt, 'setpoint': val} for dt, val in zip(list_of_dates, p_ch2)],
-			pDischarge2=[{'datetime': dt, 'setpoint': val} for dt, val in zip(list_of_dates, p_disch2)],
-			eBess2=[{'datetime': dt, 'setpoint': val} for dt, val in zip(list_of_dates, self.varis.get('e_bess2'))],
-			eDeg2=[{'datetime': dt, 'setpoint': val} for dt, val in zip(list_of_dates, self.varis.get('e_deg2'))],
-			pAbs=[{'datetime': dt, 'setpoint': val} for dt, val in zip(list_of_dates, self.varis.get('p_abs'))],
-			expectRevs=[{'datetime': dt, 'setpoint': val} for dt, val in zip(list_of_dates, of)],
-			Totaldeg=[{'datetime': dt, 'setpoint': val} for dt, val in zip(list_of_dates, totdeg)],
-			Total=[{'datetime': dt, 'setpoint': val} for dt, val in zip(list_of_dates, tot)],
-			Merge=[{'datetime': dt, 'setpoint': val} for dt, val in zip(list_of_dates, merge)],
-			Merge2=[{'datetime': dt, 'setpoint': val} for dt, val in zip(list_of_dates, merge2)],
-
+		self.outputs = dict(milpStatus=self.milp.status)
+		merges = dict()
+		for sfx in self.suffixes:
+			p_ch = self.varis.get(f'p_ch{sfx}')
+			p_disch = self.varis.get(f'p_disch{sfx}')
+			# Sum the variables p_ch and p_dis values across the different segments to obtain a single value per asset
+			# and per time step, in case add_on_inv is active
+			if self.add_on_inv:
+				p_ch = list(pd.DataFrame(p_ch).sum(axis=1))
+				p_disch = list(pd.DataFrame(p_disch).sum(axis=1))
+
+			self.outputs[f'pCharge{sfx}'] = set_points(p_ch)
+			self.outputs[f'pDischarge{sfx}'] = set_points(p_disch)
+			self.outputs[f'eBess{sfx}'] = set_points(self.varis.get(f'e_bess{sfx}'))
+			self.outputs[f'eDeg{sfx}'] = set_points(self.varis.get(f'e_deg{sfx}'))
+			merges[f'Merge{sfx}'] = set_points(np.array(p_ch) - np.array(p_disch))
+
+		self.outputs.update(
+			pAbs=set_points(self.varis.get('p_abs')),
+			expectRevs=set_points(of),
+			Totaldeg=set_points(totdeg),
+			Total=set_points(tot),
+			**merges,
 		)
+		# Heuristic engines report how far their solution may be from the optimum
+		if self.gap is not None:
+			self.outputs.update(lowerBound=self.lower_bound, optimalityGap=self.gap)
 
 	@staticmethod
 	def final_folder_cleaning():
@@ -734,6 +1374,6 @@ class Optimizer:
 		dir_name = os.path.abspath(os.path.join(__file__, '..'))
 		test = os.listdir(dir_name)
 		for item in test:
-			if item.endswith((".lp")):
+			if item.endswith((".lp", ".npz")):
 				os.remove(os.path.join(dir_name, item))
 		pass
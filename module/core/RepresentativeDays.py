@@ -0,0 +1,166 @@
+"""
+RepresentativeDays class. Clusters the days of an annual study by their daily market price and load profiles
+(k-medoids) and solves only the medoid of each cluster; every other day takes the set points of its cluster's medoid,
+so the annual KPIs are rebuilt with the clusters' weights (number of days represented by each medoid).
+"""
+import numpy as np
+import pandas as pd
+
+from loguru import logger
+from module.core.TemporalDecomposition import same_state, solve_block
+from scipy.spatial.distance import cdist
+from time import time
+
+# Format of the outputs' datetime values (as in milp_helpers.create_strftime_list)
+iso_8601_format = '%Y-%m-%dT%H:%M:%SZ'
+
+
+class RepresentativeDays:
+	def __init__(self, optimize, objective_function, nr_days, max_iterations=5, seed=0):
+		self.optimize = optimize  # function that runs a single day, with the same signature as main.optimize
+		self.objective_function = objective_function  # objective function chosen by the client
+		self.nr_days = nr_days  # number of representative days (clusters)
+		self.max_iterations = max_iterations  # maximum number of solves of each medoid when linking the SoC
+		self.seed = seed  # seed of the k-medoids++ initialization
+		# **************************************************************************************************************
+		#        CLUSTERS
+		# **************************************************************************************************************
+		self.medoids = []  # position (in the days of the run) of the medoid of each cluster
+		self.labels = None  # cluster of each day
+		self.weights = None  # number of days represented by each medoid
+		self.iterations = 0  # number of SoC linking iterations of the last run
+
+	def run(self, problems, state):
+		"""
+		Clusters the days and solves the medoid of each cluster. The days carry the SoC over midnight, so each medoid
+		starts from the average final SoC of the days preceding its cluster's days in the calendar (the first day of
+		the run from the initial SoC): the medoids are solved again until those starting SoCs no longer change, or
+		max_iterations is reached. The capacity fade is the one of the initial state for all medoids.
+		:param problems: inputs of each day (settings, bess_asset, bess_asset2, milp_params, forecasts), in which the
+		state-dependent values (actualENom and the measured SoC) are replaced according to the state of each day
+		:type problems: list
+		:param state: initial state (SoC of each BESS in %, energy degraded so far in each BESS in kWh)
+		:type state: tuple
+		:return: result of each day (see TemporalDecomposition.solve_block), with the outputs of its cluster's medoid
+		moved to the day's own dates
+		:rtype: list
+		"""
+		run_t = time()
+		self.cluster([problem[-1] for problem in problems])
+		starts = [state] * len(self.medoids)
+		results = [None] * len(self.medoids)
+		pending = list(range(len(self.medoids)))
+		self.iterations = 0
+		while pending and self.iterations < self.max_iterations:
+			self.iterations += 1
+			for c in pending:
+				results[c] = solve_block(self.optimize, self.objective_function, [problems[self.medoids[c]]],
+				                         starts[c])[0]
+
+			# Starting SoC of each medoid from the final SoC of the days preceding its cluster's days
+			pending = []
+			for c in range(len(self.medoids)):
+				previous = [results[self.labels[d - 1]]['state'] if d > 0 else state
+				            for d in np.flatnonzero(self.labels == c)]
+				start = (float(np.mean([s[0] for s in previous])), float(np.mean([s[1] for s in previous])),
+				         state[2], state[3])
+				if not same_state(start, starts[c]):
+					starts[c] = start
+					pending.append(c)
+			logger.debug(f' - representative days: iteration {self.iterations}, {len(pending)} medoid(s) to solve '
+			             f'again')
+
+		logger.info(f' - representative days: {len(problems)} days in {len(self.medoids)} clusters, '
+		            f'{self.iterations} iteration(s) ({time() - run_t:.3f}s)')
+
+		day_results = []
+		for d, c in enumerate(self.labels):
+			medoid = self.medoids[c]
+			result = dict(results[c], outputs=shift_outputs(results[c]['outputs'], d - medoid))
+			if d != medoid:
+				result['time'] = 0.0
+			day_results.append(result)
+
+		return day_results
+
+	def cluster(self, forecasts):
+		"""
+		Clusters the days by k-medoids over their price and load profiles (each standardized over all days, so that
+		both weigh the same).
+		:param forecasts: forecasts of each day ("loadForecasts" and "marketPrices" arrays of equal length)
+		:type forecasts: list of dict
+		:return: position of the medoid of each cluster and cluster of each day
+		:rtype: (list, numpy.ndarray)
+		"""
+		profiles = []
+		for key in ('marketPrices', 'loadForecasts'):
+			values = np.array([np.asarray(day[key], dtype=float) for day in forecasts])
+			profiles.append((values - values.mean()) / max(values.std(), 1e-12))
+		self.medoids, self.labels = k_medoids(np.hstack(profiles), min(self.nr_days, len(forecasts)), self.seed)
+		self.weights = np.bincount(self.labels, minlength=len(self.medoids))
+
+		return self.medoids, self.labels
+
+
+def k_medoids(points, k, seed=0, max_iterations=100):
+	"""
+	Clusters the points around k medoids (points themselves), minimizing the sum of the Euclidean distances of each
+	point to its medoid: k-medoids++ initialization followed by alternate assignment and medoid update steps.
+	:param points: one point per row
+	:type points: numpy.ndarray
+	:param k: number of clusters
+	:type k: int
+	:param seed: seed of the initialization
+	:type seed: int
+	:param max_iterations: maximum number of assignment/update steps
+	:type max_iterations: int
+	:return: position of the medoid of each cluster and cluster of each point
+	:rtype: (list, numpy.ndarray)
+	"""
+	distances = cdist(points, points)
+	rng = np.random.default_rng(seed)
+
+	# The most central point, then points drawn with probability proportional to their squared distance to the
+	# closest medoid (identical points are never drawn twice)
+	medoids = [int(np.argmin(distances.sum(axis=1)))]
+	while len(medoids) < k:
+		closest = distances[:, medoids].min(axis=1) ** 2
+		if closest.sum() <= 0:
+			break
+		medoids.append(int(rng.choice(len(points), p=closest / closest.sum())))
+
+	for _ in range(max_iterations):
+		labels = np.argmin(distances[:, medoids], axis=1)
+		updated = []
+		for c in range(len(medoids)):
+			members = np.flatnonzero(labels == c)
+			updated.append(int(members[np.argmin(distances[np.ix_(members, members)].sum(axis=1))]))
+		if updated == medoids:
+			break
+		medoids = updated
+
+	return medoids, np.argmin(distances[:, medoids], axis=1)
+
+
+def shift_outputs(outputs, days):
+	"""
+	Moves the datetime values of the outputs' set points by a number of days.
+	:param outputs: outputs, as in Optimizer.outputs
+	:type outputs: dict
+	:param days: number of days to add
+	:type days: int
+	:return: outputs with the new datetime values
+	:rtype: dict
+	"""
+	if not days or not outputs:
+		return outputs
+
+	shifted = dict()
+	for key, val in outputs.items():
+		if isinstance(val, list):
+			dates = pd.to_datetime([entry['datetime'] for entry in val], format=iso_8601_format) + \
+				pd.Timedelta(days=days)
+			val = [dict(entry, datetime=date.strftime(iso_8601_format)) for entry, date in zip(val, dates)]
+		shifted[key] = val
+
+	return shifted
@@ -0,0 +1,173 @@
+"""
+ResultCache class. Keeps the results of past runs (outputs, status and objective function value) under a canonical
+hash of all inputs of the run, in a bounded in-memory LRU layer and, optionally, in a SQLite file that survives
+restarts, so that identical runs (e.g. repeated requests or day windows of sensitivity studies) are not solved again.
+"""
+import datetime
+import hashlib
+import numpy as np
+import pandas as pd
+import pickle
+import sqlite3
+
+from collections import OrderedDict
+from loguru import logger
+from time import perf_counter
+
+
+class ResultCache:
+	def __init__(self, max_entries=128, path=None):
+		self.max_entries = max_entries  # maximum number of results kept in memory (least recently used evicted)
+		self.path = path  # SQLite file of the on-disk layer; None to keep the results in memory only
+		self.__entries = OrderedDict()  # key -> result, from the least to the most recently used
+		self.__db = None  # connection to the SQLite file
+		if path is not None:
+			self.__db = sqlite3.connect(path, check_same_thread=False)
+			self.__db.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, result BLOB)')
+			self.__db.commit()
+		# **************************************************************************************************************
+		#        METRICS
+		# **************************************************************************************************************
+		self.memory_hits = 0  # lookups answered by the in-memory layer
+		self.disk_hits = 0  # lookups answered by the on-disk layer
+		self.misses = 0  # lookups not answered
+		self.stores = 0  # results stored
+		self.evictions = 0  # results evicted from the in-memory layer
+		self.hit_time = 0.0  # total time spent in lookups answered (with the key's computation, see lookup), in s
+
+	@staticmethod
+	def key(*inputs):
+		"""
+		Canonical hash of the inputs of a run: the same values give the same key, whatever the order of the
+		dictionaries' keys or the containers of the values (lists, tuples or arrays).
+		:param inputs: inputs of the run (settings, assets, milp_params, measures, forecasts, objective function, ...)
+		:type inputs: tuple
+		:return: hexadecimal SHA-256 digest
+		:rtype: str
+		"""
+		digest = hashlib.sha256()
+		_update_digest(digest, inputs)
+
+		return digest.hexdigest()
+
+	def lookup(self, *inputs):
+		"""
+		Computes the key of a run and looks up its result (see ResultCache.key and ResultCache.get); the time of a hit
+		includes the key's computation.
+		:param inputs: inputs of the run
+		:type inputs: tuple
+		:return: key of the run and the result stored, or None
+		:rtype: (str, dict)
+		"""
+		lookup_t = perf_counter()
+		key = self.key(*inputs)
+
+		return key, self.get(key, lookup_t)
+
+	def get(self, key, lookup_t=None):
+		"""
+		Looks up the result of a run, in memory and then on disk (a disk hit is brought into memory). The result is
+		shared with the cache, so it must not be modified.
+		:param key: key of the run (see ResultCache.key)
+		:type key: str
+		:param lookup_t: start of the lookup (time.perf_counter), for the time of a hit; None to start it here
+		:type lookup_t: float
+		:return: the result stored, or None
+		:rtype: dict
+		"""
+		lookup_t = perf_counter() if lookup_t is None else lookup_t
+		result = self.__entries.get(key)
+		if result is not None:
+			self.__entries.move_to_end(key)
+			self.memory_hits += 1
+		elif self.__db is not None:
+			row = self.__db.execute('SELECT result FROM results WHERE key = ?', (key,)).fetchone()
+			if row is not None:
+				result = pickle.loads(row[0])
+				self.__remember(key, result)
+				self.disk_hits += 1
+
+		if result is None:
+			self.misses += 1
+			return None
+
+		self.hit_time += perf_counter() - lookup_t
+		logger.debug(f' - result cache: hit ({self.metrics()["hit_rate"]:.1%} of the lookups)')
+
+		return result
+
+	def put(self, key, result):
+		"""
+		Stores the result of a run, in memory and, if set, on disk.
+		:param key: key of the run (see ResultCache.key)
+		:type key: str
+		:param result: result of the run (e.g. outputs, stat, status_real, opt_val and varis)
+		:type result: dict
+		:return: None
+		:rtype: None
+		"""
+		self.__remember(key, result)
+		if self.__db is not None:
+			self.__db.execute('INSERT OR REPLACE INTO results (key, result) VALUES (?, ?)',
+			                  (key, pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)))
+			self.__db.commit()
+		self.stores += 1
+
+	def metrics(self):
+		"""
+		Metrics of the cache's use since it was created.
+		:return: dictionary with the number of hits (per layer), misses, stores and evictions, the hit rate, the mean
+		time of a hit (in microseconds) and the number of results in memory
+		:rtype: dict
+		"""
+		hits = self.memory_hits + self.disk_hits
+		lookups = hits + self.misses
+
+		return dict(memory_hits=self.memory_hits, disk_hits=self.disk_hits, misses=self.misses, stores=self.stores,
+		            evictions=self.evictions, hit_rate=hits / lookups if lookups else 0.0,
+		            mean_hit_us=self.hit_time / hits * 1e6 if hits else 0.0, entries=len(self.__entries))
+
+	def __remember(self, key, result):
+		"""
+		Keeps a result in the in-memory layer, evicting the least recently used ones beyond max_entries.
+		:return: None
+		:rtype: None
+		"""
+		self.__entries[key] = result
+		self.__entries.move_to_end(key)
+		while len(self.__entries) > self.max_entries:
+			self.__entries.popitem(last=False)
+			self.evictions += 1
+
+
+def _update_digest(digest, value):
+	"""
+	Feeds a value to the digest in a canonical form, tagged by kind so that, e.g., 1 and "1" differ.
+	:return: None
+	:rtype: None
+	"""
+	if isinstance(value, dict):
+		digest.update(b'd%d' % len(value))
+		for key in sorted(value, key=repr):
+			_update_digest(digest, key)
+			_update_digest(digest, value[key])
+	elif isinstance(value, (pd.DataFrame, pd.Series)):
+		_update_digest(digest, value.to_dict())
+	elif isinstance(value, np.ndarray) and value.ndim == 1 and value.dtype.kind in 'biuf' or \
+			isinstance(value, (list, tuple)) and all(isinstance(item, (int, float, np.number)) for item in value):
+		# Numeric sequences (e.g. forecasts) as a single block of bytes
+		values = np.asarray(value, dtype=float)
+		digest.update(b'a%d' % values.size)
+		digest.update(values.tobytes())
+	elif isinstance(value, (list, tuple, range, np.ndarray)):
+		digest.update(b'l%d' % len(value))
+		for item in value:
+			_update_digest(digest, item)
+	elif isinstance(value, (datetime.datetime, datetime.date)):
+		digest.update(b't' + pd.Timestamp(value).isoformat().encode())
+	elif isinstance(value, (bool, np.bool_)):
+		digest.update(b'b%d' % bool(value))
+	elif isinstance(value, (int, float, np.number)):
+		digest.update(b'n' + repr(float(value)).encode())
+	else:
+		digest.update(b's' + repr(value).encode())
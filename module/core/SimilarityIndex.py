@@ -0,0 +1,94 @@
+"""
+SimilarityIndex class. Keeps the schedules of past solved runs under a compact embedding of their inputs (price and
+load profiles, initial SoC and asset parameters) in a KD-tree, so that a new run can start from the schedule of the
+most similar run already solved (repaired for its own inputs) as MIP start and cutoff, even when no past run has
+exactly the same inputs (see ResultCache).
+"""
+import numpy as np
+
+from loguru import logger
+from scipy.spatial import cKDTree
+
+
+class SimilarityIndex:
+	def __init__(self, max_entries=365, bins=24):
+		self.max_entries = max_entries  # maximum number of runs kept (the oldest evicted)
+		self.bins = bins  # number of values of each profile in the embedding, whatever the horizon's time steps
+		self.vectors = []  # embedding of each run, from the oldest to the newest
+		self.schedules = []  # values of the decision variables of each run (as in Optimizer.varis)
+		self.__tree = None  # KD-tree over the vectors; rebuilt on the first query after a change
+		# **************************************************************************************************************
+		#        METRICS
+		# **************************************************************************************************************
+		self.lookups = 0  # queries answered with a neighbour
+		self.evictions = 0  # runs evicted
+		self.distances = []  # distance to the neighbour of each query answered
+
+	def embed(self, forecasts, socs, assets):
+		"""
+		Embedding of the inputs of a run: the price and load profiles, averaged over "bins" periods of the horizon and
+		scaled by their peak absolute value (their shape is what drives the schedule), the initial SoC of each BESS (as
+		a fraction) and the dimensionless parameters of each BESS (C-rates, efficiencies and remaining capacity).
+		:param forecasts: forecasts of the run ("loadForecasts" and "marketPrices")
+		:type forecasts: dict
+		:param socs: initial SoC of each BESS, in %
+		:type socs: list
+		:param assets: parameters of each BESS, in the same order
+		:type assets: list of dict
+		:return: the embedding
+		:rtype: numpy.ndarray
+		"""
+		parts = []
+		for key in ('marketPrices', 'loadForecasts'):
+			values = np.asarray(forecasts[key], dtype=float)
+			# Mean over each period (the time steps are repeated so that the periods need not split them evenly)
+			profile = np.repeat(values, self.bins).reshape(self.bins, values.size).mean(axis=1)
+			parts.append(profile / max(np.abs(profile).max(), 1e-12))
+		parts.append(np.asarray(socs, dtype=float) / 100)
+		for asset in assets:
+			parts.append([asset['maxCCh'], asset['maxCDch'], asset['chEff'] / 100, asset['dischEff'] / 100,
+			              asset['actualENom'] / asset['eNom']])
+
+		return np.concatenate(parts)
+
+	def add(self, vector, varis):
+		"""
+		Keeps the schedule of a solved run, evicting the oldest runs beyond max_entries. Runs with embeddings of
+		another size (e.g. another number of BESS) replace the whole index.
+		:param vector: embedding of the run (see SimilarityIndex.embed)
+		:type vector: numpy.ndarray
+		:param varis: values of the decision variables of the run
+		:type varis: dict
+		:return: None
+		:rtype: None
+		"""
+		if self.vectors and self.vectors[0].size != vector.size:
+			logger.debug(' - similarity index: inputs of another size; index cleared')
+			self.vectors, self.schedules = [], []
+		self.vectors.append(vector)
+		self.schedules.append(varis)
+		while len(self.vectors) > self.max_entries:
+			self.vectors.pop(0)
+			self.schedules.pop(0)
+			self.evictions += 1
+		self.__tree = None
+
+	def nearest(self, vector):
+		"""
+		Finds the schedule of the run closest to the given embedding (Euclidean distance).
+		:param vector: embedding of the new run (see SimilarityIndex.embed)
+		:type vector: numpy.ndarray
+		:return: the schedule found and its distance, or (None, None) if the index has no comparable run
+		:rtype: (dict, float)
+		"""
+		if not self.vectors or self.vectors[0].size != vector.size:
+			return None, None
+		if self.__tree is None:
+			self.__tree = cKDTree(np.vstack(self.vectors))
+
+		distance, position = self.__tree.query(vector)
+		self.lookups += 1
+		self.distances.append(float(distance))
+		logger.debug(f' - similarity index: neighbour at distance {distance:.4f} among {len(self.vectors)} runs')
+
+		return self.schedules[position], float(distance)
@@ -0,0 +1,238 @@
+"""
+SolverPortfolio class. Races several solvers (or configurations of the same solver) on a SparseMilp, each one in its
+own process, and keeps the first answer proven by any of them.
+"""
+import multiprocessing
+import numpy as np
+import os
+import subprocess
+import tempfile
+
+from loguru import logger
+from pulp import PULP_CBC_CMD
+from scipy.optimize import Bounds, LinearConstraint, milp
+from time import sleep, time
+
+# Configurations that can be raced: name -> (backend, options). HiGHS options are passed on to scipy.optimize.milp
+# and CBC options to the command line of the CBC executable shipped with PuLP
+portfolio_configurations = {
+	'HIGHS': ('HIGHS', dict()),
+	'HIGHS_NOPRESOLVE': ('HIGHS', dict(presolve=False)),
+	'CBC': ('CBC', ()),
+	'CBC_NOCUTS': ('CBC', ('cuts', 'off')),
+	'CBC_ROOTCUTS': ('CBC', ('cuts', 'root')),
+	'CBC_NOPREPROCESS': ('CBC', ('preprocess', 'off')),
+}
+
+# Map between the first word written by CBC in its solution file and scipy.optimize.milp status codes
+cbc2scipy_status = {
+	'Optimal': 0,
+	'Stopped': 1,
+	'Infeasible': 2,
+	'Integer': 2,  # "Integer infeasible"
+	'Unbounded': 3,
+}
+
+# Scipy status codes of a proven answer: optimal (within the gap), infeasible or unbounded
+proven_status = (0, 2, 3)
+
+# Time between checks of the running solvers, in seconds
+poll_interval = 0.005
+
+
+class SolverPortfolio:
+	def __init__(self, configurations, time_limit=None, mip_rel_gap=None, cutoff=None):
+		unknown = [name for name in configurations if name not in portfolio_configurations]
+		if unknown:
+			raise ValueError(f'Unknown solver portfolio configuration(s): {unknown}; '
+			                 f'available: {list(portfolio_configurations)}')
+		self.configurations = tuple(configurations)  # names of the configurations raced (see portfolio_configurations)
+		self.time_limit = time_limit  # temporal limit of each configuration, in seconds
+		self.mip_rel_gap = mip_rel_gap  # relative MIP gap tolerance of each configuration
+		self.cutoff = cutoff  # objective value above which solutions are discarded (only applied by CBC)
+		self.winner = None  # configuration whose result was kept
+		self.runtimes = dict()  # configuration -> time until it finished, in seconds (only those that finished)
+
+	def race(self, model):
+		"""
+		Launches all configurations on the assembled arrays of "model" and waits for the first proven answer (optimal
+		within the gap, infeasible or unbounded); the remaining processes are then terminated. If no configuration
+		proves its answer (e.g. all reach the time limit), the best solution found among them is kept.
+		:param model: problem to solve, already assembled
+		:type model: module.core.SparseMilp.SparseMilp
+		:return: scipy's status code, variables' values, objective function value and solver's message
+		:rtype: (int, numpy.ndarray, float, str)
+		"""
+		race_t = time()
+		results = dict()
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			runners = {name: self.__start(name, model, tmp_dir) for name in self.configurations}
+			try:
+				while runners:
+					for name, runner in list(runners.items()):
+						result = self.__poll(runner, model)
+						if result is None:
+							continue
+						del runners[name]
+						results[name] = result
+						self.runtimes[name] = time() - race_t
+						logger.debug(f' - solver portfolio: {name} finished ({result[3]}; {self.runtimes[name]:.3f}s)')
+						if result[0] in proven_status:
+							self.winner = name
+							return result
+					sleep(poll_interval)
+			finally:
+				for runner in runners.values():
+					self.__stop(runner)
+
+		solved = {name: result for name, result in results.items() if result[1] is not None}
+		if solved:
+			self.winner = min(solved, key=lambda name: solved[name][2])
+		else:
+			self.winner = self.configurations[0]
+
+		return results[self.winner]
+
+	def __start(self, name, model, tmp_dir):
+		"""
+		Launches one configuration in its own process.
+		:return: the running process and what is needed to collect its result
+		:rtype: dict
+		"""
+		backend, options = portfolio_configurations[name]
+		if backend == 'HIGHS':
+			receiver, sender = multiprocessing.Pipe(duplex=False)
+			process = multiprocessing.Process(target=_solve_highs, daemon=True,
+			                                  args=(sender, model.c, model.integrality, model.lb, model.ub,
+			                                        model.A_eq, model.b_eq, model.A_ub, model.b_ub,
+			                                        self.__highs_options(options)))
+			process.start()
+			sender.close()
+			return dict(backend=backend, process=process, receiver=receiver)
+
+		mps_path = os.path.join(tmp_dir, 'model.mps')
+		if not os.path.exists(mps_path):
+			model.write_mps(mps_path)
+		sol_path = os.path.join(tmp_dir, f'{name}.sol')
+		process = subprocess.Popen(self.__cbc_command(mps_path, sol_path, options),
+		                           stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+		return dict(backend=backend, process=process, sol_path=sol_path)
+
+	def __highs_options(self, options):
+		"""
+		Returns the options passed on to scipy.optimize.milp by a HiGHS configuration.
+		:rtype: dict
+		"""
+		highs_options = dict(disp=False, **options)
+		if self.time_limit is not None:
+			highs_options['time_limit'] = self.time_limit
+		if self.mip_rel_gap is not None:
+			highs_options['mip_rel_gap'] = self.mip_rel_gap
+
+		return highs_options
+
+	def __cbc_command(self, mps_path, sol_path, options):
+		"""
+		Returns the command line that runs a CBC configuration, following the one built by PuLP's PULP_CBC_CMD.
+		:rtype: list
+		"""
+		command = [PULP_CBC_CMD().path, mps_path]
+		if self.time_limit is not None:
+			command += ['sec', str(self.time_limit), 'timeMode', 'elapsed']
+		if self.mip_rel_gap is not None:
+			command += ['ratio', str(self.mip_rel_gap)]
+		if self.cutoff is not None:
+			command += ['cutoff', repr(float(self.cutoff))]
+		command += [*options, 'branch', 'printingOptions', 'all', 'solution', sol_path]
+
+		return command
+
+	@staticmethod
+	def __poll(runner, model):
+		"""
+		Collects the result of a configuration, if it has already finished.
+		:return: scipy's status code, variables' values, objective function value and solver's message, or None if the
+		configuration is still running
+		:rtype: (int, numpy.ndarray, float, str)
+		"""
+		process = runner['process']
+		if runner['backend'] == 'HIGHS':
+			if runner['receiver'].poll():
+				result = runner['receiver'].recv()
+				process.join()
+				return result
+			if process.is_alive():
+				return None
+			return 4, None, None, f'solver process ended with exit code {process.exitcode}'
+
+		if process.poll() is None:
+			return None
+		if not os.path.exists(runner['sol_path']):
+			return 4, None, None, f'CBC ended with exit code {process.returncode}'
+
+		return _read_cbc_solution(runner['sol_path'], model)
+
+	@staticmethod
+	def __stop(runner):
+		"""
+		Terminates a configuration that is still running.
+		:return: None
+		:rtype: None
+		"""
+		process = runner['process']
+		if runner['backend'] == 'HIGHS':
+			process.terminate()
+			process.join(1)
+			if process.is_alive():
+				process.kill()
+				process.join()
+			runner['receiver'].close()
+		else:
+			process.kill()
+			process.wait()
+
+
+def _solve_highs(connection, c, integrality, lb, ub, A_eq, b_eq, A_ub, b_ub, options):
+	"""
+	Solves a problem through scipy.optimize.milp and sends the result through "connection" (target of the HiGHS
+	processes of the portfolio).
+	:return: None
+	:rtype: None
+	"""
+	constraints = []
+	if A_eq.shape[0]:
+		constraints.append(LinearConstraint(A_eq, b_eq, b_eq))
+	if A_ub.shape[0]:
+		constraints.append(LinearConstraint(A_ub, -np.inf, b_ub))
+
+	res = milp(c, integrality=integrality, bounds=Bounds(lb, ub), constraints=constraints, options=options)
+	connection.send((res.status, res.x, res.fun, res.message))
+	connection.close()
+
+
+def _read_cbc_solution(path, model):
+	"""
+	Reads the solution file written by CBC for a problem written by SparseMilp.write_mps.
+	:return: scipy's status code, variables' values, objective function value and solver's message
+	:rtype: (int, numpy.ndarray, float, str)
+	"""
+	with open(path) as f:
+		lines = f.read().splitlines()
+	if not lines:
+		return 4, None, None, 'CBC wrote an empty solution file'
+
+	message = lines[0].strip()
+	status = cbc2scipy_status.get(message.split(' ')[0], 4)
+	if status not in (0, 1) or 'objective value' not in message:
+		return status, None, None, message
+
+	x = np.zeros(model.n_cols)
+	for line in lines[1:]:
+		words = line.split()
+		if words and words[0] == '**':
+			words = words[1:]
+		if len(words) >= 3 and words[1].startswith('C'):
+			x[int(words[1][1:])] = float(words[2])
+	x = np.clip(x, model.lb, model.ub)
+
+	return status, x, float(model.c @ x), message
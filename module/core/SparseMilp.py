@@ -0,0 +1,634 @@
+"""
+SparseMilp class. Holds a MILP as vectorized NumPy/SciPy sparse arrays and solves it with HiGHS (or races several
+solvers on it, see SolverPortfolio).
+"""
+import numpy as np
+
+from loguru import logger
+from pulp import LpStatusInfeasible, LpStatusNotSolved, LpStatusOptimal, LpStatusUnbounded, LpStatusUndefined
+from scipy.optimize import Bounds, LinearConstraint, milp
+from scipy.sparse import csr_matrix, vstack
+from module.core.ModelReduction import ModelReduction
+from module.core.ModelScaling import ModelScaling
+from module.core.SolverPortfolio import SolverPortfolio
+from time import time
+
+# highspy (HiGHS' own Python API) is optional; it allows keeping a solver instance alive between solves
+try:
+	import highspy
+except ImportError:
+	highspy = None
+
+# Map between scipy.optimize.milp status codes and PuLP's status codes, so both backends share the same outputs
+scipy2pulp_status = {
+	0: LpStatusOptimal,
+	1: LpStatusOptimal,  # time or node limit reached with a feasible solution (same as PuLP's CBC)
+	2: LpStatusInfeasible,
+	3: LpStatusUnbounded,
+	4: LpStatusUndefined,
+}
+
+# Map between scipy.optimize.milp status codes and the status names reported by CBC
+scipy2real_status = {
+	0: 'Optimal',
+	1: 'Stopped on time',
+	2: 'Infeasible',
+	3: 'Unbounded',
+	4: 'Not Solved',
+}
+
+# Map between highspy's model status names and scipy.optimize.milp status codes
+highs2scipy_status = {
+	'kOptimal': 0,
+	'kTimeLimit': 1,
+	'kIterationLimit': 1,
+	'kSolutionLimit': 1,
+	'kObjectiveBound': 1,
+	'kObjectiveTarget': 1,
+	'kInfeasible': 2,
+	'kUnbounded': 3,
+	'kUnboundedOrInfeasible': 3,
+}
+
+
+class SparseMilp:
+	def __init__(self, name, persistent=False, reduce=False, scale=False):
+		self.name = name  # problem's name
+		self.persistent = persistent  # if True, the reduced/scaled problems and HiGHS instance are kept between solves
+		self.reduce = reduce  # if True, the problem is reduced (see ModelReduction) before being solved
+		self.scale = scale  # if True, the problem is scaled (see ModelScaling) before being solved
+		self.__highs = None  # HiGHS instance kept alive between solves, when persistent
+		self.__reduced = None  # reduced problem solved in place of this one, kept between solves when persistent
+		self.__scaled = None  # scaled problem solved in place of this one, kept between solves when persistent
+		# **************************************************************************************************************
+		#        STRUCTURE
+		# **************************************************************************************************************
+		self.columns = dict()  # variable block name -> array with the respective column indices
+		self.rows = dict()  # constraint block name -> (sense, array with the respective row indices)
+		self.n_cols = 0  # total number of columns (variables)
+		self.n_rows = dict(eq=0, ub=0)  # total number of equality and inequality (<=) rows
+		self.__lb = []  # lower bounds of each variable block
+		self.__ub = []  # upper bounds of each variable block
+		self.__integrality = []  # integrality flag of each variable block
+		self.__obj = []  # (columns, coefficients) pairs added to the objective function
+		self.__triplets = dict(eq=[], ub=[])  # (rows, columns, coefficients) of each sense
+		self.__rhs = dict(eq=[], ub=[])  # right-hand sides of each sense
+		# **************************************************************************************************************
+		#        ASSEMBLED ARRAYS
+		# **************************************************************************************************************
+		self.c = None  # objective function coefficients
+		self.lb = None  # variables' lower bounds
+		self.ub = None  # variables' upper bounds
+		self.integrality = None  # 1 for integer variables, 0 for continuous
+		self.A_eq = None  # equality constraints' matrix
+		self.b_eq = None  # equality constraints' right-hand side
+		self.A_ub = None  # inequality (<=) constraints' matrix
+		self.b_ub = None  # inequality (<=) constraints' right-hand side
+		self.start = None  # feasible values of all variables passed to the solver as a MIP start, if any
+		# **************************************************************************************************************
+		#        RESULTS
+		# **************************************************************************************************************
+		self.status = LpStatusNotSolved  # status of the solution, following PuLP's codes
+		self.status_real = None  # status reported by the solver itself (e.g. "Stopped on time")
+		self.message = None  # solver's message
+		self.objective_value = None  # optimal objective function value
+		self.x = None  # optimal variables' values
+		self.solved_by = None  # solver (portfolio configuration) whose solution was kept
+
+	def add_variables(self, name, size, lb=0.0, ub=np.inf, binary=False):
+		"""
+		Adds a block of variables to the problem. Given a list of names (e.g. one per BESS of a fleet), the blocks of
+		all names are added at once, as the rows of a 2D array of column indices.
+		:param name: name of the block of variables, or list of names of blocks with the same size
+		:type name: Union[str, list]
+		:param size: number of variables in the block (in each block)
+		:type size: int
+		:param lb: lower bound(s) of the variables
+		:type lb: Union[float, numpy.ndarray]
+		:param ub: upper bound(s) of the variables
+		:type ub: Union[float, numpy.ndarray]
+		:param binary: True if the variables are binary
+		:type binary: bool
+		:return: column indices of the block (one row per name, given a list of names)
+		:rtype: numpy.ndarray
+		"""
+		names = [name] if isinstance(name, str) else list(name)
+		idx = np.arange(self.n_cols, self.n_cols + len(names) * size).reshape(len(names), size)
+		self.n_cols += idx.size
+		for block_name, block_idx in zip(names, idx):
+			self.columns[block_name] = block_idx
+
+		if binary:
+			lb, ub = 0.0, 1.0
+		self.__lb.append(np.broadcast_to(np.asarray(lb, dtype=float), idx.size))
+		self.__ub.append(np.broadcast_to(np.asarray(ub, dtype=float), idx.size))
+		self.__integrality.append(np.full(idx.size, int(binary)))
+
+		return idx[0] if isinstance(name, str) else idx
+
+	def add_objective(self, cols, coefs):
+		"""
+		Adds the terms coefs * x[cols] to the objective function (to be minimized).
+		:param cols: column indices
+		:type cols: numpy.ndarray
+		:param coefs: coefficient(s) of each column
+		:type coefs: Union[float, numpy.ndarray]
+		:return: None
+		:rtype: None
+		"""
+		self.__obj.append((cols, np.broadcast_to(np.asarray(coefs, dtype=float), len(cols))))
+
+	def add_constraints(self, name, sense, terms, rhs, size=None):
+		"""
+		Adds a block of constraints sum(coefs * x[cols]) (== or <=) rhs to the problem.
+		Each term is a tuple (cols, coefs) with one column per row of the block, or (cols, coefs, rows) when the term
+		only applies to a subset of the block's rows (positions relative to the block).
+		:param name: name of the block of constraints
+		:type name: str
+		:param sense: 'eq' for equality constraints, 'ub' for "lower or equal" constraints
+		:type sense: str
+		:param terms: terms of the left-hand side
+		:type terms: list of tuple
+		:param rhs: right-hand side(s) of the constraints
+		:type rhs: Union[float, numpy.ndarray]
+		:param size: number of rows of the block; defaults to the number of columns in the first term
+		:type size: int
+		:return: row indices of the block
+		:rtype: numpy.ndarray
+		"""
+		size = len(terms[0][0]) if size is None else size
+		idx = np.arange(self.n_rows[sense], self.n_rows[sense] + size)
+		self.n_rows[sense] += size
+		self.rows[name] = (sense, idx)
+
+		for term in terms:
+			cols, coefs = term[0], term[1]
+			rows = idx if len(term) == 2 else idx[term[2]]
+			self.__triplets[sense].append((rows, cols, np.broadcast_to(np.asarray(coefs, dtype=float), len(cols))))
+		self.__rhs[sense].append(np.broadcast_to(np.asarray(rhs, dtype=float), size))
+
+		return idx
+
+	def assemble(self):
+		"""
+		Concatenates all blocks into the objective, bounds, integrality and constraint matrices.
+		:return: None
+		:rtype: None
+		"""
+		self.c = np.zeros(self.n_cols)
+		for cols, coefs in self.__obj:
+			np.add.at(self.c, cols, coefs)
+
+		self.lb = np.concatenate(self.__lb)
+		self.ub = np.concatenate(self.__ub)
+		self.integrality = np.concatenate(self.__integrality)
+		self.A_eq, self.b_eq = self.__assemble_sense('eq')
+		self.A_ub, self.b_ub = self.__assemble_sense('ub')
+
+	def load_arrays(self, c, lb, ub, integrality, A_eq, b_eq, A_ub, b_ub):
+		"""
+		Sets the problem directly from assembled arrays, as a single block of variables named "x".
+		:return: None
+		:rtype: None
+		"""
+		self.c, self.lb, self.ub, self.integrality = c, lb, ub, integrality
+		self.A_eq, self.b_eq, self.A_ub, self.b_ub = csr_matrix(A_eq), b_eq, csr_matrix(A_ub), b_ub
+		self.A_eq.sort_indices()
+		self.A_ub.sort_indices()
+		self.n_cols = len(c)
+		self.n_rows = dict(eq=self.A_eq.shape[0], ub=self.A_ub.shape[0])
+		self.columns = dict(x=np.arange(self.n_cols))
+
+	def __assemble_sense(self, sense):
+		"""
+		Builds the sparse matrix and right-hand side of all constraints of a given sense.
+		:param sense: 'eq' or 'ub'
+		:type sense: str
+		:return: constraints' matrix and right-hand side
+		:rtype: (scipy.sparse.csr_matrix, numpy.ndarray)
+		"""
+		triplets = self.__triplets[sense]
+		if not triplets:
+			return csr_matrix((0, self.n_cols)), np.zeros(0)
+
+		rows = np.concatenate([r for r, _, _ in triplets])
+		cols = np.concatenate([c for _, c, _ in triplets])
+		coefs = np.concatenate([v for _, _, v in triplets])
+		matrix = csr_matrix((coefs, (rows, cols)), shape=(self.n_rows[sense], self.n_cols))
+		# Canonical format (sorted indices, no duplicates) so the sparsity pattern can be compared between models;
+		# explicit zeros are kept on purpose, as a coefficient can be 0 in one run and not in the next
+		matrix.sum_duplicates()
+
+		return matrix, np.concatenate(self.__rhs[sense])
+
+	def has_same_structure(self, other):
+		"""
+		Checks if another problem has the same variables, constraints and sparsity pattern as this one.
+		:param other: the other problem
+		:type other: SparseMilp
+		:return: True if only the numeric data (costs, bounds, right-hand sides, coefficients) can differ
+		:rtype: bool
+		"""
+		if other.n_cols != self.n_cols or other.n_rows != self.n_rows:
+			return False
+		if not np.array_equal(other.integrality, self.integrality):
+			return False
+
+		return all(np.array_equal(getattr(other, m).indptr, getattr(self, m).indptr)
+		           and np.array_equal(getattr(other, m).indices, getattr(self, m).indices) for m in ('A_eq', 'A_ub'))
+
+	def update(self, other):
+		"""
+		Copies the numeric data of another problem with the same structure into this one.
+		Only the costs, bounds, right-hand sides and coefficients that actually changed are passed on to the HiGHS
+		instance kept alive, so the model does not have to be loaded again.
+		:param other: problem with the same structure (see has_same_structure) and the new data
+		:type other: SparseMilp
+		:return: number of values changed
+		:rtype: int
+		"""
+		changed_cost = np.flatnonzero(other.c != self.c)
+		changed_bounds = np.flatnonzero((other.lb != self.lb) | (other.ub != self.ub))
+		changed_rows = np.concatenate([np.flatnonzero(other.b_eq != self.b_eq),
+		                               self.n_rows['eq'] + np.flatnonzero(other.b_ub != self.b_ub)])
+		changed_coefs = {m: np.flatnonzero(getattr(other, m).data != getattr(self, m).data) for m in ('A_eq', 'A_ub')}
+
+		self.c, self.lb, self.ub = other.c, other.lb, other.ub
+		self.b_eq, self.b_ub = other.b_eq, other.b_ub
+		self.A_eq, self.A_ub = other.A_eq, other.A_ub
+		self.start = other.start
+
+		if self.__highs is not None:
+			h = self.__highs
+			if changed_cost.size:
+				h.changeColsCost(changed_cost.size, changed_cost.astype(np.int32), self.c[changed_cost])
+			if changed_bounds.size:
+				h.changeColsBounds(changed_bounds.size, changed_bounds.astype(np.int32),
+				                   self.lb[changed_bounds], self.ub[changed_bounds])
+			if changed_rows.size:
+				row_lower, row_upper = self.__row_bounds()
+				h.changeRowsBounds(changed_rows.size, changed_rows.astype(np.int32),
+				                   row_lower[changed_rows], row_upper[changed_rows])
+			for m, offset in (('A_eq', 0), ('A_ub', self.n_rows['eq'])):
+				matrix = getattr(self, m)
+				rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+				for k in changed_coefs[m]:
+					h.changeCoeff(int(offset + rows[k]), int(matrix.indices[k]), float(matrix.data[k]))
+
+		nr_changes = changed_cost.size + changed_bounds.size + changed_rows.size + \
+			sum(v.size for v in changed_coefs.values())
+		logger.debug(f' - model updated in place ({nr_changes} values changed)')
+
+		return nr_changes
+
+	def set_start(self, values, tol=1e-6):
+		"""
+		Sets a MIP start from the values of each block of variables. The start is only kept if it covers all variables
+		and satisfies all bounds, integrality and constraints of the assembled problem.
+		:param values: dictionary of variable block name -> values
+		:type values: dict
+		:param tol: absolute feasibility tolerance
+		:type tol: float
+		:return: True if the start was accepted
+		:rtype: bool
+		"""
+		self.start = None
+		if self.c is None:
+			self.assemble()
+		if any(name not in values or len(values[name]) != len(idx) for name, idx in self.columns.items()):
+			logger.debug(' - MIP start discarded: missing variables')
+			return False
+
+		x = np.zeros(self.n_cols)
+		for name, idx in self.columns.items():
+			x[idx] = values[name]
+
+		is_integer = self.integrality.astype(bool)
+		feasible = np.all(x >= self.lb - tol) and np.all(x <= self.ub + tol) \
+			and np.all(np.abs(x[is_integer] - np.round(x[is_integer])) <= tol) \
+			and np.all(np.abs(self.A_eq @ x - self.b_eq) <= tol) and np.all(self.A_ub @ x - self.b_ub <= tol)
+		if not feasible:
+			logger.debug(' - MIP start discarded: infeasible')
+			return False
+
+		x[is_integer] = np.round(x[is_integer])
+		self.start = np.clip(x, self.lb, self.ub)
+
+		return True
+
+	def __row_bounds(self):
+		"""
+		Returns the lower and upper bounds of all rows, equality rows first.
+		:return: rows' lower and upper bounds
+		:rtype: (numpy.ndarray, numpy.ndarray)
+		"""
+		row_lower = np.concatenate([self.b_eq, np.full(self.n_rows['ub'], -np.inf)])
+		row_upper = np.concatenate([self.b_eq, self.b_ub])
+
+		return row_lower, row_upper
+
+	def solve(self, time_limit=None, mip_rel_gap=None, cutoff=None, portfolio=None):
+		"""
+		Solves the problem with the HiGHS solver shipped with scipy.optimize.milp or, when a portfolio is given, races
+		several solvers/configurations in parallel processes (see SolverPortfolio) and keeps the first proven answer.
+		:param time_limit: solver's temporal limit, in seconds
+		:type time_limit: float
+		:param mip_rel_gap: solver's relative MIP gap tolerance
+		:type mip_rel_gap: float
+		:param cutoff: objective value above which solutions are discarded (only applied through highspy or CBC)
+		:type cutoff: float
+		:param portfolio: names of the configurations to race (see SolverPortfolio.portfolio_configurations)
+		:type portfolio: tuple of str
+		:return: status of the solution, following PuLP's codes
+		:rtype: int
+		"""
+		if self.c is None:
+			self.assemble()
+
+		if self.reduce and self.__solve_reduced(time_limit, mip_rel_gap, cutoff, portfolio):
+			return self.status
+		if self.scale and self.__solve_scaled(time_limit, mip_rel_gap, cutoff, portfolio):
+			return self.status
+
+		solve_t = time()
+		if portfolio:
+			race = SolverPortfolio(portfolio, time_limit, mip_rel_gap, cutoff)
+			status, x, fun, message = race.race(self)
+			self.solved_by = race.winner
+		# scipy.optimize.milp does not accept a MIP start, so highspy is used whenever there is one to pass on; without
+		# one, a fresh scipy HiGHS solves these MILPs about twice as fast as a HiGHS instance kept alive and updated
+		# (HiGHS restarts its branch and bound on each run anyway), so persistent problems only keep it for MIP starts
+		elif highspy is not None and self.start is not None:
+			status, x, fun, message = self.__solve_highspy(time_limit, mip_rel_gap, cutoff)
+			self.solved_by = 'HIGHS'
+		else:
+			status, x, fun, message = self.__solve_scipy(time_limit, mip_rel_gap)
+			self.solved_by = 'HIGHS'
+		self.__store_results(status, x, fun, message)
+		logger.debug(f' - {self.solved_by}: {message} ({time() - solve_t:.3f}s)')
+
+		return self.status
+
+	def __solve_reduced(self, time_limit, mip_rel_gap, cutoff, portfolio=None):
+		"""
+		Solves the reduced problem in place of this one and reconstructs the values of the original variables.
+		When persistent, the reduced problem of the previous solve is updated instead of replaced, if possible.
+		:return: False if the reduction found nothing to reduce or proved the problem infeasible (to be solved as is)
+		:rtype: bool
+		"""
+		reduce_t = time()
+		reduction = ModelReduction(self)
+		reduced = reduction.reduce()
+		if reduced is None or reduced.n_cols == self.n_cols:
+			return False
+		logger.debug(f' - model reduction ({time() - reduce_t:.3f}s)')
+
+		reduced.scale = self.scale
+		if self.persistent and self.__reduced is not None and self.__reduced.has_same_structure(reduced):
+			self.__reduced.update(reduced)
+		else:
+			self.__reduced = reduced
+		self.__reduced.start = None
+		if self.start is not None:
+			self.__reduced.set_start(dict(x=self.start[reduction.kept_cols]))
+		if cutoff is not None:
+			cutoff -= reduction.offset
+
+		self.__reduced.solve(time_limit, mip_rel_gap, cutoff, portfolio)
+		self.status = self.__reduced.status
+		self.solved_by = self.__reduced.solved_by
+		self.status_real = self.__reduced.status_real
+		self.message = self.__reduced.message
+		self.x = reduction.postsolve(self.__reduced.x) if self.__reduced.x is not None else None
+		self.objective_value = self.c @ self.x if self.x is not None else None
+
+		return True
+
+	def __solve_scaled(self, time_limit, mip_rel_gap, cutoff, portfolio=None):
+		"""
+		Solves the scaled problem in place of this one and unscales the values of the variables.
+		When persistent, the scaled problem of the previous solve is updated instead of replaced, if possible.
+		:return: True (the problem can always be scaled)
+		:rtype: bool
+		"""
+		scaling = ModelScaling(self)
+		scaled = scaling.scale()
+
+		if self.persistent and self.__scaled is not None and self.__scaled.has_same_structure(scaled):
+			self.__scaled.update(scaled)
+		else:
+			self.__scaled = scaled
+		self.__scaled.start = None
+		if self.start is not None:
+			self.__scaled.set_start(dict(x=scaling.scale_values(self.start)))
+		if cutoff is not None:
+			cutoff *= scaling.obj_scale
+
+		self.__scaled.solve(time_limit, mip_rel_gap, cutoff, portfolio)
+		self.status = self.__scaled.status
+		self.solved_by = self.__scaled.solved_by
+		self.status_real = self.__scaled.status_real
+		self.message = self.__scaled.message
+		self.x = scaling.unscale(self.__scaled.x) if self.__scaled.x is not None else None
+		self.objective_value = self.c @ self.x if self.x is not None else None
+
+		return True
+
+	def solve_relaxation(self, fixed=None):
+		"""
+		Solves the LP relaxation of the problem, optionally with the integer variables fixed to given values.
+		:param fixed: dictionary of variable block name -> values of the integer variables; None to relax them
+		:type fixed: dict
+		:return: status of the solution, following PuLP's codes
+		:rtype: int
+		"""
+		if self.c is None:
+			self.assemble()
+
+		lb, ub = self.lb, self.ub
+		if fixed is not None:
+			lb, ub = lb.copy(), ub.copy()
+			for name, idx in self.columns.items():
+				if self.integrality[idx].any():
+					lb[idx] = ub[idx] = np.round(fixed[name])
+
+		solve_t = time()
+		status, x, fun, message = self.__solve_scipy(None, None, lb, ub, np.zeros(self.n_cols))
+		self.__store_results(status, x, fun, message)
+		logger.debug(f' - HiGHS (LP): {message} ({time() - solve_t:.3f}s)')
+
+		return self.status
+
+	def __store_results(self, status, x, fun, message):
+		"""
+		Stores the results of a solve, converting scipy's status codes to PuLP's codes and to CBC's status names.
+		:return: None
+		:rtype: None
+		"""
+		self.message = message
+		self.status_real = scipy2real_status.get(status, 'Not Solved')
+		self.x = x
+		self.objective_value = fun if x is not None else None
+		if x is not None or status in (2, 3):
+			self.status = scipy2pulp_status.get(status, LpStatusUndefined)
+		else:
+			self.status = LpStatusNotSolved
+
+	def __solve_scipy(self, time_limit, mip_rel_gap, lb=None, ub=None, integrality=None):
+		"""
+		Solves the problem through scipy.optimize.milp (a new HiGHS instance per call). The bounds and integrality
+		can be replaced, e.g. to solve relaxations, without changing the problem itself.
+		:return: scipy's status code, variables' values, objective function value and solver's message
+		:rtype: (int, numpy.ndarray, float, str)
+		"""
+		options = dict(disp=False)
+		if time_limit is not None:
+			options['time_limit'] = time_limit
+		if mip_rel_gap is not None:
+			options['mip_rel_gap'] = mip_rel_gap
+
+		constraints = []
+		if self.A_eq.shape[0]:
+			constraints.append(LinearConstraint(self.A_eq, self.b_eq, self.b_eq))
+		if self.A_ub.shape[0]:
+			constraints.append(LinearConstraint(self.A_ub, -np.inf, self.b_ub))
+
+		lb = self.lb if lb is None else lb
+		ub = self.ub if ub is None else ub
+		integrality = self.integrality if integrality is None else integrality
+		res = milp(self.c, integrality=integrality, bounds=Bounds(lb, ub), constraints=constraints, options=options)
+
+		return res.status, res.x, res.fun, res.message
+
+	def __solve_highspy(self, time_limit, mip_rel_gap, cutoff=None):
+		"""
+		Solves the problem through highspy, loading the model only on the first call; later calls reuse the same
+		HiGHS instance, to which update() has already passed the changed values.
+		:return: scipy's status code, variables' values, objective function value and solver's message
+		:rtype: (int, numpy.ndarray, float, str)
+		"""
+		if self.__highs is None:
+			self.__highs = highspy.Highs()
+			self.__highs.setOptionValue('output_flag', False)
+			self.__highs.passModel(self.__highs_lp())
+
+		h = self.__highs
+		h.setOptionValue('time_limit', float(time_limit) if time_limit is not None else np.inf)
+		if mip_rel_gap is not None:
+			h.setOptionValue('mip_rel_gap', float(mip_rel_gap))
+		h.setOptionValue('objective_bound', float(cutoff) if cutoff is not None else np.inf)
+		if self.start is not None:
+			h.setSolution(self.n_cols, np.arange(self.n_cols, dtype=np.int32), self.start)
+		h.run()
+
+		model_status = h.getModelStatus()
+		message = h.modelStatusToString(model_status)
+		status = highs2scipy_status.get(model_status.name, 4)
+		info = h.getInfo()
+		x = np.array(h.getSolution().col_value) if info.primal_solution_status == 2 else None
+
+		return status, x, info.objective_function_value, message
+
+	def __highs_lp(self):
+		"""
+		Converts the assembled arrays into a highspy.HighsLp (rows: equality constraints first).
+		:return: linear problem in HiGHS' format
+		:rtype: highspy.HighsLp
+		"""
+		matrix = vstack([self.A_eq, self.A_ub]).tocsc()
+		row_lower, row_upper = self.__row_bounds()
+
+		lp = highspy.HighsLp()
+		lp.num_col_ = self.n_cols
+		lp.num_row_ = matrix.shape[0]
+		lp.col_cost_ = self.c
+		lp.col_lower_ = self.lb
+		lp.col_upper_ = self.ub
+		lp.row_lower_ = row_lower
+		lp.row_upper_ = row_upper
+		lp.a_matrix_.format_ = highspy.MatrixFormat.kColwise
+		lp.a_matrix_.start_ = matrix.indptr
+		lp.a_matrix_.index_ = matrix.indices
+		lp.a_matrix_.value_ = matrix.data
+		lp.integrality_ = [highspy.HighsVarType.kInteger if i else highspy.HighsVarType.kContinuous
+		                   for i in self.integrality]
+
+		return lp
+
+	def write(self, path):
+		"""
+		Writes the assembled problem to a compressed .npz file.
+		:param path: path of the file
+		:type path: str
+		:return: None
+		:rtype: None
+		"""
+		np.savez_compressed(path, c=self.c, lb=self.lb, ub=self.ub, integrality=self.integrality,
+		                    A_eq_data=self.A_eq.data, A_eq_indices=self.A_eq.indices, A_eq_indptr=self.A_eq.indptr,
+		                    b_eq=self.b_eq, A_ub_data=self.A_ub.data, A_ub_indices=self.A_ub.indices,
+		                    A_ub_indptr=self.A_ub.indptr, b_ub=self.b_ub)
+
+	def write_mps(self, path):
+		"""
+		Writes the assembled problem to a free format MPS file, with columns named C<index> and rows R<index> (equality
+		rows first), so solvers other than HiGHS can read it and their solutions can be mapped back to the columns.
+		:param path: path of the file
+		:type path: str
+		:return: None
+		:rtype: None
+		"""
+		n_eq = self.n_rows['eq']
+		n_rows = n_eq + self.n_rows['ub']
+		matrix = vstack([self.A_eq, self.A_ub]).tocsc()
+		rhs = np.concatenate([self.b_eq, self.b_ub])
+
+		lines = [f'NAME {self.name}', 'ROWS', ' N OBJ']
+		lines += [f' {"E" if i < n_eq else "L"} R{i}' for i in range(n_rows)]
+		lines.append('COLUMNS')
+		is_integer = False
+		for j in range(self.n_cols):
+			if bool(self.integrality[j]) != is_integer:
+				is_integer = not is_integer
+				lines.append(f" MARKER 'MARKER' '{'INTORG' if is_integer else 'INTEND'}'")
+			start, end = matrix.indptr[j], matrix.indptr[j + 1]
+			# Every column is listed at least once, through the objective
+			if self.c[j] or start == end:
+				lines.append(f' C{j} OBJ {self.c[j]:.17g}')
+			lines += [f' C{j} R{i} {v:.17g}' for i, v in zip(matrix.indices[start:end], matrix.data[start:end])]
+		if is_integer:
+			lines.append(" MARKER 'MARKER' 'INTEND'")
+
+		lines.append('RHS')
+		lines += [f' RHS R{i} {rhs[i]:.17g}' for i in np.flatnonzero(rhs)]
+
+		lines.append('BOUNDS')
+		for j, (lb, ub) in enumerate(zip(self.lb, self.ub)):
+			if lb == ub:
+				lines.append(f' FX BND C{j} {lb:.17g}')
+				continue
+			if lb == -np.inf:
+				lines.append(f' MI BND C{j}')
+			elif lb != 0:
+				lines.append(f' LO BND C{j} {lb:.17g}')
+			if ub != np.inf:
+				lines.append(f' UP BND C{j} {ub:.17g}')
+			elif self.integrality[j]:
+				lines.append(f' PL BND C{j}')
+		lines.append('ENDATA')
+
+		with open(path, 'w') as f:
+			f.write('\n'.join(lines) + '\n')
+
+	def values(self, name):
+		"""
+		Returns the solution values of a block of variables.
+		:param name: name of the block of variables
+		:type name: str
+		:return: solution values of the block, or NaN if no solution is available
+		:rtype: numpy.ndarray
+		"""
+		idx = self.columns[name]
+		if self.x is None:
+			return np.full(len(idx), np.nan)
+
+		return self.x[idx]
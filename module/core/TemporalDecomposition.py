@@ -0,0 +1,160 @@
+"""
+TemporalDecomposition class. Solves the rolling sequence of daily problems (each day starting from the previous day's
+final energy content and cumulative degradation) as blocks of consecutive days in parallel worker processes,
+iterating on the state at the blocks' boundaries until it matches the end of the previous block.
+"""
+import numpy as np
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+from loguru import logger
+from time import time
+
+# Tolerance used when comparing the states at the beginning of a day (SoC in %, degradation in kWh)
+state_tol = 1e-6
+
+
+class TemporalDecomposition:
+	def __init__(self, optimize, objective_function, nr_workers=None):
+		self.optimize = optimize  # function that runs a single day, with the same signature as main.optimize
+		self.objective_function = objective_function  # objective function chosen by the client
+		self.nr_workers = nr_workers or os.cpu_count()  # number of worker processes (and blocks of days)
+		self.iterations = 0  # number of iterations of the last run
+		self.solved_days = 0  # number of daily problems solved in the last run (>= number of days)
+
+	def run(self, problems, state):
+		"""
+		Solves all days. In the first iteration every block starts from the initial state; in each of the following
+		ones, the blocks whose initial state differs from the (predicted) final state of the previous block are solved
+		again, from that state. Within a block, a day whose initial state matches the one of the previous iteration
+		ends the block's solve, as the remaining days would not change. Block k is exact after at most k + 1
+		iterations, so the results always match those of the sequential chain (within state_tol).
+		:param problems: inputs of each day (settings, bess_asset, bess_asset2, milp_params, forecasts), in which the
+		state-dependent values (actualENom and the measured SoC) are replaced according to the state of each day
+		:type problems: list
+		:param state: initial state (SoC of each BESS in %, energy degraded so far in each BESS in kWh)
+		:type state: tuple
+		:return: result of each day (see solve_block)
+		:rtype: list
+		"""
+		run_t = time()
+		limits = np.linspace(0, len(problems), min(self.nr_workers, len(problems)) + 1).astype(int)
+		blocks = [problems[start:end] for start, end in zip(limits[:-1], limits[1:])]
+		starts = [state] * len(blocks)
+		results = [[] for _ in blocks]
+		self.iterations = self.solved_days = 0
+
+		# Non-daemonic workers, so that each one can still race a solver portfolio
+		with ProcessPoolExecutor(len(blocks)) as pool:
+			pending = list(range(len(blocks)))
+			while pending:
+				self.iterations += 1
+				futures = [pool.submit(solve_block, self.optimize, self.objective_function, blocks[k], starts[k],
+				                       [result['start'] for result in results[k]]) for k in pending]
+				solved = [future.result() for future in futures]
+				for k, block_results in zip(pending, solved):
+					results[k] = block_results + results[k][len(block_results):]
+					self.solved_days += len(block_results)
+
+				# Blocks whose initial state no longer matches the (predicted) end of the previous block
+				pending = []
+				for k in range(1, len(blocks)):
+					end = predicted_end(results[k - 1], starts[k - 1])
+					if not same_state(end, starts[k]):
+						starts[k] = end
+						pending.append(k)
+				logger.debug(f' - temporal decomposition: iteration {self.iterations}, {len(pending)} block(s) to '
+				             f'solve again')
+
+		logger.info(f' - temporal decomposition: {len(problems)} days in {len(blocks)} blocks, '
+		            f'{self.iterations} iteration(s), {self.solved_days} daily solves ({time() - run_t:.3f}s)')
+
+		return [result for block_results in results for result in block_results]
+
+
+def solve_block(optimize, objective_function, problems, state, previous=None):
+	"""
+	Solves a block of consecutive days sequentially, each one from the final state of the previous one (target of the
+	worker processes of the decomposition).
+	:param optimize: function that runs a single day, with the same signature as main.optimize
+	:type optimize: function
+	:param objective_function: objective function chosen by the client
+	:type objective_function: str
+	:param problems: inputs of each day of the block (see TemporalDecomposition.run)
+	:type problems: list
+	:param state: state at the beginning of the block
+	:type state: tuple
+	:param previous: states at the beginning of each day in the previous solve of the block, if any
+	:type previous: list
+	:return: for each day solved, a dictionary with its outputs, status, status reported by the solver, files' name,
+	solve time and states at its beginning ("start") and end ("state")
+	:rtype: list
+	"""
+	results = []
+	for d, (settings, bess_asset, bess_asset2, milp_params, forecasts) in enumerate(problems):
+		if previous and d < len(previous) and same_state(state, previous[d]):
+			break
+
+		soc, soc2, degraded, degraded2 = state
+		bess_asset = dict(bess_asset, actualENom=bess_asset['eNom'] - degraded)
+		bess_asset2 = dict(bess_asset2, actualENom=bess_asset2['eNom'] - degraded2)
+		solve_t = time()
+		problem = optimize(settings, bess_asset, bess_asset2, milp_params, {'bessSoC': soc}, {'bessSoC': soc2},
+		                   forecasts, objective_function)
+		results.append(dict(outputs=problem.outputs, stat=problem.stat, status_real=problem.status_real,
+		                    common_fname=problem.common_fname, time=time() - solve_t, start=state,
+		                    state=next_state(state, problem.outputs, bess_asset, bess_asset2)))
+		state = results[-1]['state']
+
+	return results
+
+
+def next_state(state, outputs, bess_asset, bess_asset2):
+	"""
+	State at the end of a day: SoC of each BESS (%, relative to its capacity after that day's degradation) and energy
+	degraded so far in each BESS (kWh). Days without outputs (not solved) leave the state unchanged.
+	:param state: state at the beginning of the day
+	:type state: tuple
+	:param outputs: outputs of the day, as in Optimizer.outputs
+	:type outputs: dict
+	:return: state at the end of the day
+	:rtype: tuple
+	"""
+	if not outputs:
+		return state
+
+	_, _, degraded, degraded2 = state
+	degraded += sum(entry['setpoint'] for entry in outputs['eDeg'])
+	degraded2 += sum(entry['setpoint'] for entry in outputs['eDeg2'])
+	soc = outputs['eBess'][-1]['setpoint'] / (bess_asset['eNom'] - degraded) * 100
+	soc2 = outputs['eBess2'][-1]['setpoint'] / (bess_asset2['eNom'] - degraded2) * 100
+
+	return soc, soc2, degraded, degraded2
+
+
+def predicted_end(results, start):
+	"""
+	Final state of a block if it started from "start" instead of the initial state of its last solve: the final SoC
+	of the last solve and the energy degraded during the block added to the new initial degradation. The cumulative
+	degradation of every block depends on all previous days, so this avoids propagating it one block per iteration;
+	it is exact when the block was last solved from "start".
+	:param results: results of the block's days (see solve_block)
+	:type results: list
+	:param start: initial state of the block
+	:type start: tuple
+	:return: final state of the block
+	:rtype: tuple
+	"""
+	solved_start, end = results[0]['start'], results[-1]['state']
+	if same_state(solved_start, start):
+		return end
+
+	return end[0], end[1], start[2] + end[2] - solved_start[2], start[3] + end[3] - solved_start[3]
+
+
+def same_state(state, other):
+	"""
+	Checks whether two states are equal, within state_tol.
+	:rtype: bool
+	"""
+	return all(abs(a - b) <= state_tol * max(1.0, abs(a), abs(b)) for a, b in zip(state, other))
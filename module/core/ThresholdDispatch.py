@@ -0,0 +1,317 @@
+"""
+ThresholdDispatch class. Real-time heuristic for the BESS dispatch problem with constant efficiencies: each BESS
+charges below and discharges above price thresholds derived from the market prices, its efficiencies and its
+degradation cost. The thresholds come from a Lagrangian (perfect-foresight) lower bound, computed first, so the
+optimality gap of the heuristic's schedule is always known.
+"""
+import numpy as np
+
+from loguru import logger
+from pulp import LpStatusInfeasible, LpStatusNotSolved, LpStatusOptimal
+from time import time
+
+# Tolerance used when checking the PCC and energy content limits
+feasibility_tol = 1e-7
+# Number of values tried for the multiplier of each BESS's energy content limits in each pass of the lower bound
+nr_multipliers = 7
+# Number of passes of the lower bound, each one on a narrower range around the best multipliers of the previous one
+nr_bound_passes = 4
+# Number of uniform shifts of the lower bound's multipliers (within +/- half the prices' range) dispatched; the
+# cheapest schedule is kept (the bound's multipliers ignore the energy content limits of each time step)
+nr_threshold_shifts = 4
+
+
+class ThresholdDispatch:
+	def __init__(self, name):
+		self.name = name  # problem's name
+		# **************************************************************************************************************
+		#        PROBLEM
+		# **************************************************************************************************************
+		self.dt = None  # time interval of each step, in hours
+		self.load = None  # inflexible load per time step (kW)
+		self.prices = None  # market prices per time step (€/kWh)
+		self.pcc_limit = None  # power limit that can be absorbed at the PCC (kW)
+		self.units = []  # parameters and price thresholds of each BESS (see add_unit)
+		# **************************************************************************************************************
+		#        RESULTS
+		# **************************************************************************************************************
+		self.columns = dict()  # variable block name -> array with the respective indices in x (as in SparseMilp)
+		self.status = LpStatusNotSolved  # status of the solution, following PuLP's codes
+		self.status_real = None  # status reported as by the solvers (here, "Heuristic" when a schedule was found)
+		self.message = None  # solver's message
+		self.objective_value = None  # objective function value of the heuristic's schedule
+		self.lower_bound = None  # lower bound of the optimal objective function value
+		self.gap = None  # relative gap between the heuristic's objective function value and the lower bound
+		self.x = None  # variables' values
+
+	def set_pcc(self, load, prices, pcc_limit, dt):
+		"""
+		Sets the inflexible load, the market prices and the PCC limit of the optimization horizon.
+		:param load: inflexible load per time step (kW)
+		:type load: Union[list, numpy.ndarray]
+		:param prices: market prices per time step (€/kWh)
+		:type prices: Union[list, numpy.ndarray]
+		:param pcc_limit: power limit that can be absorbed at the PCC (kW)
+		:type pcc_limit: float
+		:param dt: time interval of each step, in hours
+		:type dt: float
+		:return: None
+		:rtype: None
+		"""
+		self.load = np.asarray(load, dtype=float)
+		self.prices = np.asarray(prices, dtype=float)
+		self.pcc_limit = pcc_limit
+		self.dt = dt
+
+	def add_unit(self, bess, sfx, deg_weight):
+		"""
+		Adds a BESS to the problem. Must be called after set_pcc.
+		:param bess: the BESS configured
+		:type bess: module.tasks.BESS.BESS
+		:param sfx: suffix of the BESS's variables' names
+		:type sfx: str
+		:param deg_weight: cost of each kWh degraded (€/kWh)
+		:type deg_weight: float
+		:return: None
+		:rtype: None
+		"""
+		dt = self.dt
+		eff_ch, eff_disch = bess.const_eff_ch, bess.const_eff_disch
+		# Largest AC charge/discharge P, respecting the DC limits
+		p_ch = max(min(bess.p_ac_max_c, bess.p_dc_max_c / eff_ch), 0.0)
+		p_disch = max(min(bess.p_ac_max_d, bess.p_dc_max_d * eff_disch), 0.0)
+		# Degradation cost per kWh discharged at DC-side (multiplied by the step duration, as in the MILP's objective)
+		deg_cost = deg_weight * bess.deg_slope * dt
+
+		self.units.append(dict(
+			sfx=sfx, bess=bess, p_ch=p_ch, p_disch=p_disch, eff_ch=eff_ch, eff_disch=eff_disch, deg_weight=deg_weight,
+			deg_cost=deg_cost,
+		))
+
+	def solve(self):
+		"""
+		Computes the heuristic's schedule and the lower bound of the optimal objective function value.
+		:return: status of the solution, following PuLP's codes
+		:rtype: int
+		"""
+		solve_t = time()
+		self.lower_bound, multipliers = self.__lower_bound()
+		bound_t = time()
+		blocks, self.objective_value = None, np.inf
+		half_range = (self.prices.max() - self.prices.min()) / 2
+		for shift in np.concatenate(([0.0], np.linspace(-half_range, half_range, nr_threshold_shifts))):
+			candidate = self.__dispatch(multipliers + shift)
+			if candidate is None:
+				continue
+			objective_value = self.__objective_value(candidate)
+			if objective_value < self.objective_value:
+				blocks, self.objective_value = candidate, objective_value
+
+		if blocks is None:
+			self.status, self.status_real, self.message = LpStatusInfeasible, 'Infeasible', 'No feasible schedule found'
+			self.objective_value, self.x, self.gap = None, None, None
+			logger.debug(f' - threshold dispatch: {self.message} ({time() - solve_t:.3f}s)')
+			return self.status
+
+		T = len(self.load)
+		self.columns = {name: np.arange(b * T, (b + 1) * T) for b, name in enumerate(blocks)}
+		self.x = np.concatenate(list(blocks.values()))
+		self.gap = (self.objective_value - self.lower_bound) / max(abs(self.objective_value), feasibility_tol) \
+			if np.isfinite(self.lower_bound) else None
+		self.status, self.status_real = LpStatusOptimal, 'Heuristic'
+		gap = f'{self.gap:.2%}' if self.gap is not None else 'unknown'
+		self.message = f'Objective {self.objective_value:.4f}, lower bound {self.lower_bound:.4f} (gap {gap})'
+		logger.debug(f' - threshold dispatch: {self.message} ({time() - bound_t:.4f}s + {bound_t - solve_t:.4f}s '
+		             f'for the bound)')
+
+		return self.status
+
+	def __dispatch(self, multipliers):
+		"""
+		Dispatches all BESS following their price thresholds: a BESS charges when the price is below the value of the
+		stored kWh (minus the multiplier of its energy content limits) after charge losses, and discharges when the
+		price is above that value plus the degradation cost, after discharge losses. The set points of each BESS are
+		set for all time steps at once, within the PCC limits left by the previous BESS, and then cut where the BESS
+		gets full or empty (see _bounded_cumsum).
+		:param multipliers: multipliers of the energy content limits of each BESS (€/kWh), from the lower bound
+		:type multipliers: numpy.ndarray
+		:return: dictionary of variable block name -> values, or None if the PCC limit could not be respected
+		:rtype: dict
+		"""
+		T, dt = len(self.load), self.dt
+		# Discharge required to keep the absorption at the PCC within its limit
+		required = np.maximum(self.load - self.pcc_limit, 0.0)
+		headroom = self.pcc_limit - self.load  # charge P still allowed at the PCC
+		absorption = self.load.copy()  # discharge P still allowed at the PCC (no injection)
+
+		p_ch = np.zeros((len(self.units), T))
+		p_disch = np.zeros((len(self.units), T))
+		e_bess = np.zeros((len(self.units), T))
+		for i, (u, lam) in enumerate(zip(self.units, multipliers)):
+			bess = u['bess']
+			charging = (self.prices <= -lam * u['eff_ch']) & (required <= 0)
+			discharging = ~charging & ((self.prices >= (u['deg_cost'] - lam) / u['eff_disch']) | (required > 0))
+			increments = np.where(charging, np.clip(headroom, 0.0, u['p_ch']) * u['eff_ch'] * dt, 0.0) - \
+				np.where(discharging, np.clip(absorption, 0.0, u['p_disch']) / u['eff_disch'] * dt, 0.0)
+			e_bess[i] = _bounded_cumsum(bess.initial_e_bess, increments, max(bess.min_e_bess, 0.0), bess.max_e_bess)
+			stored = np.diff(e_bess[i], prepend=bess.initial_e_bess)
+			p_ch[i] = np.maximum(stored, 0.0) / (u['eff_ch'] * dt)
+			p_disch[i] = np.maximum(-stored, 0.0) * u['eff_disch'] / dt
+			headroom -= p_ch[i]
+			absorption -= p_disch[i]
+			required -= p_disch[i]
+
+		p_abs = self.load + np.sum(p_ch - p_disch, axis=0)
+		if np.any(required > feasibility_tol) or np.any(p_abs < -feasibility_tol):
+			return None
+
+		blocks = dict(p_abs=np.maximum(p_abs, 0.0), delta_pcc=np.ones(T))
+		for i, u in enumerate(self.units):
+			bess, sfx = u['bess'], u['sfx']
+			blocks[f'e_bess{sfx}'] = np.maximum(e_bess[i], 0.0)
+			blocks[f'e_deg{sfx}'] = bess.deg_slope * p_disch[i] / u['eff_disch'] * dt
+			blocks[f'max_e_bes{sfx}'] = np.full(T, max(float(bess.max_e_bess), 0.0))
+			blocks[f'min_e_bes{sfx}'] = np.full(T, max(float(bess.min_e_bess), 0.0))
+			blocks[f'p_ch{sfx}'] = p_ch[i]
+			blocks[f'p_disch{sfx}'] = p_disch[i]
+			blocks[f'delta_bess{sfx}'] = (p_ch[i] > 0).astype(float)
+
+		return blocks
+
+	def __objective_value(self, blocks):
+		"""
+		Objective function value of a schedule, as in the MILP: cost of the energy absorbed at the PCC and of the
+		energy degraded in the BESS.
+		:param blocks: dictionary of variable block name -> values
+		:type blocks: dict
+		:return: objective function value
+		:rtype: float
+		"""
+		return float(np.sum(self.prices * self.dt * blocks['p_abs']) +
+		             sum(np.sum(u['deg_weight'] * self.dt * blocks[f'e_deg{u["sfx"]}']) for u in self.units))
+
+	def __lower_bound(self):
+		"""
+		Lagrangian lower bound of the optimal objective function value: the energy content limits of each time step
+		are dropped (perfect foresight over the whole horizon) and the limits of the final energy content are
+		dualized, so the problem splits into one small continuous knapsack per time step (the BESS only share the PCC
+		limits). Any multipliers give a valid bound; the best among a few refined grids of multipliers is kept.
+		:return: lower bound (inf if the relaxation is infeasible) and the respective multipliers (€/kWh, per BESS)
+		:rtype: (float, numpy.ndarray)
+		"""
+		dt = self.dt
+		prices = self.prices[:, None] * dt
+		# Items per time step: AC charge and discharge P of each BESS (increasing/decreasing the PCC absorption)
+		caps = np.array([p for u in self.units for p in (u['p_ch'], u['p_disch'])])
+		signs = np.tile([1.0, -1.0], len(self.units))
+		# Multipliers' scale: value of one kWh stored, in the range of the prices corrected for the efficiencies
+		scale = max(np.abs(self.prices).max() / min(u['eff_ch'] * u['eff_disch'] for u in self.units), 1.0)
+		centers = np.zeros(len(self.units))
+		widths = np.full(len(self.units), scale)
+
+		best = -np.inf
+		for _ in range(nr_bound_passes):
+			grids = [np.linspace(c - w, c + w, nr_multipliers) for c, w in zip(centers, widths)]
+			multipliers = np.stack(np.meshgrid(*grids, indexing='ij'), axis=-1).reshape(-1, len(self.units))
+			bounds = self.__dual_function(multipliers, prices, caps, signs)
+			k = int(np.argmax(bounds))
+			if bounds[k] > best:
+				best, centers = bounds[k], multipliers[k]
+			widths = widths * 2 / (nr_multipliers - 1)
+
+		return float(best), centers
+
+	def __dual_function(self, multipliers, prices, caps, signs):
+		"""
+		Evaluates the Lagrangian dual function for several multipliers at once.
+		:param multipliers: one row of multipliers (€/kWh, one per BESS) per evaluation
+		:type multipliers: numpy.ndarray
+		:return: value of the dual function for each row of multipliers
+		:rtype: numpy.ndarray
+		"""
+		dt = self.dt
+		# Cost of each item (charge P, discharge P of each BESS) per kW, for each multiplier and time step
+		costs = []
+		for i, u in enumerate(self.units):
+			lam = multipliers[:, i][:, None, None]
+			costs.append(prices + lam * u['eff_ch'] * dt)
+			costs.append(-prices + (u['deg_cost'] - lam) * dt / u['eff_disch'])
+		costs = np.concatenate(costs, axis=-1)
+
+		# Items at their most favourable bound, then the cheapest moves that bring the PCC absorption within limits
+		values = np.where(costs < 0, caps, 0.0)
+		net = np.sum(signs * values, axis=-1)
+		lower = -self.load[None, :]
+		upper = (self.pcc_limit - self.load)[None, :]
+		excess = np.maximum(net - upper, 0.0)
+		shortage = np.maximum(lower - net, 0.0)
+		# Items able to lower the absorption: charge P at its upper bound or discharge P at 0 (and the reverse)
+		lowers = (signs > 0) == (costs < 0)
+		movable = np.where((excess > 0)[..., None], lowers, ~lowers) * caps
+		required = excess + shortage
+
+		marginal = np.where(movable > 0, np.abs(costs), np.inf)
+		order = np.argsort(marginal, axis=-1)
+		marginal = np.take_along_axis(marginal, order, axis=-1)
+		movable = np.take_along_axis(movable, order, axis=-1)
+		moved = np.clip(required[..., None] - (np.cumsum(movable, axis=-1) - movable), 0.0, movable)
+		adjustment = np.sum(moved * np.where(movable > 0, marginal, 0.0), axis=-1)
+		adjustment[required > np.sum(movable, axis=-1) + feasibility_tol] = np.inf
+
+		step_values = prices[:, 0] * self.load + np.sum(costs * values, axis=-1) + adjustment
+		# Dualized limits of the final energy content
+		constant = 0.0
+		for i, u in enumerate(self.units):
+			bess = u['bess']
+			lam = multipliers[:, i]
+			e_min = max(bess.min_e_bess, 0.0) - bess.initial_e_bess
+			e_max = bess.max_e_bess - bess.initial_e_bess
+			constant = constant - np.where(lam >= 0, lam * e_max, lam * e_min)
+
+		return np.sum(step_values, axis=-1) + constant
+
+	def values(self, name):
+		"""
+		Returns the solution values of a block of variables.
+		:param name: name of the block of variables
+		:type name: str
+		:return: solution values of the block, or NaN if no solution is available
+		:rtype: numpy.ndarray
+		"""
+		idx = self.columns[name]
+		if self.x is None:
+			return np.full(len(idx), np.nan)
+
+		return self.x[idx]
+
+
+def _bounded_cumsum(start, increments, lower, upper):
+	"""
+	Cumulative sum of the increments from a start value, cut at the lower and upper limits (an increment that would
+	cross a limit only reaches it). Within each run of increments of the same sign the sum is monotonic, so each run
+	is summed at once and cut at the limit it moves towards.
+	:param start: value before the first increment
+	:type start: float
+	:param increments: increment of each step
+	:type increments: numpy.ndarray
+	:param lower: lower limit (a start below it is kept until the first positive increment)
+	:type lower: float
+	:param upper: upper limit (a start above it is kept until the first negative increment)
+	:type upper: float
+	:return: value after each step
+	:rtype: numpy.ndarray
+	"""
+	values = np.empty(len(increments))
+	signs = np.sign(increments)
+	firsts = np.flatnonzero(np.diff(signs, prepend=np.nan) != 0)
+	value = start
+	for first, end in zip(firsts, np.append(firsts[1:], len(increments))):
+		run = value + np.cumsum(increments[first:end])
+		if signs[first] > 0:
+			run = np.minimum(run, max(upper, value))
+		else:
+			run = np.maximum(run, min(lower, value))
+		values[first:end] = run
+		value = run[-1]
+
+	return values
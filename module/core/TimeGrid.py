@@ -0,0 +1,94 @@
+"""
+TimeGrid class. Builds a non-uniform time grid over the requested (uniform) one: consecutive steps with the same
+forecasts are merged into a single, longer step, which leaves the optimum unchanged with static energy content limits,
+and, optionally, the steps past the first hours of the horizon are coarsened (lossy). The values of the merged steps
+are expanded back to the requested step afterwards.
+"""
+import numpy as np
+
+
+class TimeGrid:
+	def __init__(self, nr_steps, step_in_hours, fine_hours=None, coarse_step=None):
+		self.nr_steps = nr_steps  # number of steps of the requested grid
+		self.step_in_hours = step_in_hours  # time interval of each step of the requested grid, in hours
+		self.fine_hours = fine_hours  # hours kept at the requested step at the beginning of the horizon (None: lossless)
+		self.coarse_step = coarse_step  # time interval, in minutes, of the steps past fine_hours (lossy mode)
+		# **************************************************************************************************************
+		#        MERGED STEPS
+		# **************************************************************************************************************
+		self.starts = None  # first step (of the requested grid) of each merged step
+		self.counts = None  # number of steps (of the requested grid) in each merged step
+		self.durations = None  # time interval of each merged step, in hours
+		self.series = None  # values of each series per step of the requested grid, as passed to build
+
+	def build(self, *series):
+		"""
+		Merges the consecutive steps in which all series have the same values. In the lossy mode (fine_hours and
+		coarse_step set), the series are first averaged over windows of coarse_step past the first fine_hours.
+		:param series: values of each series per step of the requested grid (e.g. loads and market prices)
+		:type series: list
+		:return: values of each series per merged step
+		:rtype: list of numpy.ndarray
+		"""
+		self.series = series
+		values = np.column_stack([np.asarray(s, dtype=float)[:self.nr_steps] for s in series])
+		if self.fine_hours is not None and self.coarse_step:
+			first = min(int(round(self.fine_hours / self.step_in_hours)), self.nr_steps)
+			window = max(int(round(self.coarse_step / 60 / self.step_in_hours)), 1)
+			if first < self.nr_steps and window > 1:
+				edges = np.arange(first, self.nr_steps, window)
+				counts = np.diff(np.append(edges, self.nr_steps))
+				means = np.add.reduceat(values[first:], edges - first, axis=0) / counts[:, None]
+				values[first:] = np.repeat(means, counts, axis=0)
+
+		changes = np.any(values[1:] != values[:-1], axis=1)
+		self.starts = np.flatnonzero(np.concatenate(([True], changes)))
+		self.counts = np.diff(np.append(self.starts, self.nr_steps))
+		self.durations = self.counts * self.step_in_hours
+
+		return [values[self.starts, j] for j in range(values.shape[1])]
+
+	def reduce(self, varis):
+		"""
+		Takes the values of the first step of each merged step from values on the requested grid (e.g. a previous
+		solution, to be used as MIP start); shorter or longer values are repeated or truncated first.
+		:param varis: dictionary with the values of the decision variables, as in Optimizer.varis
+		:type varis: dict
+		:return: dictionary with the same structure, one value per merged step
+		:rtype: dict
+		"""
+		def sample(values):
+			values = np.asarray(values, dtype=float)
+			return list(np.resize(values, self.nr_steps)[self.starts]) if values.size else []
+
+		return {name: {s: sample(v) for s, v in values.items()} if isinstance(values, dict) else sample(values)
+		        for name, values in varis.items()}
+
+	def expand(self, varis, states, amounts):
+		"""
+		Expands the values of the merged steps to the requested grid: the amounts per step (e.g. energy degraded) are
+		split evenly among the steps merged, the states at the end of each step (e.g. energy content) are linearly
+		interpolated from the previous one (constant powers within a merged step) and all others are repeated.
+		:param varis: dictionary with the values of the decision variables, one per merged step, as in Optimizer.varis
+		:type varis: dict
+		:param states: names of the state variables -> value before the first step
+		:type states: dict
+		:param amounts: names of the amount variables
+		:type amounts: set
+		:return: dictionary with the same structure, one value per step of the requested grid
+		:rtype: dict
+		"""
+		position = (np.arange(self.nr_steps) - np.repeat(self.starts, self.counts) + 1) / \
+			np.repeat(self.counts, self.counts)
+
+		def expanded(name, values):
+			values = np.asarray(values, dtype=float)
+			if name in states:
+				previous = np.concatenate(([states[name]], values[:-1]))
+				return list(np.repeat(previous, self.counts) + position * np.repeat(values - previous, self.counts))
+			if name in amounts:
+				return list(np.repeat(values / self.counts, self.counts))
+			return list(np.repeat(values, self.counts))
+
+		return {name: {s: expanded(name, v) for s, v in values.items()} if isinstance(values, dict)
+		        else expanded(name, values) for name, values in varis.items()}
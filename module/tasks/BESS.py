@@ -5,10 +5,31 @@ import math
 import numpy as np
 import pandas as pd
 
+from collections import OrderedDict
 from helpers.dynamic_bess_helpers import *
 from loguru import logger
+from module.core.ResultCache import ResultCache
 from time import time
 
+# Parameters used by the optimization model; two BESS with equal values for all of them are interchangeable
+model_parameters = ('p_ac_min_c_1', 'p_ac_max_c_1', 'p_ac_min_c_2', 'p_ac_min_d_1', 'p_ac_max_d_1', 'p_ac_min_d_2',
+                    'p_ac_max_c', 'p_ac_max_d', 'p_dc_max_c', 'p_dc_max_d', 'max_e_bess', 'min_e_bess',
+                    'initial_e_bess', 'charge_slope', 'charge_origin', 'discharge_slope', 'discharge_origin',
+                    'v_nom_charge', 'v_nom_discharge', 'deg_slope', 'sl_eff_ch', 'or_eff_ch', 'sl_eff_disch',
+                    'or_eff_disch', 'const_eff_ch', 'const_eff_disch', 'eff_segments_ch', 'eff_segments_disch')
+
+# Immutable data of an asset ("bessAsset" keys), from which fitted_asset_data fits its values
+asset_data = ('testData', 'degCurve', 'eolCriterion')
+
+# Values fitted from the immutable data of the assets configured (see fitted_asset_data), by a canonical hash of that
+# data, from the least to the most recently used; at most fitted_cache_size are kept
+fitted_cache = OrderedDict()
+fitted_cache_size = 32
+
+# Canonical hash of the immutable data of the assets configured (see asset_data_key), by the identity of that data
+# (the objects are kept so that their ids are not reused), from the least to the most recently used
+asset_data_keys = OrderedDict()
+
 
 class BESS:
     def __init__(self):
@@ -97,6 +118,10 @@ class BESS:
         self.or_eff_disch = None  # origin of discharge eff. lin. (BES + inverter)
         self.const_eff_ch = None  # value of constant charge eff. (after cut value) (BES + inverter)
         self.const_eff_disch = None  # value of constant discharge eff. (after cut value) (BES + inverter)
+        self.nr_eff_segments = 2  # number of segments of the piecewise lin. of eff. curves (incl. the constant one)
+        self.eff_segments_ch = None  # (min P, max P, slope, origin) of each segment of DC charge P vs. AC P
+        self.eff_segments_disch = None  # (min P, max P, slope, origin) of each segment of DC discharge P vs. AC P
+        self.convex_eff = None  # Flag for modelling the piecewise lin. of eff. curves without segment binaries
 
     def configure(self, bess_asset, bess_soc, add_ons):
         """
@@ -163,19 +188,26 @@ class BESS:
         self.__is_constant_eff_applicable()
         self.const_eff_ch = self.bess_asset.get('chEff') / 100
         self.const_eff_disch = self.bess_asset.get('dischEff') / 100
+        self.nr_eff_segments = int(self.bess_tests.get('effSegments', 2)) if self.bess_tests is not None else 2
+        self.eff_segments_ch = None
+        self.eff_segments_disch = None
+
+        # Values fitted from the test data and degradation curve, which do not change from day to day
+        fitted = fitted_asset_data(self.bess_asset, self.key2test_value)
 
         # Calculate the degradation slope when data is provided or assign default value
         logger.debug(f'- parsing degradation curve')
         self.capacity_loss = 100 - self.degradation_level
         if self.deg_curve is not None:
-            self.deg_slope = deg_curve_linearization(pd.DataFrame(self.deg_curve), self.capacity_loss)
+            self.deg_slope = fitted['deg_slope']
         else:
             self.deg_slope = self.default_deg_slope
 
         # Check for test data in the input data provided
         if self.bess_tests is not None:
             logger.debug(f' - parsing test data')
-            self.__read_tests()
+            self.__read_tests(fitted)
+            self.__check_eff_segments()
             logger.debug(f'Configuring BESS asset ... OK! ({time() - config_t:.3f}s)')
             return True
 
@@ -183,35 +215,60 @@ class BESS:
         else:
             logger.debug(f' - no test data available; linearizing efficiency curves')
             self.__basic_linear_eff()
+            self.__check_eff_segments()
             logger.debug(f'Configuring BESS asset ... OK! ({time() - config_t:.3f}s)')
             return False
 
-    def __read_tests(self):
+    def is_identical_to(self, other):
+        """
+        Checks if another configured BESS has the same values for all parameters used by the optimization model
+        (including the initial energy content), i.e., if both BESS are interchangeable in the model
+        :param other: another configured BESS
+        :type other: BESS
+        :return: True if all model parameters are equal
+        :rtype: bool
+        """
+        for parameter in model_parameters:
+            value, other_value = getattr(self, parameter), getattr(other, parameter)
+            if value is None or other_value is None:
+                if value is not other_value:
+                    return False
+            elif isinstance(value, list):
+                if len(value) != len(other_value) or not np.allclose(value, other_value, rtol=1e-9, atol=1e-12):
+                    return False
+            elif not math.isclose(value, other_value, rel_tol=1e-9, abs_tol=1e-12):
+                return False
+
+        return True
+
+    def __read_tests(self, fitted):
         """
         Function for reading and parsing information regarding the BESS's test sets' data
+        :param fitted: values fitted from the test data (see fitted_asset_data)
+        :type fitted: dict
         :return: None
         :rtype: None
         """
         ############################################################################################################
         #                                      DYNAMIC SOC LIMITS												   #
         ############################################################################################################
-        # For each set of tests check if the same c-rate was tested in different trial runs and, if so, averages
-        tests_dups_avg = average_c_rates_dups(self.bess_tests, self.key2test_value)
+        # For each set of tests, the same c-rates tested in different trial runs averaged
+        tests_dups_avg = fitted['tests']
 
         # If global flag for addOnSoc is set, validate BESS's vNomC, vNomD, cLim and dLim test sets
         if self.add_ons['addOnSoc']:
             # Find nominal charge voltage
-            self.__validate_vnomc(tests_dups_avg.get('vNomC'))
+            self.v_nom_charge = fitted['v_nom_charge']
             # Find nominal discharge voltage
-            self.__validate_vnomd(tests_dups_avg.get('vNomD'))
+            self.v_nom_discharge = fitted['v_nom_discharge']
             # Update max charge power rates at battery's end
             self.__max_charge_power(tests_dups_avg.get('vNomC'))
             # Update max discharge power rates at battery's end
             self.__max_discharge_power(tests_dups_avg.get('vNomD'))
             # Check maximum energy content values per C-rate
-            self.__validate_clim(tests_dups_avg.get('cLim'))
+            self.__validate_clim(fitted['c_lim'])
             # Check minimum energy content values per C.rate
-            self.__validate_dlim(tests_dups_avg.get('dLim'))
+            self.__validate_dlim(fitted['d_lim'])
 
         ############################################################################################################
         #                                      		EFFICIENCIES												   #
@@ -224,30 +281,6 @@ class BESS:
         elif bool(tests_dups_avg.get('roundEffApprox')):
             self.__roundtrip_linear_eff(tests_dups_avg)
 
-    def __validate_vnomc(self, test_data):
-        """
-        Function for validating vNomC (Nominal Charge Voltage) data from the tests
-        Nominal voltage is calculated as the average of the average voltage values retrieved for charging
-        the BESS at several previously defined C-rates, usually between 0 and the maximum C-rate admissible.
-        :param test_data: dataframe of "vNomC" structure
-        :type test_data: pandas.core.frame.DataFrame of float
-        :return: None
-        :rtype: None
-        """
-        self.v_nom_charge = test_data.get(self.key2test_value.get('vNomC')).mean()
-
-    def __validate_vnomd(self, test_data):
-        """
-        Function for validating vNomD (Nominal Discharge Voltage) data from the tests
-        Nominal voltage is calculated as the average of the average voltage values retrieved for discharging
-        the BESS at several previously defined C-rates, usually between 0 and the maximum C-rate admissible.
-        :param test_data: dataframe of "vNomD" structure
-        :type test_data: pandas.core.frame.DataFrame of float
-        :return: None
-        :rtype: None
-        """
-        self.v_nom_discharge = test_data.get(self.key2test_value.get('vNomD')).mean()
-
     def __max_charge_power(self, test_data):
         """
         Function for updating the batteries maximum charge power rate, supported by the tests
@@ -270,38 +303,39 @@ class BESS:
         """
         self.p_dc_max_d = power_rate_limits(self.nominal_capacity, self.c_rate_max_disch, test_data, action='discharge')
 
-    def __validate_clim(self, test_data):
+    def __validate_clim(self, line):
         """
         Function for acquiring the line parameters for applying a dynamic SoC charging limit
-        :param test_data: dataframe of "cLim" structure
-        :type test_data: pandas.core.frame.DataFrame of float
+        :param line: slope and origin of the "cLim" structure's line, per unit (see fitted_asset_data)
+        :type line: (float, float)
         :return: None
         :rtype: None
         """
-        self.charge_slope, self.charge_origin = self.__validate_lim(test_data)
+        self.charge_slope, self.charge_origin = self.__validate_lim(line)
 
-    def __validate_dlim(self, test_data):
+    def __validate_dlim(self, line):
         """
         Function for acquiring the line parameters for applying a dynamic SoC discharging limit
-        :param test_data: dataframe of "dLim" structure
-        :type test_data: pandas.core.frame.DataFrame of float
+        :param line: slope and origin of the "dLim" structure's line, per unit (see fitted_asset_data)
+        :type line: (float, float)
         :return: None
         :rtype: None
         """
-        self.discharge_slope, self.discharge_origin = self.__validate_lim(test_data)
+        self.discharge_slope, self.discharge_origin = self.__validate_lim(line)
 
-    def __validate_lim(self, test_data):
+    def __validate_lim(self, line):
         """
-        Function for acquiring the line parameters for applying any dynamic SoC limit
-        :param test_data: dataframe of "dLim" or "cLim" structure
-        :type test_data: pandas.core.frame.DataFrame of float
+        Function for acquiring the line parameters for applying any dynamic SoC limit: the line fitted per unit
+        (energy fraction vs. C-rate) is scaled to the actual capacity (energy content in kWh vs. current in kA);
+        the least squares fit of the scaled data would give the same line
+        :param line: slope and origin of the "dLim" or "cLim" structure's line, per unit
+        :type line: (float, float)
         :return: line parameters
         :rtype: (float, float)
         """
-        test_data['cRate'] *= self.nominal_capacity
-        test_data['eRemain'] *= self.nominal_energy / 100
+        slope, origin = line
 
-        return linearize(test_data)
+        return slope * self.nominal_energy / self.nominal_capacity, origin * self.nominal_energy
 
     def __is_constant_eff_applicable(self):
         """
@@ -418,10 +452,12 @@ class BESS:
         power_rates.name = 'x'
         eff_times_power_rates.name = 'y'
         df_to_linearize = pd.concat([power_rates, eff_times_power_rates], axis=1)
-        slope, origin = efficiencies(df_to_linearize, cut_value, constant_eff)
+        fitted = segment_efficiencies(df_to_linearize, cut_value, constant_eff, max(self.nr_eff_segments - 1, 1))
+        slope, origin = fitted[0][2:]
 
         # Update cut value so that the constant efficiency is not exceeded for Pinv <= 0.1 Pinv,nom
-        new_cut_power = (constant_eff * cut_value - origin) / slope
+        last_slope, last_origin = fitted[-1][2:]
+        new_cut_power = (constant_eff * cut_value - last_origin) / last_slope
         if test_values.name == 'effChAvg':
             self.p_ac_max_c_1 = new_cut_power
             self.p_ac_min_c_2 = new_cut_power
@@ -434,8 +470,61 @@ class BESS:
             self.p_ac_max_d_1 = new_cut_power
             self.p_ac_min_d_2 = new_cut_power
 
+        # Segments of the DC power as a function of the AC power, up to the maximum AC power rates
+        if test_values.name in ('effChAvg', 'roundEffAvg'):
+            self.eff_segments_ch = self.__eff_segments(fitted, self.p_ac_min_c_1, new_cut_power, self.p_ac_max_c,
+                                                       constant_eff)
+        if test_values.name in ('effDchAvg', 'roundEffAvg'):
+            # The lines fitted for discharging give the AC power (efficiency times power) as a function of the DC power
+            inverse = [(low, high, 1 / line_slope, -line_origin / line_slope)
+                       for low, high, line_slope, line_origin in fitted]
+            self.eff_segments_disch = self.__eff_segments(inverse, self.p_ac_min_d_1, new_cut_power, self.p_ac_max_d,
+                                                          1 / constant_eff)
+
         return slope, origin
 
+    @staticmethod
+    def __eff_segments(fitted, p_min, p_cut, p_max, constant_slope):
+        """
+        Builds the segments of a piecewise linear DC(AC) power curve from the segments fitted before the cut value and
+        a last segment with constant efficiency, restricted to the admissible AC power rates
+        :param fitted: (min P, max P, slope, origin) of each segment fitted before the cut value
+        :type fitted: list of (float, float, float, float)
+        :param p_min: minimum AC power rate (kVA)
+        :type p_min: float
+        :param p_cut: AC power rate after which the efficiency is constant (kVA)
+        :type p_cut: float
+        :param p_max: maximum AC power rate (kVA)
+        :type p_max: float
+        :param constant_slope: DC power per AC power after the cut value
+        :type constant_slope: float
+        :return: (min P, max P, slope, origin) of each segment
+        :rtype: list of (float, float, float, float)
+        """
+        p_cut = min(max(p_cut, p_min), p_max)
+        segments = [(max(low, p_min), min(high, p_cut), slope, origin) for low, high, slope, origin in fitted
+                    if low < p_cut and high > p_min]
+        if p_cut < p_max or not segments:
+            segments.append((p_cut, p_max, constant_slope, 0.0))
+
+        return segments
+
+    def __check_eff_segments(self):
+        """
+        Assigns a single constant efficiency segment to the curves that were not linearized and checks if both curves
+        can be modelled without segment binaries, i.e., if the DC charge power is a concave function of the AC power
+        and the DC discharge power a convex one, both starting at the origin
+        :return: None
+        :rtype: None
+        """
+        if self.eff_segments_ch is None:
+            self.eff_segments_ch = [(self.p_ac_min_c_1, self.p_ac_max_c, self.const_eff_ch, 0.0)]
+        if self.eff_segments_disch is None:
+            self.eff_segments_disch = [(self.p_ac_min_d_1, self.p_ac_max_d, 1 / self.const_eff_disch, 0.0)]
+
+        self.convex_eff = is_convex_curve(self.eff_segments_ch, concave=True) and \
+            is_convex_curve(self.eff_segments_disch)
+
     def __basic_linear_eff(self):
         """
         Function for calculating the line parameters of BESSs' charge and discharge efficiency curves
@@ -486,3 +575,84 @@ class BESS:
     #
     # 	self.trap_left_q = np.sqrt(left_difference)
     # 	self.trap_right_q = np.sqrt(right_difference)
+
+
+def fitted_asset_data(bess_asset, key2test_value):
+    """
+    Returns the values fitted from the immutable data of a BESS asset (test data, degradation curve and EOL criterion),
+    which do not depend on its actual capacity: the test sets with the same C-rates averaged, the degradation slope,
+    the nominal (dis)charge voltages and the lines of the dynamic SoC limits per unit (energy fraction vs. C-rate).
+    The values are fitted once per asset and then kept, so configuring the same asset again (e.g. every day of a run,
+    with only its actual capacity and SoC changed) skips the fits; the values returned must not be modified.
+    :param bess_asset: main structure with BESS's characteristics ( = "bessAsset" structure)
+    :type bess_asset: dict
+    :param key2test_value: checkup dictionary relating the keys of a test set structure and the corresponding value key
+    :type key2test_value: dict of string
+    :return: dictionary with "tests", "deg_slope", "v_nom_charge", "v_nom_discharge", "c_lim" and "d_lim" (None when
+    the respective data is not provided)
+    :rtype: dict
+    """
+    test_data, deg_curve = bess_asset.get('testData'), bess_asset.get('degCurve')
+    key = asset_data_key(bess_asset)
+    fitted = fitted_cache.get(key)
+    if fitted is not None:
+        fitted_cache.move_to_end(key)
+        return fitted
+
+    fit_t = time()
+    fitted = dict(tests=None, deg_slope=None, v_nom_charge=None, v_nom_discharge=None, c_lim=None, d_lim=None)
+    if deg_curve is not None:
+        fitted['deg_slope'] = deg_curve_linearization(pd.DataFrame(deg_curve), 100 - bess_asset.get('eolCriterion'))
+    if test_data is not None:
+        tests = fitted['tests'] = average_c_rates_dups(test_data, key2test_value)
+        for name, attribute in (('vNomC', 'v_nom_charge'), ('vNomD', 'v_nom_discharge')):
+            if name in tests:
+                fitted[attribute] = tests[name].get(key2test_value.get(name)).mean()
+        for name, attribute in (('cLim', 'c_lim'), ('dLim', 'd_lim')):
+            if name in tests:
+                fitted[attribute] = linearize(tests[name].assign(eRemain=tests[name]['eRemain'] / 100))
+
+    fitted_cache[key] = fitted
+    while len(fitted_cache) > fitted_cache_size:
+        fitted_cache.popitem(last=False)
+    logger.debug(f' - asset data fitted ({time() - fit_t:.3f}s)')
+
+    return fitted
+
+
+def asset_data_key(bess_asset):
+    """
+    Returns the canonical hash of the immutable data of a BESS asset (see asset_data and ResultCache.key). Hashing the
+    test data and degradation curve takes milliseconds, so the hash is computed once per data objects and then found
+    by their identity (e.g. the same objects of the settings every day of a run); the objects must not be modified.
+    :param bess_asset: main structure with BESS's characteristics ( = "bessAsset" structure)
+    :type bess_asset: dict
+    :return: hexadecimal SHA-256 digest
+    :rtype: str
+    """
+    data = tuple(bess_asset.get(name) for name in asset_data)
+    identity = tuple(map(id, data))
+    found = asset_data_keys.get(identity)
+    if found is not None and all(kept is value for kept, value in zip(found[0], data)):
+        asset_data_keys.move_to_end(identity)
+        return found[1]
+
+    key = ResultCache.key(*data)
+    asset_data_keys[identity] = (data, key)
+    while len(asset_data_keys) > fitted_cache_size:
+        asset_data_keys.popitem(last=False)
+
+    return key
+
+
+def key_asset(bess_asset):
+    """
+    Returns the asset as an input of a canonical hash (e.g. the result cache's key, see main.cached_run): its immutable
+    data replaced by their hash, which is only computed the first time (see asset_data_key).
+    :param bess_asset: main structure with BESS's characteristics ( = "bessAsset" structure)
+    :type bess_asset: dict
+    :return: the asset, without its immutable data but with their hash
+    :rtype: dict
+    """
+    return dict({name: value for name, value in bess_asset.items() if name not in asset_data},
+                data=asset_data_key(bess_asset))
@@ -3,21 +3,78 @@ EDIT HERE your settings for running "run.py"
 - final_outputs_file -> name of the .csv file to store the outputs; saved in the same folder as "run.py"
 - add_on_inv ---------> set True to consider the two-step approach for estimating overall efficiency; False for constant
 - add_on_soc ---------> set True to consider dynamic SoC limits; False for static
+- eff_segments -------> number of segments of the piecewise linear efficiency curves (add_on_inv), incl. the constant one
 - all_days -----------> options: from range (0, 1) to range (0, 365) and between
+- annual_lp ----------> set True to solve all_days as a single LP (binaries relaxed, HiGHS), split back into days
+- parallel_days ------> number of worker processes solving blocks of all_days in parallel (1 for the sequential loop)
+- representative_days > number of clusters (k-medoids) of all_days by price and load profiles; only each cluster's
+                        medoid is solved, its set points repeated for the other days of the cluster (0 to solve all)
+- mpc ----------------> set True to re-plan at every step over a receding horizon, committing only its first step
+- look_ahead ---------> hours solved beyond horizon in each day's window, whose plan seeds the next day (0 for none)
 - plot ---------------> set True to save plot of each days' forecasts and BESS set points
 - scale_pv -----------> Installed pv capacity [kW]
 - scale_inflex -------> Maximum demand capacity [kW]
 - pcc_limit_value ----> a maximum power limit at the connection to the grid, in kW
 - init_dt ------------> datetime at the beginning of the optimization horizon ("dd/mm/yyyy  HH:MM:SS")
+- solver -------------> 'CBC' (PuLP model), 'HIGHS' (vectorized sparse model solved by scipy's HiGHS), 'DP'
+                        (dynamic programming over a discretized SoC grid; constant efficiencies only) or 'THRESHOLD'
+                        (price-threshold heuristic reporting its optimality gap; constant efficiencies and static SoC
+                        limits only)
+- dp_resolution ------> DP: number of SoC grid steps covered by each BESS at full power in one time step
+- write_artifacts ----> set True to keep the model, solver files and outputs.json on disk; False for in-memory only
+- persistent_session -> set True to build the model once and only update the values that change between days
+- warm_start ---------> set True to use the previous day's solution, repaired for the new SoC, as MIP start
+- heuristic ----------> LP-rounding heuristic: None (off), 'incumbent' (MIP start and cutoff) or 'fast' (final result)
+- model_reduction ----> set True to remove fixed, defined and redundant variables/constraints before solving (HiGHS)
+- model_scaling ------> set True to scale the model's rows, columns and objective before solving
+- portfolio ----------> None, or solver configurations raced in parallel on each solve (e.g. ('HIGHS', 'CBC'))
+- unit_decomposition -> set True to solve by Lagrangian decomposition across the BESS (subproblems in parallel)
+- fleet_aggregation --> set True to solve clusters of similar BESS as virtual batteries (large fleets)
+- aggregation_tol ----> maximum relative difference between the parameters of BESS aggregated together
+- merge_steps --------> set True to merge consecutive steps with the same prices and loads (set points still per step)
+- fine_hours ---------> merge_steps: hours at the requested step before coarse_step is used (lossy); None to only merge
+- coarse_step --------> merge_steps: step in minutes past fine_hours (prices and loads averaged over each step)
+- result_cache -------> set True to reuse the results of runs with the same inputs instead of solving them again
+- cache_size ---------> result_cache: maximum number of results kept in memory (least recently used evicted)
+- cache_path ---------> result_cache: SQLite file where the results persist across restarts; None for memory only
+- similarity_index ---> set True to start each day from the schedule of the most similar day solved (MIP start and
+                        cutoff) instead of the previous day's
+- index_size ---------> similarity_index: maximum number of days kept (the oldest evicted)
 """
 
 class GeneralSettings:
     add_on_inv = False
     add_on_soc = False
+    eff_segments = 2  # convex curves are modelled without binaries per segment
     all_days = range(0, 1)
+    annual_lp = False  # relaxed benchmark: SoC chained across midnight, but no capacity fade between days
+    parallel_days = 1  # same results as the sequential loop; without warm start or persistent session within blocks
+    representative_days = 0  # overrides parallel_days; no capacity fade between days (as in annual_lp)
+    mpc = False  # closed loop with perfect tracking; with solver = 'HIGHS', only the changed values are updated
+    look_ahead = 0  # e.g. 24 solves 48 h windows and commits 24 h; sequential loop only
     plot = False
 
     # milp_params
+    solver = 'CBC'  # 'CBC', 'HIGHS', 'DP' or 'THRESHOLD'
+    dp_resolution = 12  # finer grids get closer to the MILP's optimum, but the work grows with resolution^4 (two BESS)
+    write_artifacts = False  # model/solution files are always written when the solver fails
+    persistent_session = False  # only effective with solver = 'HIGHS'; ~no gain measured on daily horizons
+    warm_start = False  # no gain measured on daily horizons (CBC ~10% slower); with 'HIGHS', requires highspy
+    heuristic = None  # None, 'incumbent' or 'fast'
+    model_reduction = True  # only effective with solver = 'HIGHS'
+    model_scaling = False  # with solver = 'CBC', CBC's geometric scaling is requested instead
+    portfolio = None  # overrides solver; see SolverPortfolio.portfolio_configurations for the available names
+    unit_decomposition = False  # a repaired schedule within mipgap is final; otherwise it seeds the whole MILP
+    fleet_aggregation = False  # not available with add_on_inv
+    aggregation_tol = 0.05
+    merge_steps = False  # exact with static SoC limits (add_on_soc off); not used with solver = 'DP' or 'THRESHOLD'
+    fine_hours = None
+    coarse_step = 60
+    result_cache = False  # the runs' inputs are hashed, so forecasts have to match exactly
+    cache_size = 128
+    cache_path = None  # e.g. 'results_cache.sqlite'
+    similarity_index = False  # an LP with the neighbour's binaries fixed is solved first, for the cutoff
+    index_size = 365
     mipgap = 0.001  # solver's tolerance
     timeout = 300  # time limit for solver (! does not consider time required for solving primal, relaxed, problem!)
     # WARNING: when choosing all_days with more than one day, don't change horizon = 24
@@ -123,6 +180,7 @@ class GeneralSettings:
                             "addOnSoc": add_on_soc,
                             'betterEffApprox': add_on_inv,
                             'roundEffApprox': add_on_inv,
+                            'effSegments': eff_segments,
                             "effD": [
                                 {"trial": 1, "cRate": 0.11, "effDchAvg": 99.14},
                                 {"trial": 1, "cRate": 0.19, "effDchAvg": 99.53},
@@ -262,6 +320,7 @@ class GeneralSettings:
                             "addOnSoc": add_on_soc,
                             'betterEffApprox': add_on_inv,
                             'roundEffApprox': add_on_inv,
+                            'effSegments': eff_segments,
                             "effD": [
                                 {"trial": 1, "cRate": 0.11, "effDchAvg": 99.14},
                                 {"trial": 1, "cRate": 0.19, "effDchAvg": 99.53},